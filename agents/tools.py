@@ -101,10 +101,11 @@ def to_openai_toolschema(tools: List[ToolSpec]) -> List[Dict[str, Any]]:
         for param_name, param in sig.parameters.items():
             if param.annotation != inspect.Parameter.empty:
 
-                param_type = type_mapping.get(param.annotation, "string")
+                # Generic aliases such as List[str] are looked up by their origin.
+                origin = get_origin(param.annotation)
+                param_type = type_mapping.get(origin or param.annotation, "string")
                 
                 if param_type == 'array':
-                    origin = get_origin(param.annotation)
                     args = get_args(param.annotation)
                     
                     if origin is list and args:
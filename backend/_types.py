@@ -15,6 +15,7 @@ MessageRoleLiteral = Literal['user', 'assistant']
 MessageContentType = Literal['text', 'image', 'file']
 CompletionActionLiteral = Literal['next', 'retry', 'variant']
 ConversationTypeLiteral = Literal['chat', 'recommendation']
+IngestionStageLiteral = Literal['analyze_result', 'pages', 'documents', 'embeddings']
 
 DepartmentsLiteral = Literal[
     'Common',
@@ -11,6 +11,8 @@ import backend.deps as dp
 import backend.models as mdl
 import backend.services.file as svc
 
+from backend.clients import ClientRegistry
+
 FILES = APIRouter(
     prefix=c.APIPrefix.FILES.value,
     tags=[c.APITag.FILES],
@@ -35,6 +37,7 @@ async def upload_file(
     request_id: Annotated[str, Depends(dp.generate_request_id)],
     session: Annotated[Session, Depends(dp.get_db)],
     user_profile: Annotated[mdl.User, Depends(dp.get_current_userprofile)],
+    clients: Annotated[ClientRegistry, Depends(dp.get_clients)],
 ) -> mdl.PostFileUploadResponse:
     """
     Upload a file to the server.
@@ -45,7 +48,7 @@ async def upload_file(
     file_size = file.size or -1
     file_content_type = file.content_type if file.content_type else "unknown"
 
-    err = await svc.upload_file(
+    is_duplicate, err = await svc.upload_file(
         file_id=file_id,
         filename=filename,
         file_size=file_size,
@@ -53,6 +56,7 @@ async def upload_file(
         file_stream=file.file,
         user_profile=user_profile,
         session=session,
+        clients=clients,
     )
     if err:
         raise HTTPException(
@@ -65,6 +69,7 @@ async def upload_file(
         message="File uploaded successfully.",
         request_id=request_id,
         file_id=file_id,
+        is_duplicate=is_duplicate,
     )
 
 
@@ -105,8 +110,12 @@ async def get_files(
     path="/{file_id}/vectorize",
     summary="Vectorize Files",
     response_model=mdl.PostVectorizeFilesResponse,
+    status_code=202,
     description="""
 This endpoint allows users to vectorize their uploaded files.
+
+The vectorization runs in the background. The response returns the id of the queued job,
+whose status can be polled with `GET /files/{file_id}/vectorize`.
 """
 )
 async def vectorize_files(
@@ -115,11 +124,11 @@ async def vectorize_files(
     session: Annotated[Session, Depends(dp.get_db)],
     user_profile: Annotated[mdl.User, Depends(dp.get_current_userprofile)],
 ) -> mdl.PostVectorizeFilesResponse:
-    err = await svc.vectorize_file(
+    job, err = svc.enqueue_vectorize(
         request_id=request_id,
         user_profile=user_profile,
         session=session,
-        file_id=file_id
+        file_id=file_id,
     )
     if err:
         raise HTTPException(
@@ -129,9 +138,43 @@ async def vectorize_files(
 
     return mdl.PostVectorizeFilesResponse(
         status="success",
-        message="File vectorization started successfully.",
+        message="File vectorization queued successfully.",
         request_id=request_id,
         file_id=file_id,
+        job_id=job.job_id,
+    )
+
+
+@FILES.get(
+    path="/{file_id}/vectorize",
+    summary="Get Vectorize Job",
+    response_model=mdl.GetVectorizeJobResponse,
+    description="""
+This endpoint returns the status of the vectorization job of a file.
+"""
+)
+async def get_vectorize_job(
+    file_id: str,
+    request_id: Annotated[str, Depends(dp.generate_request_id)],
+    session: Annotated[Session, Depends(dp.get_db)],
+    user_profile: Annotated[mdl.User, Depends(dp.get_current_userprofile)],
+) -> mdl.GetVectorizeJobResponse:
+    job, err = svc.get_vectorize_job(
+        user_profile=user_profile,
+        session=session,
+        file_id=file_id,
+    )
+    if err:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Error retrieving vectorization job: {err}"
+        )
+
+    return mdl.GetVectorizeJobResponse(
+        status="success",
+        message="Vectorization job retrieved successfully.",
+        request_id=request_id,
+        job=job,
     )
 
 
@@ -148,8 +191,9 @@ async def delete_file(
     request_id: Annotated[str, Depends(dp.generate_request_id)],
     session: Annotated[Session, Depends(dp.get_db)],
     user_profile: Annotated[mdl.User, Depends(dp.get_current_userprofile)],
+    clients: Annotated[ClientRegistry, Depends(dp.get_clients)],
 ) -> mdl.DeleteFilesByIDResponse:
-    err = await svc.delete_file(user_profile=user_profile, session=session, file_id=file_id)
+    err = await svc.delete_file(user_profile=user_profile, session=session, file_id=file_id, clients=clients)
     if err:
         raise HTTPException(
             status_code=500,
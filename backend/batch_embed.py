@@ -0,0 +1,528 @@
+""" Offline re-embedding of the document library, for bulk re-vectorization after an embedding model change.
+
+The chunks are already in the index, so re-vectorizing does not need OCR or tagging again. This tool
+collects the documents of many files from the `document` table, writes OpenAI Batch API request files,
+and bulk indexes the returned vectors into a new index, optionally swapping an alias onto it.
+Batch jobs have their own rate limits and the batch price, so they do not compete with interactive traffic.
+
+Usage:
+    python -m backend.batch_embed prepare --out batch/ --model text-embedding-3-large --dimensions 1024
+    python -m backend.batch_embed submit --out batch/
+    python -m backend.batch_embed collect --out batch/ --wait
+    python -m backend.batch_embed ingest --out batch/ --target-index document-v2 --alias document
+
+`prepare` writes `manifest.json` and `requests-NNNNN.jsonl` files, `collect` downloads
+`results-NNNNN.jsonl` (and `errors-NNNNN.jsonl`), and `ingest` writes the ids that failed to `failed.txt`.
+Documents written after `prepare` are embedded directly during `ingest`, before the alias swap.
+Near-duplicates linked to another document have no vector of their own, and are copied as they are.
+
+Without the Batch API, `sync` embeds the same documents with batched embeddings requests, at a low concurrency:
+    python -m backend.batch_embed sync --target-index document-v2 --model text-embedding-3-large --concurrency 1
+
+To test without the API, `stub` answers the request files with deterministic vectors in the Batch API output
+format, as `collect` would. `--base-url` points `submit` and `collect` at another server.
+    python -m backend.batch_embed stub --out batch/
+"""
+import argparse
+import asyncio
+import datetime as dt
+import hashlib
+import itertools
+import json
+import os
+from typing import Any, Iterator, List, Tuple
+
+import numpy as np
+
+from openai import AsyncOpenAI
+from pydantic import BaseModel, Field
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import backend.db.engine as db
+import backend.db.file_tables as tbl
+import backend.rag as rag
+import backend.utils.logger as lg
+
+from backend.clients import aopen_clients, aclose_clients
+from backend.config import CONFIG
+from backend.rag.models import DEFAULT_DIMENSIONS
+from backend.rag.tokenizer import count_tokens
+
+BATCH_ENDPOINT = "/v1/embeddings"
+MAX_REQUESTS_PER_FILE = 50_000
+MAX_BYTES_PER_FILE = 190 * 2**20
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchPart(BaseModel):
+    index: int = Field(
+        ...,
+        description="Number of the part, used in its file names."
+    )
+    count: int = Field(
+        default=0,
+        description="Number of requests in the request file."
+    )
+    batch_id: str | None = Field(
+        default=None,
+        description="Id of the Batch API job, once submitted."
+    )
+    status: str | None = Field(
+        default=None,
+        description="Last known status of the Batch API job."
+    )
+    collected: bool = Field(
+        default=False,
+        description="Whether the results of the job are downloaded."
+    )
+
+    @property
+    def requests_file(self) -> str:
+        return f"requests-{self.index:05d}.jsonl"
+
+    @property
+    def results_file(self) -> str:
+        return f"results-{self.index:05d}.jsonl"
+
+    @property
+    def errors_file(self) -> str:
+        return f"errors-{self.index:05d}.jsonl"
+
+
+class BatchManifest(BaseModel):
+    source_index: str = Field(
+        ...,
+        description="The index the documents are read from."
+    )
+    model: str = Field(
+        ...,
+        description="The embedding model of the requests."
+    )
+    dimensions: int | None = Field(
+        default=None,
+        description="The requested number of dimensions. None keeps the model default."
+    )
+    file_ids: List[str] = Field(
+        default_factory=list,
+        description="The files whose documents are embedded. Empty for every file."
+    )
+    prepared_at: dt.datetime = Field(
+        default_factory=dt.datetime.now,
+        description="When the documents were collected. Later writes are caught up during ingest."
+    )
+    skipped: List[str] = Field(
+        default_factory=list,
+        description="Documents left out because they exceed the input limit of the model."
+    )
+    linked: List[str] = Field(
+        default_factory=list,
+        description="Near-duplicate documents, indexed without a vector next to the document they are linked to."
+    )
+    parts: List[BatchPart] = Field(
+        default_factory=list,
+        description="The request files and their Batch API jobs."
+    )
+
+    @classmethod
+    def load(cls, out: str) -> "BatchManifest":
+        with open(os.path.join(out, "manifest.json"), "r", encoding="utf-8") as f:
+            return cls.model_validate_json(f.read())
+
+    def save(self, out: str) -> None:
+        path = os.path.join(out, "manifest.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.model_dump_json(indent=2))
+        os.replace(path + ".tmp", path)
+
+    def embedding_config(self, concurrency: int = 4) -> rag.EmbeddingConfig:
+        return rag.EmbeddingConfig(dimensions=self.dimensions, concurrency=concurrency)
+
+
+def _document_id_pages(
+    session: Session,
+    *,
+    file_ids: List[str],
+    page_size: int,
+) -> Iterator[List[str]]:
+    """ Yields the ids of the documents of live files, `page_size` at a time, file by file. """
+    query = (
+        select(tbl.Document.document_id)
+        .join(tbl.File, tbl.File.file_id == tbl.Document.file_id)
+        .where(tbl.File.is_deleted.is_(False))
+        .order_by(tbl.Document.file_id, tbl.Document.document_id)
+    )
+    if file_ids:
+        query = query.where(tbl.Document.file_id.in_(file_ids))
+
+    result = session.execute(query.execution_options(yield_per=page_size))
+    for partition in result.scalars().partitions(page_size):
+        yield list(partition)
+
+
+def _request_line(document: rag.Document, manifest: BatchManifest) -> str:
+    body: dict[str, Any] = {
+        "model": manifest.model,
+        "input": document.content,
+        "encoding_format": "float",
+    }
+    if manifest.dimensions is not None:
+        body["dimensions"] = manifest.dimensions
+    return json.dumps(
+        {"custom_id": document.document_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body},
+        ensure_ascii=False,
+    ) + "\n"
+
+
+def _read_results(path: str) -> Iterator[Tuple[str, List[float] | None, str | None]]:
+    """ Yields the document id, vector and error of each line of a Batch API output or error file. """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                error = item.get("error") or response.get("body", {}).get("error") or response
+                yield item["custom_id"], None, json.dumps(error, ensure_ascii=False)
+                continue
+            yield item["custom_id"], response["body"]["data"][0]["embedding"], None
+
+
+async def prepare(args: argparse.Namespace) -> None:
+    os.makedirs(args.out, exist_ok=True)
+    manifest = BatchManifest(
+        source_index=args.source_index,
+        model=args.model,
+        dimensions=args.dimensions,
+        file_ids=args.file_id or [],
+    )
+    max_input_tokens = rag.EmbeddingConfig().max_input_tokens
+
+    clients = await aopen_clients()
+    session = db.SessionLocal()
+    part: BatchPart | None = None
+    writer = None
+    written = 0
+    try:
+        source = await clients.vector_store(args.source_index)
+        for ids in _document_id_pages(session, file_ids=manifest.file_ids, page_size=args.page_size):
+            documents, err = await source.get_documents(ids)
+            if err:
+                raise err
+
+            for document in documents:
+                if document.duplicate_of:
+                    manifest.linked.append(document.document_id)
+                    continue
+                if count_tokens(document.content, manifest.model) > max_input_tokens:
+                    lg.logger.warning(f"Document {document.document_id} exceeds the input limit, skipping it")
+                    manifest.skipped.append(document.document_id)
+                    continue
+
+                line = _request_line(document, manifest).encode("utf-8")
+                if part is None or part.count >= MAX_REQUESTS_PER_FILE or written + len(line) > MAX_BYTES_PER_FILE:
+                    if writer is not None:
+                        writer.close()
+                    part = BatchPart(index=len(manifest.parts))
+                    manifest.parts.append(part)
+                    writer = open(os.path.join(args.out, part.requests_file), "wb")
+                    written = 0
+
+                writer.write(line)
+                written += len(line)
+                part.count += 1
+    finally:
+        if writer is not None:
+            writer.close()
+        session.close()
+        await aclose_clients()
+
+    manifest.save(args.out)
+    total = sum(part.count for part in manifest.parts)
+    lg.logger.info(
+        f"Wrote {total} requests in {len(manifest.parts)} files, "
+        f"skipped {len(manifest.skipped)}, linked {len(manifest.linked)}"
+    )
+
+
+async def submit(args: argparse.Namespace) -> None:
+    manifest = BatchManifest.load(args.out)
+    client = AsyncOpenAI(base_url=args.base_url)
+    try:
+        for part in manifest.parts:
+            if part.batch_id is not None:
+                continue
+            with open(os.path.join(args.out, part.requests_file), "rb") as f:
+                uploaded = await client.files.create(file=f, purpose="batch")
+            batch = await client.batches.create(
+                input_file_id=uploaded.id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window="24h",
+                metadata={"source_index": manifest.source_index, "part": str(part.index)},
+            )
+            part.batch_id, part.status = batch.id, batch.status
+            manifest.save(args.out)
+            lg.logger.info(f"Submitted {part.requests_file} as batch {batch.id}")
+    finally:
+        await client.close()
+
+
+async def collect(args: argparse.Namespace) -> None:
+    manifest = BatchManifest.load(args.out)
+    client = AsyncOpenAI(base_url=args.base_url)
+
+    async def download(file_id: str, name: str) -> None:
+        async with client.files.with_streaming_response.content(file_id) as resp:
+            with open(os.path.join(args.out, name), "wb") as f:
+                async for chunk in resp.iter_bytes():
+                    f.write(chunk)
+
+    try:
+        while True:
+            pending = [part for part in manifest.parts if part.batch_id and not part.collected]
+            for part in pending:
+                batch = await client.batches.retrieve(part.batch_id)
+                part.status = batch.status
+                if batch.status not in TERMINAL_STATUSES:
+                    continue
+
+                if batch.output_file_id:
+                    await download(batch.output_file_id, part.results_file)
+                if batch.error_file_id:
+                    await download(batch.error_file_id, part.errors_file)
+                part.collected = True
+                lg.logger.info(f"Batch {part.batch_id} of {part.requests_file} is {batch.status}")
+
+            manifest.save(args.out)
+            waiting = [part for part in manifest.parts if part.batch_id and not part.collected]
+            if not args.wait or not waiting:
+                break
+            lg.logger.info(f"Waiting for {len(waiting)} batches")
+            await asyncio.sleep(args.poll_interval)
+    finally:
+        await client.close()
+
+
+async def ingest(args: argparse.Namespace) -> None:
+    manifest = BatchManifest.load(args.out)
+    clients = await aopen_clients()
+    indexed = 0
+    failed: dict[str, str] = {
+        document_id: "Exceeds the input limit of the model." for document_id in manifest.skipped
+    }
+    try:
+        source = await clients.vector_store(manifest.source_index)
+        target = await clients.vector_store(
+            args.target_index,
+            embedding_model=manifest.model,
+            embedding_config=manifest.embedding_config(args.concurrency),
+            index_type=args.index_type,
+        )
+
+        dimensions = manifest.dimensions or DEFAULT_DIMENSIONS
+        for part in manifest.parts:
+            paths = [
+                os.path.join(args.out, name)
+                for name in (part.results_file, part.errors_file)
+                if os.path.exists(os.path.join(args.out, name))
+            ]
+            results = itertools.chain.from_iterable(_read_results(path) for path in paths)
+            while page := list(itertools.islice(results, args.page_size)):
+                vectors: dict[str, List[float]] = {}
+                for document_id, vector, error in page:
+                    if vector is None:
+                        failed[document_id] = error or "No vector."
+                    elif len(vector) != dimensions:
+                        failed[document_id] = f"Expected {dimensions} dimensions, got {len(vector)}."
+                    else:
+                        vectors[document_id] = vector
+
+                documents, err = await source.get_documents(list(vectors))
+                if err:
+                    raise err
+                success, err = await target.add_documents(documents, vectors=vectors)
+                if isinstance(err, rag.IndexingError):
+                    failed.update({document_id: str(exc) for document_id, exc in err.failures.items()})
+                elif err:
+                    raise err
+                indexed += len(success)
+            lg.logger.info(f"Ingested {part.results_file}, {indexed} documents indexed so far")
+
+        for start in range(0, len(manifest.linked), args.page_size):
+            documents, err = await source.get_documents(manifest.linked[start:start + args.page_size])
+            if err:
+                raise err
+            success, err = await target.add_documents(documents, vectors={})
+            if isinstance(err, rag.IndexingError):
+                failed.update({document_id: str(exc) for document_id, exc in err.failures.items()})
+            elif err:
+                raise err
+            indexed += len(success)
+
+        query: dict[str, Any] = {"range": {"updated_at": {"gte": manifest.prepared_at}}}
+        if manifest.file_ids:
+            query = {"bool": {"filter": [query, {"terms": {"file_meta.file_id": manifest.file_ids}}]}}
+        caught_up, late_failures = await source.copy_to(
+            target, re_embed=True, page_size=args.page_size, keep_alive="5m", query=query,
+        )
+        failed.update({document_id: str(exc) for document_id, exc in late_failures.items()})
+        lg.logger.info(f"Indexed {indexed} documents and {caught_up} late writes into {args.target_index}")
+
+        if failed:
+            with open(os.path.join(args.out, "failed.txt"), "w", encoding="utf-8") as f:
+                f.writelines(f"{document_id}\n" for document_id in failed)
+            lg.logger.error(
+                f"{len(failed)} documents failed, see failed.txt. Retry them with `sync --ids-file`. "
+                f"The alias is left untouched."
+            )
+        elif args.alias:
+            err = await target.swap_alias(args.alias)
+            if err:
+                raise err
+            lg.logger.info(f"Alias {args.alias} now points at {args.target_index}")
+    finally:
+        await aclose_clients()
+
+
+async def sync(args: argparse.Namespace) -> None:
+    clients = await aopen_clients()
+    session = db.SessionLocal()
+    indexed = 0
+    failed: List[str] = []
+    try:
+        source = await clients.vector_store(args.source_index)
+        target = await clients.vector_store(
+            args.target_index,
+            embedding_model=args.model,
+            embedding_config=rag.EmbeddingConfig(dimensions=args.dimensions, concurrency=args.concurrency),
+            index_type=args.index_type,
+        )
+
+        if args.ids_file:
+            with open(args.ids_file, "r", encoding="utf-8") as f:
+                ids = [line.strip() for line in f if line.strip()]
+            pages: Iterator[List[str]] = (
+                ids[start:start + args.page_size] for start in range(0, len(ids), args.page_size)
+            )
+        else:
+            pages = _document_id_pages(session, file_ids=args.file_id or [], page_size=args.page_size)
+
+        for ids in pages:
+            documents, err = await source.get_documents(ids)
+            if err:
+                raise err
+            success, err = await target.add_documents(documents)
+            if isinstance(err, rag.IndexingError):
+                failed.extend(err.failures)
+            elif err:
+                raise err
+            indexed += len(success)
+            lg.logger.info(f"{indexed} documents embedded and indexed into {args.target_index}")
+
+        if failed:
+            lg.logger.error(f"{len(failed)} documents failed: {failed[:20]}. The alias is left untouched.")
+        elif args.alias:
+            err = await target.swap_alias(args.alias)
+            if err:
+                raise err
+            lg.logger.info(f"Alias {args.alias} now points at {args.target_index}")
+    finally:
+        session.close()
+        await aclose_clients()
+
+
+def _stub_vector(text: str, dimensions: int) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+async def stub(args: argparse.Namespace) -> None:
+    """ Answers every request file like the Batch API would, with vectors seeded by the input text. """
+    manifest = BatchManifest.load(args.out)
+    for part in manifest.parts:
+        with open(os.path.join(args.out, part.requests_file), "r", encoding="utf-8") as src, \
+                open(os.path.join(args.out, part.results_file), "w", encoding="utf-8") as dst:
+            for number, line in enumerate(src):
+                request = json.loads(line)
+                body = request["body"]
+                vector = _stub_vector(body["input"], body.get("dimensions") or DEFAULT_DIMENSIONS)
+                dst.write(json.dumps({
+                    "id": f"batch_req_{part.index}_{number}",
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "request_id": f"stub-{part.index}-{number}",
+                        "body": {
+                            "object": "list",
+                            "data": [{"object": "embedding", "index": 0, "embedding": vector}],
+                            "model": body["model"],
+                            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                        },
+                    },
+                    "error": None,
+                }) + "\n")
+        part.batch_id = part.batch_id or f"stub-{part.index}"
+        part.status, part.collected = "completed", True
+    manifest.save(args.out)
+    lg.logger.info(f"Answered {sum(part.count for part in manifest.parts)} requests")
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def command(name: str, func, **kwargs) -> argparse.ArgumentParser:
+        sub = commands.add_parser(name, **kwargs)
+        sub.set_defaults(func=func)
+        return sub
+
+    def selection(sub: argparse.ArgumentParser) -> None:
+        sub.add_argument("--source-index", default="document")
+        sub.add_argument("--file-id", action="append", help="Only the documents of this file. Repeatable.")
+        sub.add_argument("--model", default="text-embedding-3-small")
+        sub.add_argument("--dimensions", type=int, default=None)
+        sub.add_argument("--page-size", type=int, default=500)
+
+    def indexing(sub: argparse.ArgumentParser) -> None:
+        sub.add_argument("--target-index", required=True)
+        sub.add_argument("--index-type", default=None, choices=["hnsw", "int8_hnsw", "int4_hnsw", "bbq_hnsw"])
+        sub.add_argument("--alias", default=None, help="Point this alias at the target index once every document is in.")
+        sub.add_argument("--concurrency", type=int, default=1, help="Embeddings requests in flight, outside the Batch API.")
+
+    sub = command("prepare", prepare, help="Write Batch API request files.")
+    sub.add_argument("--out", required=True)
+    selection(sub)
+
+    for name, func, description in (
+        ("submit", submit, "Upload the request files and create the batches."),
+        ("collect", collect, "Download the results of finished batches."),
+    ):
+        sub = command(name, func, help=description)
+        sub.add_argument("--out", required=True)
+        sub.add_argument("--base-url", default=None, help="OpenAI-compatible server, e.g. a local stub.")
+        if name == "collect":
+            sub.add_argument("--wait", action="store_true", help="Poll until every batch is finished.")
+            sub.add_argument("--poll-interval", type=float, default=60.0)
+
+    sub = command("ingest", ingest, help="Bulk index the collected vectors.")
+    sub.add_argument("--out", required=True)
+    sub.add_argument("--page-size", type=int, default=500)
+    indexing(sub)
+
+    sub = command("sync", sync, help="Embed and index with batched embeddings requests instead.")
+    sub.add_argument("--ids-file", default=None, help="Only these document ids, one per line, e.g. failed.txt.")
+    selection(sub)
+    indexing(sub)
+
+    sub = command("stub", stub, help="Answer the request files locally with deterministic vectors.")
+    sub.add_argument("--out", required=True)
+    return parser
+
+
+if __name__ == "__main__":
+    args = _parser().parse_args()
+    if CONFIG.VECTOR_STORE_BACKEND != "elasticsearch":
+        raise SystemExit("batch_embed reindexes Elasticsearch indices, it needs VECTOR_STORE_BACKEND=elasticsearch.")
+    asyncio.run(args.func(args))
@@ -0,0 +1,173 @@
+import asyncio
+
+import aiohttp
+import httpx
+
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.storage.blob.aio import ContainerClient
+from elasticsearch import AsyncElasticsearch
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+import backend.config as cfg
+import backend.rag as rag
+import backend.utils.logger as lg
+
+
+class ClientRegistry:
+    """ App-lifetime clients shared by every request.
+
+    Each client keeps a keep-alive connection pool sized by the config, so tool calls and
+    ingestion reuse connections instead of paying a TCP and TLS handshake per call.
+    Opened by the FastAPI lifespan hook and closed on shutdown, see `aopen_clients` and `aclose_clients`.
+    """
+
+    def __init__(
+        self,
+        *,
+        vector_client: AsyncElasticsearch,
+        openai: AsyncOpenAI,
+        container_client: ContainerClient,
+        embedding_cache: rag.AsyncCacheService,
+        ocr_cache: rag.OcrResultCache | None = None,
+        vector_backend: str = "elasticsearch",
+        snapshot_dir: str | None = None,
+    ) -> None:
+        self.vector_client = vector_client
+        self.openai = openai
+        self.container_client = container_client
+        self.embedding_cache = embedding_cache
+        self.ocr_cache = ocr_cache
+        self.vector_backend = vector_backend
+        self.snapshot_dir = snapshot_dir
+        self._numpy_stores: dict[str, rag.NumpyVectorStore[rag.Document]] = {}
+
+    @classmethod
+    def from_config(cls, config: cfg.Config = cfg.CONFIG) -> "ClientRegistry":
+        """ Builds the clients from the config. Must be called inside a running event loop. """
+        vector_client = AsyncElasticsearch(
+            hosts=config.ELASTICSEARCH_HOSTS,
+            api_key=config.ELASTICSEARCH_API_KEY,
+            connections_per_node=config.ELASTICSEARCH_CONNECTIONS_PER_NODE,
+            request_timeout=config.ELASTICSEARCH_TIMEOUT,
+            retry_on_timeout=True,
+        )
+        openai = AsyncOpenAI(
+            timeout=config.OPENAI_TIMEOUT,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=config.OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=config.OPENAI_MAX_CONNECTIONS,
+                ),
+            ),
+        )
+        container_client = ContainerClient.from_connection_string(
+            config.BLOB_CONNECTION_STRING,
+            config.BLOG_CONTAINER_NAME,
+            transport=AioHttpTransport(
+                session=aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit=config.BLOB_MAX_CONNECTIONS),
+                ),
+                session_owner=True,
+            ),
+            read_timeout=config.BLOB_TIMEOUT,
+        )
+        embedding_cache = rag.AsyncCacheService(
+            persist_path=config.EMBEDDING_CACHE_PATH or None,
+        )
+        ocr_cache = rag.OcrResultCache(config.OCR_CACHE_DIR) if config.OCR_CACHE_DIR else None
+        return cls(
+            vector_client=vector_client,
+            openai=openai,
+            container_client=container_client,
+            embedding_cache=embedding_cache,
+            ocr_cache=ocr_cache,
+            vector_backend=config.VECTOR_STORE_BACKEND,
+            snapshot_dir=config.NUMPY_SNAPSHOT_DIR or None,
+        )
+
+    async def vector_store(
+        self,
+        indexname: str = "document",
+        *,
+        embedding_model: str = "text-embedding-3-small",
+        embedding_config: rag.EmbeddingConfig | None = None,
+        index_type: rag.VectorIndexTypeLiteral | None = None,
+    ) -> rag.BaseVectorStore[rag.Document]:
+        """ Returns a vector store of `rag.Document` over the shared clients, on the `vector_backend`.
+        With the 'numpy' backend, the store of each index lives as long as the registry, since it holds
+        the documents in memory, and `index_type` is ignored.
+        """
+        if self.vector_backend == "numpy":
+            store = self._numpy_stores.get(indexname)
+            if store is None:
+                store = await rag.NumpyVectorStore.create(
+                    embedding_service=self.openai,
+                    cache_service=self.embedding_cache,
+                    indexname=indexname,
+                    document_class=rag.Document,
+                    embedding_model=embedding_model,
+                    embedding_config=embedding_config,
+                    snapshot_dir=self.snapshot_dir,
+                )
+                store = self._numpy_stores.setdefault(indexname, store)
+            return store
+
+        return await rag.VectorStore.create(
+            vector_client=self.vector_client,
+            embedding_service=self.openai,
+            cache_service=self.embedding_cache,
+            indexname=indexname,
+            document_class=rag.Document,
+            embedding_model=embedding_model,
+            embedding_config=embedding_config,
+            index_type=index_type,
+        )
+
+    async def aclose(self) -> None:
+        results = await asyncio.gather(
+            self.vector_client.close(),
+            self.openai.close(),
+            self.container_client.close(),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                lg.logger.error(f"Error closing client: {result}")
+        self.embedding_cache.close()
+        for store in self._numpy_stores.values():
+            if store.snapshot_dir:
+                err = store.snapshot()
+                if err:
+                    lg.logger.error(f"Error snapshotting index {store.indexname}: {err}")
+
+
+_clients: ClientRegistry | None = None
+_clients_lock = asyncio.Lock()
+
+
+async def aopen_clients(config: cfg.Config = cfg.CONFIG) -> ClientRegistry:
+    """ Opens the process-wide registry, or returns it if already open. """
+    global _clients
+    async with _clients_lock:
+        if _clients is None:
+            _clients = ClientRegistry.from_config(config)
+            lg.logger.info("Client registry opened")
+    return _clients
+
+
+async def aclose_clients() -> None:
+    """ Closes the process-wide registry, if open, and the process pool. """
+    global _clients
+    async with _clients_lock:
+        if _clients is not None:
+            await _clients.aclose()
+            _clients = None
+            lg.logger.info("Client registry closed")
+    rag.shutdown_process_pool()
+
+
+async def get_clients() -> ClientRegistry:
+    """ Returns the process-wide registry, opening it on first use outside of the app lifespan. """
+    if _clients is not None:
+        return _clients
+    return await aopen_clients()
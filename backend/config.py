@@ -1,4 +1,6 @@
 import os
+from typing import Literal
+
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
 
@@ -48,8 +50,122 @@ class Config(BaseModel):
         os.getenv("OCR_API_KEY", "asdf"),
         description="API key for the Azure OCR service."
     )
+    VECTOR_STORE_BACKEND: Literal['elasticsearch', 'numpy'] = Field(
+        os.getenv("VECTOR_STORE_BACKEND", "elasticsearch"),  # type: ignore
+        description=(
+            "Backend of the vector stores. 'numpy' keeps every index in process memory, "
+            "so it only suits a single process running the API and the ingestion worker, e.g. small tenants and CI."
+        )
+    )
+    NUMPY_SNAPSHOT_DIR: str = Field(
+        os.getenv("NUMPY_SNAPSHOT_DIR", ""),
+        description="Directory the 'numpy' backend loads its indices from and snapshots them to on shutdown. Empty to keep them in memory only."
+    )
     ELASTICSEARCH_HOSTS: str = Field()
     ELASTICSEARCH_API_KEY: str = Field()
+    ELASTICSEARCH_CONNECTIONS_PER_NODE: int = Field(
+        int(os.getenv("ELASTICSEARCH_CONNECTIONS_PER_NODE", "20")),
+        description="Size of the keep-alive connection pool per Elasticsearch node."
+    )
+    ELASTICSEARCH_TIMEOUT: float = Field(
+        float(os.getenv("ELASTICSEARCH_TIMEOUT", "30")),
+        description="Request timeout in seconds for Elasticsearch."
+    )
+    OPENAI_MAX_CONNECTIONS: int = Field(
+        int(os.getenv("OPENAI_MAX_CONNECTIONS", "100")),
+        description="Size of the keep-alive connection pool for OpenAI."
+    )
+    OPENAI_TIMEOUT: float = Field(
+        float(os.getenv("OPENAI_TIMEOUT", "60")),
+        description="Request timeout in seconds for OpenAI."
+    )
+    BLOB_MAX_CONNECTIONS: int = Field(
+        int(os.getenv("BLOB_MAX_CONNECTIONS", "20")),
+        description="Size of the keep-alive connection pool for Azure Blob Storage."
+    )
+    BLOB_TIMEOUT: float = Field(
+        float(os.getenv("BLOB_TIMEOUT", "60")),
+        description="Read timeout in seconds for Azure Blob Storage."
+    )
+    EMBEDDING_CACHE_PATH: str = Field(
+        os.getenv("EMBEDDING_CACHE_PATH", ""),
+        description="Path of the SQLite file of the persistent embedding cache. Empty to keep it in memory only."
+    )
+    OCR_CACHE_DIR: str = Field(
+        os.getenv("OCR_CACHE_DIR", ""),
+        description="Directory of the content-addressed OCR result cache. Empty to always call the OCR service."
+    )
+    TAGGING_CONCURRENCY: int = Field(
+        int(os.getenv("TAGGING_CONCURRENCY", "8")),
+        description="Maximum number of chunk tagging LLM calls in flight per file."
+    )
+    TAGGING_TIMEOUT: float = Field(
+        float(os.getenv("TAGGING_TIMEOUT", "60")),
+        description="Timeout in seconds of a single chunk tagging LLM call."
+    )
+    TAGGING_BATCH_TOKENS: int = Field(
+        int(os.getenv("TAGGING_BATCH_TOKENS", "6000")),
+        description="Token budget of the chunks tagged in one LLM call. 0 tags every chunk in its own call."
+    )
+    TAGGING_BATCH_SIZE: int = Field(
+        int(os.getenv("TAGGING_BATCH_SIZE", "16")),
+        description="Maximum number of chunks tagged in one LLM call."
+    )
+    FORMAT_PROCESS_WORKERS: int = Field(
+        int(os.getenv("FORMAT_PROCESS_WORKERS", "2")),
+        description="Number of processes formatting and splitting documents off the event loop. 0 runs them inline."
+    )
+    CHUNK_MAX_TOKENS: int = Field(
+        int(os.getenv("CHUNK_MAX_TOKENS", "512")),
+        description="Maximum number of tokens of a chunk. Sections longer than this are split."
+    )
+    CHUNK_OVERLAP_TOKENS: int = Field(
+        int(os.getenv("CHUNK_OVERLAP_TOKENS", "64")),
+        description="Number of tokens repeated between consecutive chunks of a split section."
+    )
+    INGESTION_IN_PROCESS: bool = Field(
+        os.getenv("INGESTION_IN_PROCESS", "true").lower() == "true",
+        description="Whether the API process runs ingestion workers. Set to false when running `python -m backend.worker` separately."
+    )
+    INGESTION_CONCURRENCY: int = Field(
+        int(os.getenv("INGESTION_CONCURRENCY", "2")),
+        description="Number of vectorization jobs a worker process runs at once."
+    )
+    INGESTION_MAX_ATTEMPTS: int = Field(
+        int(os.getenv("INGESTION_MAX_ATTEMPTS", "3")),
+        description="Number of attempts of a vectorization job before it is marked as failed."
+    )
+    INGESTION_RETRY_BACKOFF: float = Field(
+        float(os.getenv("INGESTION_RETRY_BACKOFF", "30")),
+        description="Base delay in seconds before retrying a failed job, doubled on every attempt."
+    )
+    INGESTION_POLL_INTERVAL: float = Field(
+        float(os.getenv("INGESTION_POLL_INTERVAL", "2")),
+        description="Seconds an idle worker waits before polling the job table again."
+    )
+    INGESTION_LEASE_SECONDS: float = Field(
+        float(os.getenv("INGESTION_LEASE_SECONDS", "1800")),
+        description="Seconds after which a running job whose worker died is picked up again."
+    )
+    INGESTION_QUEUE_SIZE: int = Field(
+        int(os.getenv("INGESTION_QUEUE_SIZE", "4")),
+        description="Number of document batches buffered between the tagging, embedding and indexing stages of a job."
+    )
+    RAG_NEIGHBOR_CHUNKS: int = Field(
+        int(os.getenv("RAG_NEIGHBOR_CHUNKS", "1")),
+        description="Number of chunks before and after each hit merged into the passages returned by the RAG tool."
+    )
+    RAG_CONTEXT_TOKENS: int = Field(
+        int(os.getenv("RAG_CONTEXT_TOKENS", "3000")),
+        description="Token budget of the search results the RAG tool returns to the model."
+    )
+    DEDUP_THRESHOLD: float = Field(
+        float(os.getenv("DEDUP_THRESHOLD", "0.9")),
+        description=(
+            "Estimated Jaccard similarity from which a chunk is linked to an indexed near-duplicate instead of embedded. "
+            "0 disables near-duplicate detection."
+        )
+    )
 
 
     @property
@@ -72,6 +188,33 @@ CONFIG = Config(
     BLOG_CONTAINER_NAME=os.getenv("BLOG_CONTAINER_NAME", "dashboard"),
     OCR_ENDPOINT=os.getenv("OCR_ENDPOINT", "wwerzcxv"),
     OCR_API_KEY=os.getenv("OCR_API_KEY", ""),
+    VECTOR_STORE_BACKEND=os.getenv("VECTOR_STORE_BACKEND", "elasticsearch"),  # type: ignore
+    NUMPY_SNAPSHOT_DIR=os.getenv("NUMPY_SNAPSHOT_DIR", ""),
     ELASTICSEARCH_HOSTS=os.getenv("ELASTICSEARCH_HOSTS", "http://localhost:9200"),
-    ELASTICSEARCH_API_KEY=os.getenv("ELASTICSEARCH_API_KEY", "")
+    ELASTICSEARCH_API_KEY=os.getenv("ELASTICSEARCH_API_KEY", ""),
+    ELASTICSEARCH_CONNECTIONS_PER_NODE=int(os.getenv("ELASTICSEARCH_CONNECTIONS_PER_NODE", "20")),
+    ELASTICSEARCH_TIMEOUT=float(os.getenv("ELASTICSEARCH_TIMEOUT", "30")),
+    OPENAI_MAX_CONNECTIONS=int(os.getenv("OPENAI_MAX_CONNECTIONS", "100")),
+    OPENAI_TIMEOUT=float(os.getenv("OPENAI_TIMEOUT", "60")),
+    BLOB_MAX_CONNECTIONS=int(os.getenv("BLOB_MAX_CONNECTIONS", "20")),
+    BLOB_TIMEOUT=float(os.getenv("BLOB_TIMEOUT", "60")),
+    EMBEDDING_CACHE_PATH=os.getenv("EMBEDDING_CACHE_PATH", ""),
+    OCR_CACHE_DIR=os.getenv("OCR_CACHE_DIR", ""),
+    TAGGING_CONCURRENCY=int(os.getenv("TAGGING_CONCURRENCY", "8")),
+    TAGGING_TIMEOUT=float(os.getenv("TAGGING_TIMEOUT", "60")),
+    TAGGING_BATCH_TOKENS=int(os.getenv("TAGGING_BATCH_TOKENS", "6000")),
+    TAGGING_BATCH_SIZE=int(os.getenv("TAGGING_BATCH_SIZE", "16")),
+    FORMAT_PROCESS_WORKERS=int(os.getenv("FORMAT_PROCESS_WORKERS", "2")),
+    CHUNK_MAX_TOKENS=int(os.getenv("CHUNK_MAX_TOKENS", "512")),
+    CHUNK_OVERLAP_TOKENS=int(os.getenv("CHUNK_OVERLAP_TOKENS", "64")),
+    INGESTION_IN_PROCESS=os.getenv("INGESTION_IN_PROCESS", "true").lower() == "true",
+    INGESTION_CONCURRENCY=int(os.getenv("INGESTION_CONCURRENCY", "2")),
+    INGESTION_MAX_ATTEMPTS=int(os.getenv("INGESTION_MAX_ATTEMPTS", "3")),
+    INGESTION_RETRY_BACKOFF=float(os.getenv("INGESTION_RETRY_BACKOFF", "30")),
+    INGESTION_POLL_INTERVAL=float(os.getenv("INGESTION_POLL_INTERVAL", "2")),
+    INGESTION_LEASE_SECONDS=float(os.getenv("INGESTION_LEASE_SECONDS", "1800")),
+    INGESTION_QUEUE_SIZE=int(os.getenv("INGESTION_QUEUE_SIZE", "4")),
+    RAG_NEIGHBOR_CHUNKS=int(os.getenv("RAG_NEIGHBOR_CHUNKS", "1")),
+    RAG_CONTEXT_TOKENS=int(os.getenv("RAG_CONTEXT_TOKENS", "3000")),
+    DEDUP_THRESHOLD=float(os.getenv("DEDUP_THRESHOLD", "0.9")),
 )
\ No newline at end of file
@@ -1,7 +1,7 @@
 import datetime as dt
 from typing import Optional
 
-from sqlalchemy import Engine, Index
+from sqlalchemy import Connection, Engine, Index, LargeBinary, Table, inspect, select, text, update
 from sqlalchemy.orm import mapped_column, DeclarativeBase, Mapped
 
 class FileBase(DeclarativeBase):
@@ -44,6 +44,11 @@ class File(FileBase):
         default=None,
         doc="The timestamp when the file was last updated. It can be None if not updated."
     )
+    digest: Mapped[Optional[str]] = mapped_column(
+        default=None,
+        index=True,
+        doc="The sha256 of the file content. Files with the same digest share their blob and their vectors."
+    )
     
 
 class Document(FileBase):
@@ -78,9 +83,124 @@ class VectorizingFile(FileBase):
         default=dt.datetime.now,
         doc="The timestamp when the vectorization process was initiated."
     )
+    user_id: Mapped[Optional[str]] = mapped_column(
+        default=None,
+        doc="The ID of the user who requested the vectorization. The job runs on behalf of this user."
+    )
+    attempts: Mapped[int] = mapped_column(
+        default=0,
+        server_default=text("0"),
+        doc="The number of times a worker has picked up the job."
+    )
+    max_attempts: Mapped[int] = mapped_column(
+        default=3,
+        server_default=text("3"),
+        doc="The number of attempts after which a failing job is marked 'red'."
+    )
+    run_after: Mapped[dt.datetime] = mapped_column(
+        default=dt.datetime.now,
+        server_default=text("now()"),
+        doc="The job is not picked up before this timestamp. Pushed back by the retry backoff."
+    )
+    locked_by: Mapped[Optional[str]] = mapped_column(
+        default=None,
+        doc="The ID of the worker running the job. None while the job is queued or finished."
+    )
+    locked_at: Mapped[Optional[dt.datetime]] = mapped_column(
+        default=None,
+        doc="The timestamp when the worker picked up the job. Stale locks are reclaimed by other workers."
+    )
+    updated_at: Mapped[Optional[dt.datetime]] = mapped_column(
+        default=None,
+        doc="The timestamp of the last status change of the job."
+    )
+
+    __table_args__ = (
+        Index("ix_vectorizing_file_queue", "status", "run_after"),
+        Index("ix_vectorizing_file_file_id", "file_id"),
+    )
+
+class IngestionCheckpoint(FileBase):
+    __tablename__ = 'ingestion_checkpoint'
+
+    file_id: Mapped[str] = mapped_column(
+        primary_key=True,
+        doc="Foreign key referencing the file being vectorized."
+    )
+    stage: Mapped[str] = mapped_column(
+        primary_key=True,
+        doc="The completed ingestion stage, e.g., 'analyze_result', 'pages', 'documents', 'embeddings'."
+    )
+    payload: Mapped[bytes] = mapped_column(
+        LargeBinary,
+        doc="The zlib-compressed JSON output of the stage."
+    )
+    created_at: Mapped[dt.datetime] = mapped_column(
+        default=dt.datetime.now,
+        doc="The timestamp when the stage was completed."
+    )
+
+# Columns added after their table was first released. `create_all` never alters an existing table,
+# so `create_file_all` adds the missing ones, and their indexes, to databases created before them.
+# Only PostgreSQL is supported, the job queue relies on `FOR UPDATE SKIP LOCKED`.
+ADDED_COLUMNS: dict[str, list[str]] = {
+    File.__tablename__: ["digest"],
+    VectorizingFile.__tablename__: [
+        "user_id", "attempts", "max_attempts", "run_after", "locked_by", "locked_at", "updated_at",
+    ],
+}
 
 def create_file_all(engine: Engine):
     FileBase.metadata.create_all(engine)
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        added: dict[str, list[str]] = {}
+        for tablename, columns in ADDED_COLUMNS.items():
+            table = FileBase.metadata.tables[tablename]
+            existing = {column["name"] for column in inspector.get_columns(tablename)}
+            added[tablename] = [name for name in columns if name not in existing]
+            for name in added[tablename]:
+                conn.execute(text(_add_column_ddl(engine, table, name)))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+        if "user_id" in added[VectorizingFile.__tablename__]:
+            _migrate_legacy_jobs(conn)
+
+def _migrate_legacy_jobs(conn: Connection) -> None:
+    """ Prepares the rows written before the job queue, when files were vectorized inline by the API.
+    They get the author of their file as `user_id`, and the ones still 'yellow' are marked 'red':
+    their inline run is gone, and the file has to be vectorized again.
+    """
+    conn.execute(
+        update(VectorizingFile)
+        .where(VectorizingFile.user_id.is_(None))
+        .values(user_id=(
+            select(File.author_id)
+            .where(File.file_id == VectorizingFile.file_id)
+            .scalar_subquery()
+        ))
+    )
+    conn.execute(
+        update(VectorizingFile)
+        .where(VectorizingFile.status == "yellow")
+        .values(
+            status="red",
+            error_message="Interrupted by the move to background ingestion jobs, vectorize the file again.",
+        )
+    )
+
+def _add_column_ddl(engine: Engine, table: Table, name: str) -> str:
+    """ Builds the `ALTER TABLE` statement adding the column.
+    NOT NULL columns need a server default, which fills the existing rows.
+    """
+    column = table.c[name]
+    ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+    if column.server_default is not None:
+        ddl += f" DEFAULT {column.server_default.arg}" # type: ignore
+    if not column.nullable:
+        ddl += " NOT NULL"
+    return ddl
 
 def drop_file_all(engine: Engine):
     FileBase.metadata.drop_all(engine)
\ No newline at end of file
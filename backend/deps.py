@@ -3,6 +3,7 @@ from typing import Annotated, Generator
 
 from sqlalchemy.orm import Session
 
+import backend.clients as clients
 import backend.db.engine as db
 import backend.models.user as user_mdl
 
@@ -48,4 +49,14 @@ def get_db() -> Generator[Session, None, None]:
     try:
         yield session
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+
+
+async def get_clients() -> clients.ClientRegistry:
+    """
+    Dependency to get the app-lifetime client registry.
+
+    Returns:
+        ClientRegistry: The shared Elasticsearch, OpenAI and Blob clients.
+    """
+    return await clients.get_clients()
\ No newline at end of file
@@ -1,5 +1,6 @@
 import uuid
-from typing import Annotated
+from contextlib import asynccontextmanager
+from typing import Annotated, AsyncGenerator
 
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
@@ -9,10 +10,28 @@ import backend.config as cfg
 import backend.deps as dp
 
 from backend.apis import init_apis
+from backend.clients import aopen_clients, aclose_clients
 from backend.db import init_db
 from backend.models.api import BaseResponse
+from backend.worker import IngestionWorker
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
+    app.state.clients = await aopen_clients()
+    app.state.ingestion_worker = None
+    if cfg.CONFIG.INGESTION_IN_PROCESS:
+        app.state.ingestion_worker = IngestionWorker.from_config(cfg.CONFIG)
+        app.state.ingestion_worker.start(app.state.clients)
+    try:
+        yield
+    finally:
+        if app.state.ingestion_worker is not None:
+            await app.state.ingestion_worker.stop()
+        await aclose_clients()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
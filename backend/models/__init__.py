@@ -32,7 +32,8 @@ from backend.models.tools import (
     ToolSpec
 )
 from backend.models.files import (
-    File
+    File,
+    VectorizeJob
 )
 from backend.models.api import (
     BaseRequest, 
@@ -60,5 +61,6 @@ from backend.models.api import (
     PostFileUploadResponse,
     GetFilesResponse,
     PostVectorizeFilesResponse,
+    GetVectorizeJobResponse,
     DeleteFilesByIDResponse
 )
@@ -14,7 +14,7 @@ from backend.models.conversations import ConversationMaster
 from backend.models.message import MessageRequest, MessageResponse, Content
 from backend.models.tools import Tool, ToolMaster, ToolRequest
 from backend.models.recommendations import RecommendationMaster, Recommendation
-from backend.models.files import File
+from backend.models.files import File, VectorizeJob
 
 class BaseRequest(BaseModel):
     pass
@@ -577,6 +577,11 @@ class PostFileUploadResponse(BaseResponse):
         description="ID of the uploaded file.",
         examples=[str(uuid.uuid4())]
     )
+    is_duplicate: bool = Field(
+        default=False,
+        description="Whether the same content was already uploaded. The existing blob is reused.",
+        examples=[False]
+    )
 
     @classmethod
     def mock(cls) -> "PostFileUploadResponse":
@@ -630,14 +635,37 @@ class PostVectorizeFilesResponse(BaseResponse):
         description="ID of the vectorized file.",
         examples=[str(uuid.uuid4())]
     )
+    job_id: str = Field(
+        ...,
+        description="ID of the queued vectorization job. Poll `GET /files/{file_id}/vectorize` for its status.",
+        examples=["vec-" + str(uuid.uuid4())]
+    )
 
     @classmethod
     def mock(cls) -> "PostVectorizeFilesResponse":
         return cls(
             status="success",
-            message="File vectorized successfully.",
+            message="File vectorization queued successfully.",
             request_id=str(uuid.uuid4()),
-            file_id=str(uuid.uuid4())
+            file_id=str(uuid.uuid4()),
+            job_id="vec-" + str(uuid.uuid4())
+        )
+
+
+class GetVectorizeJobResponse(BaseResponse):
+    job: VectorizeJob = Field(
+        ...,
+        description="The vectorization job of the file.",
+        examples=[VectorizeJob.mock()]
+    )
+
+    @classmethod
+    def mock(cls) -> "GetVectorizeJobResponse":
+        return cls(
+            status="success",
+            message="Vectorization job retrieved successfully.",
+            request_id=str(uuid.uuid4()),
+            job=VectorizeJob.mock()
         )
 
     
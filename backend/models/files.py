@@ -56,6 +56,11 @@ class File(BaseModel):
         description="Timestamp when the file was last updated.",
         examples=[dt.datetime.now()]
     )
+    digest: str | None = Field(
+        default=None,
+        description="SHA-256 of the file content.",
+        examples=["9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"]
+    )
 
     @classmethod
     def failed(cls) -> "File":
@@ -85,4 +90,75 @@ class File(BaseModel):
             author_name="user-12345",
             created_at=dt.datetime.now(),
             updated_at=dt.datetime.now()
-        )
\ No newline at end of file
+        )
+
+
+class VectorizeJob(BaseModel):
+    model_config = ConfigDict(
+        from_attributes=True,
+    )
+    job_id: str = Field(
+        ...,
+        description="Unique identifier of the vectorization job.",
+        examples=["vec-12345"]
+    )
+    file_id: str = Field(
+        ...,
+        description="ID of the file being vectorized.",
+        examples=["file-12345"]
+    )
+    status: Literal['red', 'yellow', 'green', 'gray'] = Field(
+        ...,
+        description="Status of the job. RED: Failed after all attempts, YELLOW: Queued or running, GREEN: Succeeded",
+        examples=["yellow"]
+    )
+    is_running: bool = Field(
+        default=False,
+        description="Whether a worker is currently running the job.",
+        examples=[True, False]
+    )
+    attempts: int = Field(
+        default=0,
+        description="Number of times a worker has picked up the job.",
+        examples=[1]
+    )
+    max_attempts: int = Field(
+        default=3,
+        description="Number of attempts after which the job fails.",
+        examples=[3]
+    )
+    error_message: str | None = Field(
+        default=None,
+        description="Error of the last attempt, or the partial failures of a succeeded job.",
+        examples=[None]
+    )
+    run_after: dt.datetime | None = Field(
+        default=None,
+        description="The job is not picked up before this timestamp.",
+        examples=[dt.datetime.now()]
+    )
+    created_at: dt.datetime | None = Field(
+        default=None,
+        description="Timestamp when the job was queued.",
+        examples=[dt.datetime.now()]
+    )
+    updated_at: dt.datetime | None = Field(
+        default=None,
+        description="Timestamp of the last status change of the job.",
+        examples=[dt.datetime.now()]
+    )
+
+    @classmethod
+    def mock(cls) -> "VectorizeJob":
+        return cls(
+            job_id="vec-12345",
+            file_id="file-12345",
+            status="yellow",
+            is_running=False,
+            attempts=0,
+            max_attempts=3,
+            error_message=None,
+            run_after=dt.datetime.now(),
+            created_at=dt.datetime.now(),
+            updated_at=dt.datetime.now()
+        )
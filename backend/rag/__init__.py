@@ -1,6 +1,12 @@
-from backend.rag.format import format_file
-from backend.rag.upload import upload_file
-from backend.rag.analyzer import analyze
-from backend.rag.splitter import split_by_header
-from backend.rag.vectorstore import VectorStore, AsyncCacheService
-from backend.rag.models import Document, FileMeta, PageMeta, SearchFilter
\ No newline at end of file
+from backend.rag.format import format_file, format_file_stream, format_result, iter_pages, read, FormattedPage
+from backend.rag.upload import upload_file, download_file
+from backend.rag.analyzer import analyze, analyze_stream
+from backend.rag.splitter import split_by_header, split_by_tokens
+from backend.rag.vectorstore import BaseVectorStore, VectorStore, AsyncCacheService, EmbeddingError, IndexingError
+from backend.rag.numpy_store import NumpyVectorStore
+from backend.rag.models import Document, FileMeta, PageMeta, SearchFilter, EmbeddingConfig, VectorIndexTypeLiteral, make_document_id
+from backend.rag.cache import CacheStats, SearchCacheStats, SearchResultCache, SEARCH_RESULT_CACHE
+from backend.rag.ocr_cache import OcrResultCache
+from backend.rag.process_pool import get_process_pool, run_in_process, shutdown_process_pool
+from backend.rag.dedup import SignatureIndex, minhash
+from backend.rag.context import pack_context
@@ -1,6 +1,6 @@
-import uuid
+import asyncio
 import datetime as dt
-from typing import List, Tuple, Callable
+from typing import AsyncIterable, AsyncIterator, Callable, Generic, List, Tuple, TypeVar
 from pydantic import BaseModel, Field
 
 import backend.models as mdl
@@ -9,6 +9,11 @@ import backend._types as t
 import backend.utils.logger as lg
 
 from agents.main import AsyncSimpleAgent
+from backend.rag.format import FormattedPage
+from backend.rag.process_pool import run_in_process
+from backend.rag.tokenizer import count_tokens
+
+T = TypeVar("T")
 
 class FileAnalyzed(BaseModel):
     type: str = Field(
@@ -80,22 +85,75 @@ class Tags(BaseModel):
 """
 
 
+class ChunkTags(BaseModel):
+    index: int = Field(
+        ...,
+        description="태그를 적용할 청크의 번호입니다.",
+        examples=[0, 1]
+    )
+    tags: List[str] = Field(
+        ...,
+        description="청크에 적용할 태그 목록입니다.",
+        examples=[['AI', '보고서'], ['계약서', '법률']]
+    )
+
+
+class BatchTags(BaseModel):
+    chunks: List[ChunkTags] = Field(
+        ...,
+        description="청크 번호별 태그 목록입니다. 주어진 모든 청크에 대해 하나씩 있어야 합니다.",
+    )
+
+    @staticmethod
+    def system_prompt() -> str:
+        return """
+## 역할
+당신은 문서 분석기입니다.
+당신의 역할은 주어진 문서 청크들을 분석하고, 그 내용을 이해해서, 필요한 정보를 추출하는 것입니다.
+
+## 요구사항
+- 각 청크는 <chunk index="번호"> 태그로 감싸져 있습니다.
+- 청크마다 적용할 태그 목록을 식별 가능해야 합니다.
+- 모든 청크에 대해 청크 번호와 태그 목록을 하나씩 반환하시오.
+
+"""
+
+    @staticmethod
+    def user_prompt(chunks: List[str]) -> str:
+        return "\n\n".join(
+            f'<chunk index="{idx}">\n{chunk}\n</chunk>' for idx, chunk in enumerate(chunks)
+        )
+
+
 async def analyze(
     contents_by_page: List[str],
     *,
     ai: AsyncSimpleAgent,
     file: mdl.File,
     split_func: Callable,
+    concurrency: int = 8,
+    timeout: float | None = 60.0,
+    batch_tokens: int = 0,
+    batch_size: int = 16,
 ) -> Tuple[List[rag.Document], Exception | None]:
     """
     Analyze the contents of a file and extract relevant information.
     split func must returns `List[str]`
 
+    Chunks are tagged concurrently, at most `concurrency` LLM calls at once,
+    and the documents keep the order of the chunks in the file.
+    With `batch_tokens`, consecutive chunks are packed into one call per batch,
+    and chunks the batch answer misses are tagged one by one.
+
     Args:
         contents_by_page (List[str]): The contents of the file split by page.
         ai (AsyncSimpleAgent): The AI agent to use for analysis.
         file (mdl.File): The file metadata.
         split_func (Callable): The function to split the content into chunks.
+        concurrency (int): Maximum number of tagging calls in flight.
+        timeout (float | None): Timeout in seconds of a single tagging call. None to wait forever.
+        batch_tokens (int): Token budget of the chunks packed into one tagging call. 0 tags every chunk alone.
+        batch_size (int): Maximum number of chunks packed into one tagging call.
 
     Returns:
         Tuple[List[rag.Document], Exception | None]: The analyzed documents and any error that occurred.
@@ -103,18 +161,148 @@ async def analyze(
     """
     lg.logger.info(f"Analyzing Starts with file {file.file_id} for user {file.author_name}!!")
 
+    filemeta, err = await analyze_file(contents_by_page[0], ai=ai, file=file)
+    if err or not filemeta:
+        return [], err
+
+    chunks: List[Tuple[rag.PageMeta, str]] = []
+    for page_idx, content in enumerate(contents_by_page):
+        for chunk in split_func(content):
+            pagemeta = rag.PageMeta(
+                number = page_idx + 1,
+                total_pages=len(contents_by_page),
+                chunk_index=len(chunks),
+            )
+            chunks.append((pagemeta, chunk))
+
+    packer = _BatchPacker(batch_tokens=batch_tokens, batch_size=batch_size)
+    batches = [batch for chunk in chunks if (batch := packer.add(chunk, chunk[1]))]
+    if (batch := packer.flush()):
+        batches.append(batch)
+
+    lg.logger.info(
+        f"Tagging {len(chunks)} chunks of {len(contents_by_page)} pages "
+        f"in {len(batches)} calls, {concurrency} at a time"
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    tagged_batches = await asyncio.gather(*(
+        _tag_documents(batch, filemeta=filemeta, ai=ai, semaphore=semaphore, timeout=timeout)
+        for batch in batches
+    ))
+
+    return [document for batch in tagged_batches for document in batch], None
+
+
+async def analyze_stream(
+    pages: AsyncIterable[FormattedPage],
+    *,
+    ai: AsyncSimpleAgent,
+    file: mdl.File,
+    split_func: Callable,
+    concurrency: int = 8,
+    timeout: float | None = 60.0,
+    batch_tokens: int = 0,
+    batch_size: int = 16,
+) -> AsyncIterator[List[rag.Document]]:
+    """
+    Streaming variant of `analyze`, tagging chunks while the next pages are still being produced.
+
+    Pages are split and packed into batches as they arrive, and `concurrency` taggers pull the batches
+    from a queue of at most `2 * concurrency` batches, so a slow consumer also stops the pages being read.
+    The tagged documents of each batch are yielded as soon as the batch is done, in completion order.
+    Pages are split in the process pool, so `split_func` must be picklable, e.g. a module-level function
+    or a `functools.partial` of one.
+
+    Args:
+        pages (AsyncIterable[FormattedPage]): The formatted pages of the file, in order.
+        ai (AsyncSimpleAgent): The AI agent to use for analysis.
+        file (mdl.File): The file metadata.
+        split_func (Callable): The function to split the content into chunks.
+        concurrency (int): Maximum number of tagging calls in flight.
+        timeout (float | None): Timeout in seconds of a single tagging call. None to wait forever.
+        batch_tokens (int): Token budget of the chunks packed into one tagging call. 0 tags every chunk alone.
+        batch_size (int): Maximum number of chunks packed into one tagging call.
+
+    Yields:
+        List[rag.Document]: The documents of each tagged batch. Chunks that failed to tag are left out.
+
+    Raises:
+        Exception: The error of the file analysis on the first page, or of the page iterator.
+    """
+    lg.logger.info(f"Streaming analysis starts with file {file.file_id} for user {file.author_name}!!")
+
+    batches: asyncio.Queue[List[Tuple[rag.PageMeta, str]] | None] = asyncio.Queue(maxsize=2 * concurrency)
+    tagged: asyncio.Queue[List[rag.Document] | None] = asyncio.Queue(maxsize=2 * concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    filemeta: rag.FileMeta | None = None
+
+    async def split() -> None:
+        nonlocal filemeta
+        packer = _BatchPacker(batch_tokens=batch_tokens, batch_size=batch_size)
+        chunk_index = 0
+        async for page in pages:
+            if filemeta is None:
+                filemeta, err = await analyze_file(page.content, ai=ai, file=file)
+                if err or not filemeta:
+                    raise err or ValueError(f"No analysis result for file {file.file_id}.")
+
+            for chunk in await run_in_process(split_func, page.content):
+                pagemeta = rag.PageMeta(number=page.number, total_pages=page.total_pages, chunk_index=chunk_index)
+                chunk_index += 1
+                if (batch := packer.add((pagemeta, chunk), chunk)):
+                    await batches.put(batch)
+
+        if (batch := packer.flush()):
+            await batches.put(batch)
+
+    async def tag() -> None:
+        while (batch := await batches.get()) is not None:
+            assert filemeta is not None
+            await tagged.put(
+                await _tag_documents(batch, filemeta=filemeta, ai=ai, semaphore=semaphore, timeout=timeout)
+            )
+
+    async def run() -> None:
+        try:
+            async with asyncio.TaskGroup() as group:
+                taggers = [group.create_task(tag()) for _ in range(concurrency)]
+                await split()
+                for _ in taggers:
+                    await batches.put(None)
+        finally:
+            await tagged.put(None)
+
+    runner = asyncio.create_task(run())
+    try:
+        while (documents := await tagged.get()) is not None:
+            yield documents
+        await runner
+    except BaseExceptionGroup as eg:
+        raise eg.exceptions[0]
+    finally:
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+
+
+async def analyze_file(
+    first_page: str,
+    *,
+    ai: AsyncSimpleAgent,
+    file: mdl.File,
+) -> Tuple[rag.FileMeta | None, Exception | None]:
+    """ Extracts the file metadata (type, description, validity, author, department) from the first page. """
     fileanalyzed, err = await ai.aparse(
         messages=[
             {'role': 'system', 'content': FileAnalyzed.system_prompt()},
-            {'role': 'user', 'content': contents_by_page[0]}
+            {'role': 'user', 'content': first_page}
         ],
         response_fmt=FileAnalyzed,
         deployment_id="gpt-5-nano"
     )
     if err or not fileanalyzed:
-        return [], err
+        return None, err
     
-    filemeta = rag.FileMeta(
+    return rag.FileMeta(
         file_id=file.file_id,
         file_path=file.file_path,
         file_name=file.file_name,
@@ -125,43 +313,138 @@ async def analyze(
         effective_to=fileanalyzed.effective_to,
         author=fileanalyzed.author,
         department=fileanalyzed.department
-    )
+    ), None
+
+
+async def _tag_documents(
+    chunks: List[Tuple[rag.PageMeta, str]],
+    *,
+    filemeta: rag.FileMeta,
+    ai: AsyncSimpleAgent,
+    semaphore: asyncio.Semaphore,
+    timeout: float | None,
+) -> List[rag.Document]:
+    """ Tags a batch of chunks and builds their documents. Chunks that failed to tag are logged and left out. """
+    tagged = await _tag_batch([chunk for _, chunk in chunks], ai=ai, semaphore=semaphore, timeout=timeout)
 
     documents: List[rag.Document] = []
-    for page_idx, content in enumerate(contents_by_page):
-        lg.logger.info(f"Processing page {page_idx + 1} of {len(contents_by_page)}")
+    for (pagemeta, chunk), (tags, err) in zip(chunks, tagged):
+        if err or not tags:
+            lg.logger.error(f"Error parsing tags for a chunk in page {pagemeta.number}: {err}")
+            continue
 
-        pagemeta = rag.PageMeta(
-            number = page_idx + 1,
-            total_pages=len(contents_by_page),
+        document_id = rag.make_document_id(filemeta.file_id, pagemeta.chunk_index)
+        document = rag.Document(
+            document_id=document_id,
+            content=chunk,
+            tags=tags.tags,
+            file_meta=filemeta,
+            page_meta=pagemeta
         )
-        chunks: List[str] = split_func(content)
-
-        for chunk_idx, chunk in enumerate(chunks):
-            lg.logger.info(f"Processing chunk {chunk_idx + 1} of {len(chunks)} in page {page_idx + 1}")
-
-            document_id = "doc-" + str(uuid.uuid4())
-            tags, err = await ai.aparse(
-                messages=[
-                    {'role': 'system', 'content': Tags.system_prompt()},
-                    {'role': 'user', 'content': content}
-                ],
-                response_fmt=Tags,
-                deployment_id="gpt-5-nano"
+
+        documents.append(document)
+        lg.logger.info(f"Document {document_id} created with {len(chunk)} characters.")
+
+    return documents
+
+
+async def _tag_chunk(
+    chunk: str,
+    *,
+    ai: AsyncSimpleAgent,
+    semaphore: asyncio.Semaphore,
+    timeout: float | None,
+) -> Tuple[Tags | None, Exception | None]:
+    async with semaphore:
+        try:
+            return await asyncio.wait_for(
+                ai.aparse(
+                    messages=[
+                        {'role': 'system', 'content': Tags.system_prompt()},
+                        {'role': 'user', 'content': chunk}
+                    ],
+                    response_fmt=Tags,
+                    deployment_id="gpt-5-nano"
+                ),
+                timeout=timeout,
             )
-            if err or not tags:
-                lg.logger.error(f"Error parsing tags for chunk {chunk_idx + 1} in page {page_idx + 1}: {err}")
-                continue
-        
-            document = rag.Document(
-                document_id=document_id,
-                content=chunk,
-                tags=tags.tags,
-                file_meta=filemeta,
-                page_meta=pagemeta
+        except asyncio.TimeoutError:
+            return None, TimeoutError(f"Tagging timed out after {timeout} seconds.")
+        except Exception as e:
+            return None, e
+
+
+async def _tag_batch(
+    chunks: List[str],
+    *,
+    ai: AsyncSimpleAgent,
+    semaphore: asyncio.Semaphore,
+    timeout: float | None,
+) -> List[Tuple[Tags | None, Exception | None]]:
+    if len(chunks) == 1:
+        return [await _tag_chunk(chunks[0], ai=ai, semaphore=semaphore, timeout=timeout)]
+
+    async with semaphore:
+        try:
+            parsed, err = await asyncio.wait_for(
+                ai.aparse(
+                    messages=[
+                        {'role': 'system', 'content': BatchTags.system_prompt()},
+                        {'role': 'user', 'content': BatchTags.user_prompt(chunks)}
+                    ],
+                    response_fmt=BatchTags,
+                    deployment_id="gpt-5-nano"
+                ),
+                timeout=timeout,
             )
+        except asyncio.TimeoutError:
+            parsed, err = None, TimeoutError(f"Tagging timed out after {timeout} seconds.")
+        except Exception as e:
+            parsed, err = None, e
+
+    results: dict[int, Tuple[Tags | None, Exception | None]] = {}
+    if err or not parsed:
+        lg.logger.warning(f"Batch tagging of {len(chunks)} chunks failed, tagging them one by one: {err}")
+    else:
+        for entry in parsed.chunks:
+            if 0 <= entry.index < len(chunks) and entry.tags and entry.index not in results:
+                results[entry.index] = (Tags(tags=entry.tags), None)
+
+    missing = [idx for idx in range(len(chunks)) if idx not in results]
+    if missing and parsed:
+        lg.logger.warning(f"Batch tagging missed {len(missing)} of {len(chunks)} chunks, tagging them one by one")
+    fallbacks = await asyncio.gather(*(
+        _tag_chunk(chunks[idx], ai=ai, semaphore=semaphore, timeout=timeout)
+        for idx in missing
+    ))
+    results.update(zip(missing, fallbacks))
+
+    return [results[idx] for idx in range(len(chunks))]
+
+
+class _BatchPacker(Generic[T]):
+    """ Packs consecutive items into batches of at most `batch_size` items and `batch_tokens` tokens.
+    An item larger than the budget gets a batch of its own. Without a budget every item is alone.
+    """
+
+    def __init__(self, *, batch_tokens: int, batch_size: int) -> None:
+        self.batch_tokens = batch_tokens
+        self.batch_size = batch_size if batch_tokens > 0 else 1
+        self._batch: List[T] = []
+        self._tokens = 0
+
+    def add(self, item: T, text: str) -> List[T] | None:
+        """ Adds an item and returns the batch it closed, if any. """
+        closed: List[T] | None = None
+        tokens = count_tokens(text) if self.batch_size > 1 else 0
+        if self._batch and (len(self._batch) >= self.batch_size or self._tokens + tokens > self.batch_tokens):
+            closed = self.flush()
 
-            documents.append(document)
-            lg.logger.info(f"Document {document_id} created with {len(chunk)} characters.")
+        self._batch.append(item)
+        self._tokens += tokens
+        return closed
 
-    return documents, None
\ No newline at end of file
+    def flush(self) -> List[T] | None:
+        """ Returns the pending batch, if any, and starts a new one. """
+        batch, self._batch, self._tokens = self._batch, [], 0
+        return batch or None
@@ -0,0 +1,165 @@
+""" Measures recall@k of reduced-dimension and quantized vector indices against the full-precision baseline.
+
+The corpus is embedded once at full dimensions. Lower dimensions are derived by Matryoshka truncation
+and re-normalization, which is what the `dimensions` parameter of text-embedding-3 does server side.
+The ground truth is an exact cosine top-k over the full vectors, and every (dimensions, index type)
+setting is measured by kNN searches against its own Elasticsearch index.
+
+Usage:
+    python -m backend.rag.benchmark --corpus corpus.jsonl --dims 1536 768 512 256 \\
+        --index-types hnsw int8_hnsw int4_hnsw bbq_hnsw --k 10 --queries 200
+
+The corpus is a JSONL file whose lines have a `content` key. Queries are sampled from the corpus
+unless `--query-file` (same format) is given.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from elasticsearch.helpers import async_bulk
+
+import backend.rag.models as mdl
+
+from backend.clients import aopen_clients, aclose_clients
+from backend.rag.numpy_store import NumpyVectorStore
+
+
+def _load(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["content"] for line in f if line.strip()]
+
+
+def _truncate(vectors: np.ndarray, dims: int) -> np.ndarray:
+    truncated = np.ascontiguousarray(vectors[:, :dims])
+    norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+    return truncated / np.where(norms == 0, 1, norms)
+
+
+def _exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+
+async def _embed(store: NumpyVectorStore, texts: List[str]) -> np.ndarray:
+    vectors, err = await store._aembed({str(i): text for i, text in enumerate(texts)})
+    if err:
+        raise err
+    matrix = np.asarray([vectors[str(i)] for i in range(len(texts))], dtype=np.float32)
+    return _truncate(matrix, matrix.shape[1])
+
+
+async def _measure(
+    client,
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    truth: np.ndarray,
+    *,
+    dims: int,
+    index_type: mdl.VectorIndexTypeLiteral,
+    k: int,
+    num_candidates: int,
+    keep: bool,
+) -> Tuple[float, float, int]:
+    indexname = f"bench-{dims}-{index_type.replace('_', '-')}"
+    if await client.indices.exists(index=indexname):
+        await client.indices.delete(index=indexname)
+    await mdl.index_definition(dims, index_type).init(index=indexname, using=client)
+
+    vectors = _truncate(corpus, dims)
+    await async_bulk(
+        client,
+        (
+            {"_index": indexname, "_id": str(i), "_source": {"document_id": str(i), "vector": v.tolist()}}
+            for i, v in enumerate(vectors)
+        ),
+        chunk_size=500,
+    )
+    await client.indices.refresh(index=indexname)
+    await client.indices.forcemerge(index=indexname, max_num_segments=1)
+
+    recalls: List[float] = []
+    latencies: List[float] = []
+    for query, expected in zip(_truncate(queries, dims), truth):
+        start = time.perf_counter()
+        resp = await client.search(
+            index=indexname,
+            knn={"field": "vector", "query_vector": query.tolist(), "k": k, "num_candidates": num_candidates},
+            source=False,
+            size=k,
+        )
+        latencies.append(time.perf_counter() - start)
+        found = {int(hit["_id"]) for hit in resp["hits"]["hits"]}
+        recalls.append(len(found & set(expected.tolist())) / k)
+
+    stats = await client.indices.stats(index=indexname, metric="store")
+    size = stats["_all"]["total"]["store"]["size_in_bytes"]
+    if not keep:
+        await client.indices.delete(index=indexname)
+
+    return statistics.mean(recalls), statistics.median(latencies), size
+
+
+async def main(args: argparse.Namespace) -> None:
+    clients = await aopen_clients()
+    try:
+        store = await NumpyVectorStore.create(
+            embedding_service=clients.openai,
+            cache_service=clients.embedding_cache,
+            indexname="benchmark",
+            document_class=mdl.Document,
+            embedding_model=args.model,
+            result_cache=None,
+        )
+        texts = _load(args.corpus)
+        if args.query_file:
+            query_texts = _load(args.query_file)
+        else:
+            rng = np.random.default_rng(args.seed)
+            picked = rng.choice(len(texts), size=min(args.queries, len(texts)), replace=False)
+            query_texts = [texts[i] for i in picked]
+
+        corpus = await _embed(store, texts)
+        queries = await _embed(store, query_texts)
+        truth = _exact_top_k(corpus, queries, args.k)
+        print(f"corpus={len(texts)} queries={len(query_texts)} k={args.k} num_candidates={args.num_candidates}")
+        print(f"{'dims':>6} {'index_type':>12} {'recall@k':>10} {'p50 ms':>8} {'size MiB':>10}")
+
+        for dims in args.dims:
+            for index_type in args.index_types:
+                recall, latency, size = await _measure(
+                    clients.vector_client,
+                    corpus,
+                    queries,
+                    truth,
+                    dims=dims,
+                    index_type=index_type,
+                    k=args.k,
+                    num_candidates=args.num_candidates,
+                    keep=args.keep,
+                )
+                print(f"{dims:>6} {index_type:>12} {recall:>10.4f} {latency * 1000:>8.1f} {size / 2**20:>10.1f}")
+    finally:
+        await aclose_clients()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", required=True)
+    parser.add_argument("--query-file", default=None)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--model", default="text-embedding-3-small")
+    parser.add_argument("--dims", type=int, nargs="+", default=[1536, 768, 512, 256])
+    parser.add_argument(
+        "--index-types", nargs="+", default=["hnsw", "int8_hnsw", "int4_hnsw", "bbq_hnsw"],
+    )
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--num-candidates", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark indices.")
+    asyncio.run(main(parser.parse_args()))
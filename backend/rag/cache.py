@@ -0,0 +1,312 @@
+import asyncio
+import collections
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from pydantic import BaseModel, Field
+
+
+class CacheStats(BaseModel):
+    hits: int = Field(
+        default=0,
+        description="Number of lookups answered by the in-process or persistent tier."
+    )
+    disk_hits: int = Field(
+        default=0,
+        description="Number of lookups answered by the persistent tier. Included in `hits`."
+    )
+    misses: int = Field(
+        default=0,
+        description="Number of lookups answered by neither tier."
+    )
+    evictions: int = Field(
+        default=0,
+        description="Number of entries evicted from the in-process tier, by size or by TTL."
+    )
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class AsyncCacheService:
+    """ A tiered embedding cache.
+
+    The first tier is an in-process LRU bounded by `max_entries` and `ttl_seconds`.
+    The optional second tier is a local SQLite file at `persist_path`, which survives restarts
+    and promotes its hits into the first tier.
+
+    Keys are built with `make_key` from the embedding model, the dimensions and the sha256 of the text.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: int = 50_000,
+        ttl_seconds: float = 7 * 24 * 3600,
+        persist_path: str | None = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self.stats = CacheStats()
+
+        self._memory: collections.OrderedDict[str, Tuple[float, np.ndarray]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        if persist_path:
+            self._conn = sqlite3.connect(persist_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_expires_at ON embeddings (expires_at)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, dimensions: int | None, text: str) -> str:
+        """ Builds the cache key of a text embedded with the given model and dimensions.
+
+        Args:
+            model (str): The embedding model.
+            dimensions (int | None): The requested dimensions, None for the model default.
+            text (str): The embedded text.
+
+        Returns:
+            str: The cache key.
+        """
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model}:{dimensions or 'default'}:{digest}"
+
+    async def aget_many(self, keys: Iterable[str]) -> dict[str, List[float]]:
+        """ Looks up the keys, first in memory and then in the persistent tier.
+
+        Args:
+            keys (Iterable[str]): The keys to look up.
+
+        Returns:
+            dict[str, List[float]]: The cached embeddings of the keys that were found.
+        """
+        keys = list(keys)
+        found: dict[str, List[float]] = {}
+        missing: List[str] = []
+        now = time.time()
+
+        for key in keys:
+            entry = self._memory.get(key)
+            if entry is None:
+                missing.append(key)
+                continue
+
+            expires_at, value = entry
+            if expires_at < now:
+                del self._memory[key]
+                self.stats.evictions += 1
+                missing.append(key)
+                continue
+
+            self._memory.move_to_end(key)
+            found[key] = value.tolist()
+
+        if missing and self._conn is not None:
+            rows = await asyncio.to_thread(self._disk_get, missing, now)
+            for key, (expires_at, value) in rows.items():
+                self._memory_set(key, value, expires_at)
+                found[key] = value.tolist()
+            self.stats.disk_hits += len(rows)
+
+        self.stats.hits += len(found)
+        self.stats.misses += len(keys) - len(found)
+        return found
+
+    async def aset_many(self, values: dict[str, List[float]]) -> None:
+        """ Stores the embeddings in memory and, if configured, in the persistent tier.
+
+        Args:
+            values (dict[str, List[float]]): The embeddings keyed by `make_key`.
+        """
+        if not values:
+            return
+
+        expires_at = time.time() + self.ttl_seconds
+        arrays = {
+            key: np.asarray(value, dtype=np.float32)
+            for key, value in values.items()
+        }
+        for key, value in arrays.items():
+            self._memory_set(key, value, expires_at)
+
+        if self._conn is not None:
+            await asyncio.to_thread(self._disk_set, arrays, expires_at)
+
+    def close(self) -> None:
+        """ Closes the persistent tier. The in-process tier is kept. """
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+            self._conn = None
+
+    def _memory_set(self, key: str, value: np.ndarray, expires_at: float) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats.evictions += 1
+
+    def _disk_get(self, keys: List[str], now: float) -> dict[str, Tuple[float, np.ndarray]]:
+        assert self._conn is not None
+        rows: dict[str, Tuple[float, np.ndarray]] = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                cursor = self._conn.execute(
+                    f"SELECT key, value, expires_at FROM embeddings "
+                    f"WHERE key IN ({placeholders}) AND expires_at >= ?",
+                    (*batch, now),
+                )
+                for key, value, expires_at in cursor:
+                    rows[key] = (expires_at, np.frombuffer(value, dtype=np.float32))
+        return rows
+
+    def _disk_set(self, values: dict[str, np.ndarray], expires_at: float) -> None:
+        assert self._conn is not None
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, value, expires_at) VALUES (?, ?, ?)",
+                [(key, value.tobytes(), expires_at) for key, value in values.items()],
+            )
+            self._conn.execute("DELETE FROM embeddings WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+
+
+class SearchCacheStats(BaseModel):
+    hits: int = Field(
+        default=0,
+        description="Number of searches answered from the cache."
+    )
+    misses: int = Field(
+        default=0,
+        description="Number of searches that went to the backend."
+    )
+    invalidations: int = Field(
+        default=0,
+        description="Number of times an index was invalidated by a write."
+    )
+    saved_seconds: float = Field(
+        default=0.0,
+        description="Sum of the backend latencies that cache hits did not pay."
+    )
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class SearchResultCache:
+    """ A TTL cache of search results, invalidated per index on writes.
+
+    Keys are built with `make_key` from the index, the normalized query, the tags, `top_k`,
+    the score threshold, `effective_at` rounded down to `bucket_seconds`, the number of neighbours
+    and the fusion settings.
+    Each index has a generation that `invalidate` bumps; results computed under an older
+    generation are never stored, so a search racing with a write cannot cache stale hits.
+
+    Invalidation is in-process only. With several workers, `ttl_seconds` bounds the staleness.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: int = 10_000,
+        ttl_seconds: float = 300,
+        bucket_seconds: int = 3600,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.bucket_seconds = bucket_seconds
+        self.stats = SearchCacheStats()
+
+        self._entries: collections.OrderedDict[Tuple, Tuple[float, float, list]] = collections.OrderedDict()
+        self._generations: dict[str, int] = {}
+
+    def make_key(
+        self,
+        indexname: str,
+        query: str,
+        tags: Iterable[str],
+        top_k: int,
+        stride_score: float,
+        effective_at: float,
+        neighbors: int = 0,
+        fusion: str = "rrf",
+        oversample: int = 2,
+        num_candidates: int | None = None,
+        rank_constant: int = 60,
+    ) -> Tuple:
+        """ Builds the cache key of a search. `effective_at` is a POSIX timestamp. """
+        normalized = " ".join(query.lower().split())
+        bucket = int(effective_at // self.bucket_seconds)
+        return (
+            indexname,
+            normalized,
+            tuple(sorted(set(tags))),
+            top_k,
+            stride_score,
+            bucket,
+            neighbors,
+            fusion,
+            oversample,
+            num_candidates,
+            rank_constant,
+        )
+
+    def generation(self, indexname: str) -> int:
+        return self._generations.get(indexname, 0)
+
+    def get(self, key: Tuple) -> list | None:
+        """ Returns a copy of the cached results, or None if missing or expired. """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+
+        expires_at, latency, results = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            self.stats.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        self.stats.saved_seconds += latency
+        return list(results)
+
+    def set(self, key: Tuple, results: list, latency: float, generation: int) -> None:
+        """ Stores the results if the index was not invalidated since `generation` was read. """
+        if generation != self.generation(key[0]):
+            return
+
+        self._entries[key] = (time.time() + self.ttl_seconds, latency, list(results))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, indexname: str) -> None:
+        """ Drops every cached result of the index. """
+        self._generations[indexname] = self.generation(indexname) + 1
+        for key in [k for k in self._entries if k[0] == indexname]:
+            del self._entries[key]
+        self.stats.invalidations += 1
+
+
+SEARCH_RESULT_CACHE = SearchResultCache()
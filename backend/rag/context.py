@@ -0,0 +1,95 @@
+import functools
+from typing import List, Sequence
+
+import backend.rag.models as mdl
+
+from backend.rag.tokenizer import count_tokens, get_encoding
+
+_count_tokens = functools.lru_cache(maxsize=4096)(count_tokens)
+
+
+def pack_context(
+    documents: Sequence[mdl.Document],
+    *,
+    max_tokens: int,
+    model: str = "gpt-4o",
+) -> str:
+    """
+    Formats search results for a prompt in at most `max_tokens` tokens.
+
+    Documents are grouped by file: the file metadata is written once, followed by the chunks of the file
+    in page order. Chunks are picked in rank order while they fit in the budget, and a chunk that does not
+    fit is skipped for the next ones, so a long passage does not push out several short hits.
+    If not even the best chunk fits, it is cut to the budget. Files appear in the order of their best chunk.
+
+    Token counts are cached per text, since the same chunks come back across turns of a conversation.
+
+    Args:
+        documents (Sequence[mdl.Document]): The search results, best first.
+        max_tokens (int): Token budget of the packed context.
+        model (str): The model whose tokenizer counts the tokens.
+
+    Returns:
+        str: The packed context. Empty if there are no documents.
+    """
+    picked: dict[str, List[mdl.Document]] = {}
+    headers: dict[str, str] = {}
+    budget = max_tokens
+    for doc in documents:
+        file_id = doc.file_meta.file_id
+        header = headers.get(file_id) or _file_header(doc.file_meta)
+        cost = _count_tokens(_chunk_block(doc), model)
+        if file_id not in picked:
+            cost += _count_tokens(header, model)
+        if cost > budget:
+            continue
+
+        budget -= cost
+        headers[file_id] = header
+        picked.setdefault(file_id, []).append(doc)
+
+    if not picked and documents:
+        doc = documents[0]
+        header = _file_header(doc.file_meta)
+        remaining = max_tokens - _count_tokens(header, model) - _count_tokens(_chunk_block(doc, ""), model)
+        content = _truncate(doc.content, max(0, remaining), model)
+        return header + _chunk_block(doc, content)
+
+    blocks: List[str] = []
+    for file_id, docs in picked.items():
+        docs.sort(key=lambda d: (d.page_meta.number, d.page_meta.chunk_index))
+        blocks.append(headers[file_id] + "".join(_chunk_block(doc) for doc in docs))
+
+    return "".join(blocks)
+
+
+def _file_header(file_meta: mdl.FileMeta) -> str:
+    """ Formats the file metadata, leaving out the empty fields. """
+    lines = [
+        f"원본 파일 이름: {file_meta.file_name}",
+        f"원본 파일 설명: {file_meta.file_description}" if file_meta.file_description else "",
+        f"원본 파일 다운로드 링크: {file_meta.file_path}",
+        f"원본 파일 유효기간 {file_meta.effective_from} 부터 {file_meta.effective_to} 까지",
+        f"원본 파일 저자: {file_meta.author}" if file_meta.author else "",
+        f"원본 파일 부서: {file_meta.department}" if file_meta.department else "",
+    ]
+    return "\n---\n" + "".join(line + "\n" for line in lines if line) + "---\n"
+
+
+def _chunk_block(doc: mdl.Document, content: str | None = None) -> str:
+    return f"""
+<{doc.page_meta.number} / {doc.page_meta.total_pages}> 쪽, 태그: {", ".join(doc.tags)}
+{doc.content if content is None else content}
+"""
+
+
+def _truncate(text: str, max_tokens: int, model: str) -> str:
+    """ Cuts the text to its first `max_tokens` tokens. """
+    encoding = get_encoding(model)
+    if encoding is None:
+        # Matches the estimate of `count_tokens`, one token per two UTF-8 bytes.
+        return text.encode("utf-8")[:max_tokens * 2].decode("utf-8", errors="ignore")
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -1,9 +1,15 @@
-import json
+import asyncio
+
+from collections import deque
 from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from itertools import accumulate
 
 from typing import (
     Any, 
     AsyncGenerator, 
+    AsyncIterator,
+    Deque,
     List, 
     Tuple
 )
@@ -13,9 +19,10 @@ import numpy as np
 
 from azure.core.credentials import AzureKeyCredential
 from azure.ai.documentintelligence.aio import DocumentIntelligenceClient
-from pydantic.dataclasses import dataclass
 
 from backend.config import CONFIG
+from backend.rag.ocr_cache import OcrResultCache
+from backend.rag.process_pool import run_in_process
 
 
 @dataclass
@@ -37,6 +44,13 @@ class AnalyzedFigure:
     page: int
     idx_to_remove: List[int]
 
+
+@dataclass
+class FormattedPage:
+    content: str
+    number: int
+    total_pages: int
+
 @asynccontextmanager
 async def get_ocr(
     *,
@@ -56,115 +70,331 @@ async def get_ocr(
 
 async def format_file(
     blob_url: str, 
-    mock_path: str | None = None
+    mock_path: str | None = None,
+    *,
+    content: bytes | None = None,
+    digest: str | None = None,
+    cache: OcrResultCache | None = None,
 ) -> Tuple[List[str], Exception | None]:
     """ Main pipeline to read a document, format paragraphs, tables, and figures, and return the result as markdown.
     Args:
         blob_url (str): The URL of the document to analyze.
         mock_path (str | None): Optional path to a mock JSON file for testing purposes.
+        content (bytes | None): The document bytes, if already downloaded. See `read`.
+        digest (str | None): The sha256 of the document bytes, if already known. See `read`.
+        cache (OcrResultCache | None): The OCR result cache to consult first.
     
     Returns:
         Tuple[List[str], Exception | None]: A tuple containing the markdown result per page and any exception that occurred
     """
-    unanalyzed, error = await read(blob_url, mock_path)
+    unanalyzed, error = await read(blob_url, mock_path, content=content, digest=digest, cache=cache)
     if error or not unanalyzed:
         print(f"Error reading document: {error}")
         return [], error
 
-    paras = await analyze_paragraphs(unanalyzed.paragraphs)
-    tables = await analyze_tables(unanalyzed.tables, reference_paragrahs=paras)
-    figures = await analyze_figures(unanalyzed.figures, reference_paragrahs=paras)
-
-    new_paras = {}
-    for i, para in enumerate(paras):
-        new_paras[i] = para
-
-    remove_idxs = set()
-    for tbl in tables:
-        remove_idxs.update(tbl.idx_to_remove)
-    for fig in figures:
-        remove_idxs.update(fig.idx_to_remove)
-
-    for idx in sorted(remove_idxs, reverse=True):
-        if idx in new_paras:
-            del new_paras[idx]
-
-    for tbl in tables:
-        if tbl.idx_to_remove:
-            insert_idx = tbl.idx_to_remove[0]
-            new_paras[insert_idx] = AnalyzedParagraph(
-                content=tbl.content,
-                page=tbl.page,
-                polygon=[]
-            )
+    return await format_result(unanalyzed)
 
-    for fig in figures:
-        if fig.idx_to_remove:
-            insert_idx = fig.idx_to_remove[0]
-            new_paras[insert_idx] = AnalyzedParagraph(
-                content=fig.content,
-                page=fig.page,
-                polygon=[]
-            )
+
+async def format_file_stream(
+    blob_url: str,
+    mock_path: str | None = None,
+    *,
+    content: bytes | None = None,
+    digest: str | None = None,
+    cache: OcrResultCache | None = None,
+) -> AsyncIterator[FormattedPage]:
+    """ Streaming variant of `format_file`, yielding each page as soon as it is formatted.
+    Args:
+        blob_url (str): The URL of the document to analyze.
+        mock_path (str | None): Optional path to a mock JSON file for testing purposes.
+        content (bytes | None): The document bytes, if already downloaded. See `read`.
+        digest (str | None): The sha256 of the document bytes, if already known. See `read`.
+        cache (OcrResultCache | None): The OCR result cache to consult first.
+
+    Yields:
+        FormattedPage: The markdown of each page, in order.
+
+    Raises:
+        Exception: The error of `read`.
+    """
+    unanalyzed, error = await read(blob_url, mock_path, content=content, digest=digest, cache=cache)
+    if error or not unanalyzed:
+        raise error or ValueError(f"No analysis result for {blob_url}.")
+
+    async for page in iter_pages(unanalyzed):
+        yield page
+
+
+async def format_result(
+    unanalyzed: mdl.AnalyzeResult | dict[str, Any],
+) -> Tuple[List[str], Exception | None]:
+    """ Formats paragraphs, tables, and figures of an analysis result and returns the result as markdown.
+    Args:
+        unanalyzed (mdl.AnalyzeResult | dict[str, Any]): The result of `read`, or its `as_dict()` form.
     
-    sorted_items = sorted(new_paras.items(), key=lambda x: x[0])
-    result_markdown: dict[int, str] = {}
-    for idx, para in sorted_items:
-        current_page = result_markdown.get(para.page, "")
-        current_page += para.content + "\n\n"
-        result_markdown[para.page] = current_page
+    Returns:
+        Tuple[List[str], Exception | None]: A tuple containing the markdown result per page and any exception that occurred
+    """
+    return [page.content async for page in iter_pages(unanalyzed)], None
+
 
-    markdown_per_page = [content for _, content in result_markdown.items()]
+async def iter_pages(
+    unanalyzed: mdl.AnalyzeResult | dict[str, Any],
+    *,
+    pages_per_part: int = 8,
+) -> AsyncIterator[FormattedPage]:
+    """ Formats an analysis result page by page.
+
+    The result is split into runs of about `pages_per_part` pages, see `split_pages`, and each run is
+    laid out in the process pool, see `layout_pages`. As many runs as the pool has workers are in flight
+    at a time, and the pages of a run are yielded as soon as it and the runs before it are done.
+    Large documents neither block the event loop nor compete with it for the GIL, and the first pages
+    are formatted before the last ones are laid out.
+
+    Args:
+        unanalyzed (mdl.AnalyzeResult | dict[str, Any]): The result of `read`, or its `as_dict()` form.
+        pages_per_part (int): The number of pages laid out in one call to the process pool.
+
+    Yields:
+        FormattedPage: The markdown of each page, in order.
+    """
+    data = unanalyzed if isinstance(unanalyzed, dict) else unanalyzed.as_dict()
+    parts, total_pages = split_pages(data, pages_per_part)
+    remaining = iter(parts)
+    pending: Deque[asyncio.Future[List[str]]] = deque()
+    number = 0
+    try:
+        while True:
+            while len(pending) < max(CONFIG.FORMAT_PROCESS_WORKERS, 1):
+                part = next(remaining, None)
+                if part is None:
+                    break
+                pending.append(asyncio.ensure_future(run_in_process(layout_pages, part)))
+            if not pending:
+                return
+
+            for content in await pending.popleft():
+                number += 1
+                yield FormattedPage(content=content, number=number, total_pages=total_pages)
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def split_pages(
+    unanalyzed: dict[str, Any],
+    pages_per_part: int,
+) -> Tuple[List[dict[str, Any]], int]:
+    """ Splits an analysis result into runs of consecutive pages that can be laid out on their own.
+
+    A run is cut only between pages that no table or figure spans, counting the pages of the paragraphs
+    it references, so `layout_pages` over the runs gives the same pages as over the whole result.
+    Paragraph references are renumbered within each run. When paragraphs are not in page order,
+    the result is kept whole.
 
-    return markdown_per_page, None
+    Args:
+        unanalyzed (dict[str, Any]): The `as_dict()` form of the result of `read`.
+        pages_per_part (int): The number of pages after which a run is cut, where possible.
+
+    Returns:
+        Tuple[List[dict[str, Any]], int]: The runs in reading order, each in the `as_dict()` form,
+            and the number of pages `layout_pages` returns over all of them.
+    """
+    paragraphs: List[dict[str, Any]] = unanalyzed.get("paragraphs") or []
+    tables: List[dict[str, Any]] = unanalyzed.get("tables") or []
+    figures: List[dict[str, Any]] = unanalyzed.get("figures") or []
+
+    para_pages = np.fromiter(
+        accumulate(
+            (_first_page(p) or 0 for p in paragraphs),
+            lambda page, found: found or page,
+            initial=1,
+        ),
+        dtype=np.intp,
+        count=len(paragraphs) + 1,
+    )[1:]
+    item_pages = np.fromiter(
+        (_first_page(item) or 1 for item in [*tables, *figures]),
+        dtype=np.intp,
+        count=len(tables) + len(figures),
+    )
+    item_refs = [_references(t, ("cells", "caption")) for t in tables]
+    item_refs += [_references(f, ("elements", "caption")) for f in figures]
+
+    removed = np.zeros(len(paragraphs), dtype=bool)
+    replaced: dict[int, int] = {}
+    last_page = int(max(para_pages.max(initial=1), item_pages.max(initial=1)))
+    spanned = np.zeros(last_page + 1, dtype=np.intp)
+    for page, refs in zip(item_pages, item_refs):
+        valid = refs[refs < len(paragraphs)]
+        removed[valid] = True
+        if refs.size:
+            replaced[int(refs[0])] = int(page)
+        span = np.append(para_pages[valid], page)
+        spanned[span.min():span.max()] += 1
+    total_pages = len({*para_pages[~removed].tolist(), *replaced.values()})
+
+    if pages_per_part < 1 or np.any(np.diff(para_pages) < 0):
+        return [unanalyzed], total_pages
+
+    ends: List[int] = []
+    start = 1
+    for page in range(1, last_page):
+        if page - start + 1 >= pages_per_part and not spanned[page]:
+            ends.append(page)
+            start = page + 1
+    ends.append(last_page)
+
+    parts: List[dict[str, Any]] = []
+    first_page = 1
+    for end in ends:
+        lo = int(np.searchsorted(para_pages, first_page, side="left"))
+        hi = int(np.searchsorted(para_pages, end, side="right"))
+        in_part = (item_pages >= first_page) & (item_pages <= end)
+        parts.append({
+            "paragraphs": paragraphs[lo:hi],
+            "tables": [
+                _renumber(t, lo, ("cells", "caption"))
+                for t, keep in zip(tables, in_part[:len(tables)]) if keep
+            ],
+            "figures": [
+                _renumber(f, lo, ("elements", "caption"))
+                for f, keep in zip(figures, in_part[len(tables):]) if keep
+            ],
+        })
+        first_page = end + 1
+
+    return parts, total_pages
+
+
+def layout_pages(unanalyzed: dict[str, Any]) -> List[str]:
+    """ Formats paragraphs, tables, and figures of an analysis result into the markdown of each page.
+
+    CPU-bound and free of I/O, with a plain dict in and strings out, so it can run in another process.
+    The result is read in its JSON form with camelCase keys, the `as_dict()` form. Attribute access
+    on the SDK models deserializes on every read, which dominates the time on large documents.
+
+    Args:
+        unanalyzed (dict[str, Any]): The `as_dict()` form of the result of `read`.
+
+    Returns:
+        List[str]: The markdown of each page, in order.
+    """
+    paras = analyze_paragraphs(unanalyzed.get("paragraphs"))
+    tables = analyze_tables(unanalyzed.get("tables"), reference_paragrahs=paras)
+    figures = analyze_figures(
+        unanalyzed.get("figures"), reference_paragrahs=paras, polygons=_polygon_matrix(paras)
+    )
+
+    return [
+        "\n\n".join(parts) + "\n\n"
+        for parts in _group_pages(paras, [*tables, *figures])
+    ]
+
+
+def _group_pages(
+    paras: List[AnalyzedParagraph],
+    replacements: List[AnalyzedTable | AnalyzedFigure],
+) -> List[List[str]]:
+    """ Returns the contents of each page, in reading order.
+
+    Paragraphs referenced by a table or figure are dropped, and the table or figure takes the place
+    of its first referenced paragraph. When several claim the same place, the last one wins.
+    Pages are returned in the order they first appear.
+    """
+    removed = np.zeros(len(paras), dtype=bool)
+    replaced: dict[int, AnalyzedTable | AnalyzedFigure] = {}
+    for item in replacements:
+        idxs = np.asarray(item.idx_to_remove, dtype=np.intp)
+        removed[idxs[idxs < len(paras)]] = True
+        if idxs.size:
+            replaced[int(idxs[0])] = item
+
+    kept = np.flatnonzero(~removed)
+    positions = np.concatenate([kept, np.fromiter(replaced, dtype=np.intp, count=len(replaced))])
+    items: List[AnalyzedParagraph | AnalyzedTable | AnalyzedFigure] = [
+        *(paras[i] for i in kept), *replaced.values()
+    ]
+
+    pages: dict[int, List[str]] = {}
+    for i in np.argsort(positions, kind="stable"):
+        item = items[i]
+        pages.setdefault(item.page, []).append(item.content)
+
+    return list(pages.values())
 
 
 
 async def read(
     blob_url: str,
-    mock_path: str | None = None
+    mock_path: str | None = None,
+    *,
+    content: bytes | None = None,
+    digest: str | None = None,
+    cache: OcrResultCache | None = None,
+    model_id: str = "prebuilt-layout",
 ) -> Tuple[mdl.AnalyzeResult | None, Exception | None]:
     """ Reads a document from Azure Blob Storage and returns the analysis result.
 
+    With a cache and the document's sha256 (`digest`, or computed from `content`), a result
+    already analyzed for the same bytes and model is returned without calling the OCR service.
+    When `content` is given, the bytes are sent to the service instead of `blob_url`.
+
     Args:
         blob_url (str): The URL of the document to analyze.
         mock_path (str | None): Optional path to a mock JSON file for testing purposes.
+            Loaded like a cache entry, either the raw REST response or the result itself.
+        content (bytes | None): The document bytes, if already downloaded.
+        digest (str | None): The sha256 of the document bytes, if already known.
+        cache (OcrResultCache | None): The OCR result cache to consult first and fill after analysis.
+        model_id (str): The Document Intelligence model.
     
     Returns:
         Tuple[mdl.AnalyzeResult | None, Exception | None]: A tuple containing the analysis
     
     """
     if mock_path:
-        with open(mock_path, "r") as f:
-            mock_data = json.load(f)
-        
-        data = mock_data.get('analyzeResult', {})
-        data = _convert_keys_into_snake_case(data)
-        return mdl.AnalyzeResult(**data), None # type: ignore
-
+        try:
+            return mdl.AnalyzeResult(OcrResultCache.load_path(mock_path)), None
+        except Exception as e:
+            return None, e
+
+    if digest is None and content is not None:
+        digest = OcrResultCache.digest(content)
+
+    if cache is not None and digest is not None:
+        cached = await cache.aget(digest, model_id)
+        if cached is not None:
+            return mdl.AnalyzeResult(cached), None
+
+    request = (
+        mdl.AnalyzeDocumentRequest(bytes_source=content)
+        if content is not None
+        else mdl.AnalyzeDocumentRequest(url_source=blob_url)
+    )
     try:
         async with get_ocr() as client:
-            poller = await client.begin_analyze_document(
-                "prebuilt-layout", 
-                mdl.AnalyzeDocumentRequest(url_source=blob_url)
-            )
+            poller = await client.begin_analyze_document(model_id, request)
             result = await poller.result()
     except Exception as e:
         return None, e
+
+    if cache is not None and digest is not None:
+        await cache.aset(digest, model_id, result.as_dict())
     
     return result, None
 
 
 
 
-async def analyze_paragraphs(
-    unanalyzed: List[mdl.DocumentParagraph] | None
+def analyze_paragraphs(
+    unanalyzed: List[dict[str, Any]] | None
 ) -> List[AnalyzedParagraph]:
     """ Anaylzes Azure's paragraphs from the document 
     and returns a list of AnalyzedParagraph.
 
     Args:
-        unanalyzed (List[mdl.DocumentParagraph] | None): List of paragraphs to analyze.
+        unanalyzed (List[dict[str, Any]] | None): List of paragraphs to analyze, in their JSON form.
     Returns:
         out(List[AnalyzedParagraph]): A list of AnalyzedParagraph objects containing the content and page number.
     """
@@ -198,30 +428,30 @@ async def analyze_paragraphs(
     pagenum = 1
     for p in unanalyzed:
         polygon = []
-        if p.bounding_regions:
-            pagenum = p.bounding_regions[0].page_number
-            polygon = p.bounding_regions[0].polygon
+        regions = p.get("boundingRegions")
+        if regions:
+            pagenum = regions[0]["pageNumber"]
+            polygon = regions[0].get("polygon") or []
 
-        content = p.content
+        content = p["content"]
         for old, new in replace_map.items():
             content = content.replace(old, new)
-        if p.role and isinstance(p.role, mdl.ParagraphRole):
-            prefix = role_prefix.get(p.role, "")
-            suffix = role_suffix.get(p.role, "")
-            content = f"{prefix}{p.content}{suffix}"
+        role = p.get("role")
+        if role in role_prefix:
+            content = f"{role_prefix[role]}{p['content']}{role_suffix[role]}"
 
         paragraphs.append(AnalyzedParagraph(content=content, page=pagenum, polygon=polygon))
 
     return paragraphs
 
 
-async def analyze_tables(
-    unanalyzed: List[mdl.DocumentTable] | None,
+def analyze_tables(
+    unanalyzed: List[dict[str, Any]] | None,
     reference_paragrahs: List[AnalyzedParagraph],
 ) -> List[AnalyzedTable]: 
     """ Analyzes tables from the document and returns a markdown representation and index number of paragraphs to remove.
     Args:
-        unanalyzed (List[mdl.DocumentTable] | None): List of tables to analyze.
+        unanalyzed (List[dict[str, Any]] | None): List of tables to analyze, in their JSON form.
         reference_paragrahs (List[AnalyzedParagraph]): List of paragraphs to reference for table analysis.
 
     Returns:
@@ -234,63 +464,55 @@ async def analyze_tables(
         return tables
 
     for t in unanalyzed:
-        idx_to_rm: List[int] = []
-        table_analyzed: List[List[str]] = []
-        page = t.bounding_regions[0].page_number if t.bounding_regions else 1
-        for _ in range(t.row_count):
-            table_analyzed.append([""] * (t.column_count))
-
-        for cell in t.cells:
-            rowidx = cell.row_index
-            colidx = cell.column_index
-            
-            cell_content = cell.content
-            if cell.elements:
-                reference = cell.elements[0].split("/")[-1]
-                if reference.isdigit():
-                    cell_content = reference_paragrahs[int(reference)].content
-
-            table_analyzed[rowidx][colidx] = cell_content
-
-            if cell.elements:
-                para_idxs = cell.elements
-                for idx in para_idxs:
-                    target = idx.split("/")[-1]
-                    if target.isdigit():
-                        idx_to_rm.append(int(target))
-
-        markdown_document = ""
+        regions = t.get("boundingRegions")
+        page = regions[0]["pageNumber"] if regions else 1
+        table_analyzed = [[""] * t["columnCount"] for _ in range(t["rowCount"])]
+        idx_parts: List[np.ndarray] = []
+
+        for cell in t["cells"]:
+            cell_content = cell["content"]
+            refs = _element_indices(cell.get("elements"))
+            if refs.size:
+                if refs[0] >= 0:
+                    cell_content = reference_paragrahs[refs[0]].content
+                idx_parts.append(refs[refs >= 0])
+
+            table_analyzed[cell["rowIndex"]][cell["columnIndex"]] = cell_content
+
+        lines: List[str] = []
         for rowidx, rowcontent in enumerate(table_analyzed):
-            markdown = "| " + " | ".join(rowcontent) + " |"
+            lines.append("| " + " | ".join(rowcontent) + " |")
             if rowidx == 0:
-                markdown += "\n" + "| " + " | ".join(["---"] * len(rowcontent)) + " |"
-            markdown_document += markdown + "\n"
+                lines.append("| " + " | ".join(["---"] * len(rowcontent)) + " |")
 
-        caption = t.caption
+        caption = t.get("caption")
         if caption:
-            markdown_document += f"*{caption.content}*\n"
-            eles_to_rm = caption.elements
-            if eles_to_rm:
-                for idx in eles_to_rm:
-                    target = idx.split("/")[-1]
-                    if target.isdigit():
-                        idx_to_rm.append(int(target))
-        
+            lines.append(f"*{caption['content']}*")
+            refs = _element_indices(caption.get("elements"))
+            idx_parts.append(refs[refs >= 0])
+
         tables.append(
-            AnalyzedTable(content=markdown_document, idx_to_remove=idx_to_rm, page=page)
+            AnalyzedTable(
+                content="".join(line + "\n" for line in lines),
+                idx_to_remove=np.concatenate(idx_parts).tolist() if idx_parts else [],
+                page=page,
+            )
         )
 
     return tables
 
-async def analyze_figures(
-    unanalyzed: List[mdl.DocumentFigure] | None,
+def analyze_figures(
+    unanalyzed: List[dict[str, Any]] | None,
     reference_paragrahs: List[AnalyzedParagraph],
+    *,
+    polygons: np.ndarray | None = None,
 ) -> List[AnalyzedFigure]: 
     """Analyzes figures from the document and returns a list of AnalyzedFigure.
     
     Args:
-        unanalyzed (List[mdl.DocumentFigure] | None): List of figures to analyze.
+        unanalyzed (List[dict[str, Any]] | None): List of figures to analyze, in their JSON form.
         reference_paragrahs (List[AnalyzedParagraph]): List of paragraphs to reference for figure analysis.
+        polygons (np.ndarray | None): `_polygon_matrix` of the paragraphs, if already built.
     
     Returns:
         List[AnalyzedFigure]: A list containing the analyzed figures.
@@ -300,30 +522,25 @@ async def analyze_figures(
     if not unanalyzed:
         return figures
 
+    if polygons is None:
+        polygons = _polygon_matrix(reference_paragrahs)
+
     for f in unanalyzed:
-        idx_to_rm: List[int] = []
+        regions = f.get("boundingRegions")
+        refs = _element_indices(f.get("elements"))
+        element_idxs = refs[refs >= 0]
+        idx_parts = [element_idxs]
+
         figure_caption = ""
-        figure_elements: List[AnalyzedParagraph] = []
-
-        if f.elements:
-            for idx in f.elements:
-                target = idx.split("/")[-1]
-                if target.isdigit():
-                    content_idx = int(target)
-                    parafound = reference_paragrahs[content_idx]
-                    figure_elements.append(parafound)
-                    idx_to_rm.append(int(target))
-        
-        if f.caption:
-            figure_caption = f.caption.content
-            if f.caption.elements:
-                for idx in f.caption.elements:
-                    target = idx.split("/")[-1]
-                    if target.isdigit():
-                        idx_to_rm.append(int(target))
+        caption = f.get("caption")
+        if caption:
+            figure_caption = caption["content"]
+            caption_refs = _element_indices(caption.get("elements"))
+            idx_parts.append(caption_refs[caption_refs >= 0])
 
         rendered = _ascii_render(
-            elements=figure_elements, 
+            contents=[reference_paragrahs[i].content for i in element_idxs],
+            polygons=polygons[element_idxs],
             width=60, 
             height=20,
             caption=figure_caption,
@@ -332,23 +549,107 @@ async def analyze_figures(
         figures.append(
             AnalyzedFigure(
                 content=rendered,
-                page=f.bounding_regions[0].page_number if f.bounding_regions else 1,
-                idx_to_remove=idx_to_rm,
+                page=regions[0]["pageNumber"] if regions else 1,
+                idx_to_remove=np.concatenate(idx_parts).tolist(),
             )
         )
     return figures
 
+
+def _element_indices(elements: List[str] | None) -> np.ndarray:
+    """ Parses element references such as `/paragraphs/12` into paragraph indices.
+    References whose last segment is not a number are -1.
+    """
+    if not elements:
+        return np.empty(0, dtype=np.intp)
+
+    targets = (ref.rpartition("/")[2] for ref in elements)
+    return np.fromiter(
+        (int(target) if target.isdigit() else -1 for target in targets),
+        dtype=np.intp,
+        count=len(elements),
+    )
+
+
+def _first_page(element: dict[str, Any]) -> int | None:
+    """ Returns the page of the first bounding region of a paragraph, table or figure, if any. """
+    regions = element.get("boundingRegions")
+    return regions[0]["pageNumber"] if regions else None
+
+
+def _element_lists(element: dict[str, Any], keys: Tuple[str, ...]) -> List[List[str] | None]:
+    """ Returns the element references of a table (`cells`, `caption`) or figure (`elements`, `caption`),
+    in the order `analyze_tables` and `analyze_figures` read them.
+    """
+    lists: List[List[str] | None] = []
+    for key in keys:
+        value = element.get(key)
+        if key == "cells":
+            lists.extend(cell.get("elements") for cell in value or [])
+        elif key == "elements":
+            lists.append(value)
+        elif value:
+            lists.append(value.get("elements"))
+    return lists
+
+
+def _references(element: dict[str, Any], keys: Tuple[str, ...]) -> np.ndarray:
+    """ Returns the paragraph indices a table or figure replaces, in the order of its `idx_to_remove`. """
+    parts = [_element_indices(elements) for elements in _element_lists(element, keys)]
+    refs = np.concatenate(parts) if parts else np.empty(0, dtype=np.intp)
+    return refs[refs >= 0]
+
+
+def _renumber(element: dict[str, Any], offset: int, keys: Tuple[str, ...]) -> dict[str, Any]:
+    """ Returns a copy of a table or figure whose paragraph references are shifted down by `offset`. """
+    def remap(elements: List[str] | None) -> List[str] | None:
+        if not elements:
+            return elements
+        remapped: List[str] = []
+        for ref in elements:
+            prefix, _, target = ref.rpartition("/")
+            if target.isdigit():
+                ref = f"{prefix}/{int(target) - offset}"
+            remapped.append(ref)
+        return remapped
+
+    copy = dict(element)
+    for key in keys:
+        value = element.get(key)
+        if key == "cells":
+            copy[key] = [{**cell, "elements": remap(cell.get("elements"))} for cell in value or []]
+        elif key == "elements":
+            copy[key] = remap(value)
+        elif value:
+            copy[key] = {**value, "elements": remap(value.get("elements"))}
+    return copy
+
+
+def _polygon_matrix(paragraphs: List[AnalyzedParagraph]) -> np.ndarray:
+    """ Stacks the paragraph polygons into one `(n, 2 * max_points)` array of x, y pairs, padded with NaN. """
+    lengths = np.fromiter((len(p.polygon) for p in paragraphs), dtype=np.intp, count=len(paragraphs))
+    width = max(int(lengths.max(initial=0)), 2)
+    matrix = np.full((len(paragraphs), width), np.nan)
+    if lengths.any():
+        mask = np.arange(width) < lengths[:, None]
+        matrix[mask] = np.fromiter(
+            (v for p in paragraphs for v in p.polygon), dtype=np.float64, count=int(lengths.sum())
+        )
+    return matrix
+
         
 def _ascii_render(
-    elements: List[AnalyzedParagraph], 
+    contents: List[str],
+    polygons: np.ndarray,
     width=60, 
     height=20,
     caption: str | None = None
 ) -> str:
-    """ Renders a list of AnalyzedParagraph elements into ASCII art.
+    """ Renders paragraphs at their position into ASCII art.
 
     Args:
-        elements (List[AnalyzedParagraph]): List of AnalyzedParagraph elements to render.
+        contents (List[str]): The content of each paragraph to render.
+        polygons (np.ndarray): The rows of `_polygon_matrix` for the same paragraphs.
         width (int): Width of the ASCII art canvas.
         height (int): Height of the ASCII art canvas.
         caption (str | None): Optional caption to append at the end of the ASCII art.
@@ -357,65 +658,27 @@ def _ascii_render(
         str: The rendered ASCII art as a string.
     
     """
+    canvas = np.full((height, width), " ", dtype="<U1")
 
-    all_x = []
-    all_y = []
+    xs, ys = polygons[:, 0::2], polygons[:, 1::2]
+    counts = np.count_nonzero(~np.isnan(xs), axis=1)
+    placed = np.flatnonzero(counts > 0)
 
-    for elem in elements:
-        all_x.extend(elem.polygon[0::2])
-        all_y.extend(elem.polygon[1::2])
-    
-    min_x, max_x = min(all_x), max(all_x)
-    min_y, max_y = min(all_y), max(all_y)
-    
-    canvas = [[' ' for _ in range(width)] for _ in range(height)]
-    
-    for elem in elements:
+    if placed.size:
+        min_x, max_x = np.nanmin(xs[placed]), np.nanmax(xs[placed])
+        min_y, max_y = np.nanmin(ys[placed]), np.nanmax(ys[placed])
 
-        x = np.mean(elem.polygon[0::2])
-        y = np.mean(elem.polygon[1::2])
-        
-        cx = int((x - min_x) / (max_x - min_x) * (width - 1))
-        cy = int((y - min_y) / (max_y - min_y) * (height - 1))
-        
-        text = elem.content
-        for i, char in enumerate(text):
-            if 0 <= cx + i < width and 0 <= cy < height:
-                canvas[cy][cx + i] = char
+        centroid_x = np.nansum(xs[placed], axis=1) / counts[placed]
+        centroid_y = np.nansum(ys[placed], axis=1) / counts[placed]
+
+        cols = ((centroid_x - min_x) / ((max_x - min_x) or 1) * (width - 1)).astype(np.intp)
+        rows = ((centroid_y - min_y) / ((max_y - min_y) or 1) * (height - 1)).astype(np.intp)
+
+        for i, col, row in zip(placed, cols, rows):
+            chars = list(contents[i][:width - col])
+            canvas[row, col:col + len(chars)] = chars
     
-    ascii_art = '\n'.join([''.join(row) for row in canvas]) 
+    ascii_art = '\n'.join(''.join(row) for row in canvas)
     if caption:
         ascii_art += f"\n\n*{caption}*"
     return ascii_art
-
-
-def _convert_to_snakecase(value: str) -> str:
-    """
-    Converts a string to snake_case.
-    
-    Args:
-        value (str): The string to convert.
-    
-    Returns:
-        str: The converted string in snake_case.
-    """
-    return ''.join(['_' + i.lower() if i.isupper() else i for i in value]).lstrip('_')
-
-def _convert_keys_into_snake_case(data: Any) -> Any:
-    """ Recursively converts keys in a dictionary or list to snake_case.
-    
-    Args:
-        data (Any): The data structure to convert.
-
-    Returns:
-        Any: The converted data structure with keys in snake_case.
-    """
-
-    if isinstance(data, dict):
-        return {_convert_to_snakecase(key): _convert_keys_into_snake_case(value) for key, value in data.items()}
-    elif isinstance(data, list):
-        return [_convert_keys_into_snake_case(item) for item in data]
-    return data
-
-
-
@@ -1,7 +1,11 @@
 import datetime as dt
+import functools
 import uuid
 from typing import (
+    Any,
     List,
+    Literal,
+    Self,
     TypeVar, 
 )
 
@@ -9,6 +13,8 @@ import elasticsearch.dsl as dsl
 
 from pydantic import BaseModel, Field, ConfigDict
 
+from backend.rag.dedup import band_keys
+
 class IndexFileMeta(dsl.InnerDoc):
     file_id = dsl.Keyword()
     file_path = dsl.Keyword()
@@ -26,16 +32,66 @@ class IndexPageMeta(dsl.InnerDoc):
     total_pages = dsl.Integer()
     prev = dsl.Integer()
     next = dsl.Integer()
+    chunk_index = dsl.Integer()
+
+DEFAULT_DIMENSIONS = 1536
+
+VectorIndexTypeLiteral = Literal['hnsw', 'int8_hnsw', 'int4_hnsw', 'bbq_hnsw']
 
 class Index(dsl.AsyncDocument):
     document_id = dsl.Keyword()
     content = dsl.Text(analyzer="nori")
-    vector = dsl.DenseVector(dims=1536)
+    vector = dsl.DenseVector(dims=DEFAULT_DIMENSIONS)
     tags = dsl.Keyword()
     page_meta = dsl.Object(IndexPageMeta)
     file_meta = dsl.Object(IndexFileMeta)
     created_at = dsl.Date()
     updated_at = dsl.Date()
+    signature = dsl.Keyword(index=False, doc_values=False)
+    signature_bands = dsl.Keyword()
+    duplicate_of = dsl.Keyword()
+
+
+SIGNATURE_MAPPING = {
+    "signature": {"type": "keyword", "index": False, "doc_values": False},
+    "signature_bands": {"type": "keyword"},
+    "duplicate_of": {"type": "keyword"},
+}
+
+
+@functools.lru_cache(maxsize=None)
+def index_definition(
+    dims: int = DEFAULT_DIMENSIONS,
+    index_type: VectorIndexTypeLiteral | None = None,
+) -> type[Index]:
+    """ Returns the `Index` mapping with the vector field sized to `dims` and quantized with `index_type`.
+
+    Args:
+        dims (int): The number of dimensions of the stored vectors.
+        index_type (VectorIndexTypeLiteral | None): The ES `index_options.type` of the vector field.
+            None keeps the Elasticsearch default.
+
+    Returns:
+        type[Index]: `Index` itself for the defaults, otherwise a subclass overriding `vector`.
+    """
+    if dims == DEFAULT_DIMENSIONS and index_type is None:
+        return Index
+
+    vector_options: dict = {"dims": dims, "similarity": "cosine"}
+    if index_type is not None:
+        vector_options["index_options"] = {"type": index_type}
+
+    return type(
+        f"Index{dims}{index_type or ''}",
+        (Index,),
+        {"vector": dsl.DenseVector(**vector_options)},
+    )
+
+
+def _parse_datetime(value: Any) -> Any:
+    if isinstance(value, str):
+        return dt.datetime.fromisoformat(value)
+    return value
 
 
 class PageMeta(BaseModel):
@@ -49,6 +105,13 @@ class PageMeta(BaseModel):
         ...,
         description="Total number of pages in the document."
     )
+    chunk_index: int = Field(
+        default=-1,
+        description=(
+            "Position of the chunk in its file, counting from 0 across pages. "
+            "-1 for documents indexed before chunks were numbered."
+        )
+    )
 
     @property
     def prev(self) -> int:
@@ -62,14 +125,28 @@ class PageMeta(BaseModel):
             return self.number + 1
         return -1
 
+    @classmethod
+    def from_es_source(cls, source: dict) -> "PageMeta":
+        return cls.model_construct(
+            number=source["number"],
+            total_pages=source["total_pages"],
+            chunk_index=source.get("chunk_index", -1),
+        )
+
     def to_es(self) -> IndexPageMeta:
         return IndexPageMeta(
             number=self.number, # type: ignore
             total_pages=self.total_pages, # type: ignore
             prev=self.prev, # type: ignore
-            next=self.next   # type: ignore
+            next=self.next,   # type: ignore
+            chunk_index=self.chunk_index # type: ignore
         )
 
+def make_document_id(file_id: str, chunk_index: int) -> str:
+    """ Returns the id of the chunk at `chunk_index` of the file, so neighbouring chunks can be fetched by id. """
+    return f"doc-{file_id}-{chunk_index:05d}"
+
+
 class FileMeta(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
@@ -115,6 +192,13 @@ class FileMeta(BaseModel):
     )
 
 
+    @classmethod
+    def from_es_source(cls, source: dict) -> "FileMeta":
+        data = dict(source)
+        data["effective_from"] = _parse_datetime(data.get("effective_from"))
+        data["effective_to"] = _parse_datetime(data.get("effective_to"))
+        return cls.model_construct(**data)
+
     def to_es(self) -> IndexFileMeta:
         return IndexFileMeta(
             file_id=self.file_id, # type: ignore
@@ -158,13 +242,41 @@ class Document(BaseModel):
     updated_at: dt.datetime = Field(
         default_factory=dt.datetime.now
     )
+    signature: str | None = Field(
+        default=None,
+        description="MinHash signature of the content, set by near-duplicate detection."
+    )
+    duplicate_of: str | None = Field(
+        default=None,
+        description=(
+            "Id of the document this one is a near-duplicate of. "
+            "Near-duplicates are stored without a vector and kept out of search results."
+        )
+    )
 
 
     @classmethod
-    def get_es_definition(cls) -> type[Index]:
-        return Index
+    def get_es_definition(
+        cls,
+        dims: int = DEFAULT_DIMENSIONS,
+        index_type: VectorIndexTypeLiteral | None = None,
+    ) -> type[Index]:
+        return index_definition(dims, index_type)
+
+    @classmethod
+    def from_es_source(cls, source: dict) -> Self:
+        """ Builds the document from an ES `_source` without validation.
+        Only for sources written by `to_es`, whose types are already known to be valid.
+        """
+        data = dict(source)
+        data.pop("vector", None)
+        data["page_meta"] = PageMeta.from_es_source(data["page_meta"])
+        data["file_meta"] = FileMeta.from_es_source(data["file_meta"])
+        data["created_at"] = _parse_datetime(data.get("created_at"))
+        data["updated_at"] = _parse_datetime(data.get("updated_at"))
+        return cls.model_construct(**data)
 
-    def to_es(self, vector: List[float]) -> Index:
+    def to_es(self, vector: List[float] | None) -> Index:
 
         return Index(
             document_id=self.document_id, # type: ignore
@@ -174,7 +286,10 @@ class Document(BaseModel):
             page_meta=self.page_meta.to_es(), # type: ignore
             file_meta=self.file_meta.to_es(), # type: ignore
             created_at=self.created_at, # type: ignore
-            updated_at=self.updated_at # type: ignore
+            updated_at=self.updated_at, # type: ignore
+            signature=self.signature, # type: ignore
+            signature_bands=band_keys(self.signature) if self.signature else None, # type: ignore
+            duplicate_of=self.duplicate_of # type: ignore
         ) 
     
     def to_desription(self) -> str:
@@ -202,7 +317,11 @@ class SearchFilter(BaseModel):
         default=0.5,
         lt=1.0,
         gt=0.0,
-        description="Score threshold for filtering results based on stride. Default is 0.5."
+        description=(
+            "Score threshold for pruning hits. With 'rrf' fusion, kNN hits are compared by their similarity score "
+            "and lexical hits by their score relative to the best lexical hit, before fusion. "
+            "With 'combined' fusion, hits are compared by their summed score relative to the best hit. Default is 0.5."
+        )
     )
     effective_at: dt.datetime = Field(
         default_factory=dt.datetime.now,
@@ -212,5 +331,68 @@ class SearchFilter(BaseModel):
         default_factory=list,
         description="List of tags to filter the search results."
     )
+    fusion: Literal['rrf', 'combined'] = Field(
+        default='rrf',
+        description=(
+            "How lexical and kNN hits are merged. "
+            "'rrf' runs both legs as separate ranked lists in one msearch and fuses them with reciprocal rank fusion, "
+            "'combined' runs a single query with both clauses and lets Elasticsearch sum the scores."
+        )
+    )
+    oversample: int = Field(
+        default=2,
+        ge=1,
+        description="Each leg fetches `top_k * oversample` hits before fusion and pruning."
+    )
+    num_candidates: int | None = Field(
+        default=None,
+        gt=0,
+        description="Number of kNN candidates per shard. Defaults to twice the number of fetched hits, at least 50."
+    )
+    rank_constant: int = Field(
+        default=60,
+        ge=1,
+        description="The `k` constant of reciprocal rank fusion. Larger values flatten the contribution of top ranks."
+    )
+    neighbors: int = Field(
+        default=0,
+        ge=0,
+        description=(
+            "Number of chunks before and after each hit, in the same file, merged with it into one passage. "
+            "0 returns the matched chunks alone."
+        )
+    )
+
+class EmbeddingConfig(BaseModel):
+    dimensions: int | None = Field(
+        default=None,
+        gt=0,
+        description=(
+            "Number of dimensions requested from the embedding model. "
+            "text-embedding-3 models shorten their vectors (Matryoshka truncation). None keeps the model default."
+        )
+    )
+    batch_size: int = Field(
+        default=128,
+        gt=0,
+        le=2048,
+        description="Maximum number of texts sent in a single embeddings request."
+    )
+    batch_tokens: int = Field(
+        default=100_000,
+        gt=0,
+        le=300_000,
+        description="Maximum number of tokens sent in a single embeddings request."
+    )
+    max_input_tokens: int = Field(
+        default=8191,
+        gt=0,
+        description="Maximum number of tokens of a single input. Longer texts are reported as failures."
+    )
+    concurrency: int = Field(
+        default=4,
+        gt=0,
+        description="Maximum number of embeddings requests in flight at once."
+    )
 
 DocumentT = TypeVar("DocumentT", bound=Document)
\ No newline at end of file
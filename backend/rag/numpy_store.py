@@ -0,0 +1,507 @@
+import datetime as dt
+import json
+import os
+from typing import Any, List, Tuple
+
+import numpy as np
+
+from openai import AsyncOpenAI
+
+import backend.rag.dedup as dedup
+import backend.rag.models as mdl
+import backend.utils.logger as lg
+
+from backend.rag.cache import AsyncCacheService, SearchResultCache, SEARCH_RESULT_CACHE
+from backend.rag.vectorstore import (
+    BaseVectorStore,
+    EmbeddingError,
+    IndexingError,
+    _best_match,
+    _covers,
+    _file_copy,
+    _reciprocal_rank_fusion,
+)
+
+
+class NumpyVectorStore(BaseVectorStore[mdl.DocumentT]):
+    """ In-process vector store doing exact cosine search over a contiguous float32 matrix.
+
+    Vectors are L2-normalized on insert, so cosine similarity is a single matrix-vector product.
+    Metadata is kept in columnar arrays next to the matrix, and every tag has a precomputed
+    boolean mask, so filters are combined with vectorized `&` instead of per-row checks.
+
+    Near-duplicates linked by `link_duplicates` are stored as rows with a zero vector and masked out of searches,
+    like the documents the Elasticsearch store keeps without a vector.
+
+    The store can be snapshotted to `<snapshot_dir>/<indexname>.npy` (vectors) and
+    `<snapshot_dir>/<indexname>.json` (metadata), and loaded back with the vectors memory-mapped.
+    Intended for small tenants, CI and benchmarks, where running Elasticsearch is not worth it.
+    """
+
+    __create_key = object()
+
+    def __init__(
+        self,
+        key: object,
+        embedding_service: AsyncOpenAI,
+        cache_service: AsyncCacheService,
+        indexname: str,
+        document_class: type[mdl.DocumentT],
+        *,
+        embedding_model: str = "text-embedding-3-small",
+        embedding_config: mdl.EmbeddingConfig | None = None,
+        snapshot_dir: str | None = None,
+        result_cache: SearchResultCache | None = SEARCH_RESULT_CACHE,
+    ) -> None:
+
+        if key != NumpyVectorStore.__create_key:
+            raise ValueError("Use the create method to instantiate NumpyVectorStore.")
+
+        super().__init__(
+            embedding_service=embedding_service,
+            cache_service=cache_service,
+            indexname=indexname,
+            document_class=document_class,
+            embedding_model=embedding_model,
+            embedding_config=embedding_config,
+            result_cache=result_cache,
+        )
+        self.snapshot_dir = snapshot_dir
+        self._reset()
+
+    @classmethod
+    async def create(
+        cls,
+        embedding_service: AsyncOpenAI,
+        cache_service: AsyncCacheService,
+        indexname: str,
+        document_class: type[mdl.DocumentT],
+        *,
+        embedding_model: str = "text-embedding-3-small",
+        embedding_config: mdl.EmbeddingConfig | None = None,
+        snapshot_dir: str | None = None,
+        result_cache: SearchResultCache | None = SEARCH_RESULT_CACHE,
+    ) -> "NumpyVectorStore[mdl.DocumentT]":
+        store = cls(
+            key=cls.__create_key,
+            embedding_service=embedding_service,
+            cache_service=cache_service,
+            indexname=indexname,
+            document_class=document_class,
+            embedding_model=embedding_model,
+            embedding_config=embedding_config,
+            snapshot_dir=snapshot_dir,
+            result_cache=result_cache,
+        )
+        if snapshot_dir and os.path.exists(store._snapshot_path(".npy")):
+            err = store.load()
+            if err:
+                raise ValueError(f"Failed to load snapshot of index {indexname}: {err}")
+
+        return store
+
+    def __len__(self) -> int:
+        return int(self._size - self._is_deleted[:self._size].sum())
+
+    async def delete_vectorstore(self) -> Exception | None:
+        self._reset()
+        self._invalidate_results()
+        if not self.snapshot_dir:
+            return None
+
+        try:
+            for suffix in (".npy", ".json"):
+                path = self._snapshot_path(suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+        except Exception as e:
+            return e
+
+        return None
+
+    async def add_documents(
+        self,
+        documents: List[mdl.DocumentT],
+        *,
+        vectors: dict[str, List[float]] | None = None,
+    ) -> Tuple[List[str], Exception | None]:
+        """ Embeds the documents and appends them to the matrix.
+        Documents whose id already exists replace the previous row.
+        Precomputed `vectors`, keyed by `document_id`, skip the embedding.
+        Near-duplicates linked by `link_duplicates` are added without a vector.
+
+        Returns:
+            Tuple[List[str], Exception | None]: The ids of the added documents,
+                and an `IndexingError` listing the documents that failed, if any.
+        """
+        success_docs: List[str] = []
+        failures: dict[str, Exception] = {}
+
+        vectors, err = await self._resolve_vectors(
+            [doc for doc in documents if not doc.duplicate_of],
+            vectors,
+        )
+        if isinstance(err, EmbeddingError):
+            failures.update(err.failures)
+        elif err:
+            return success_docs, err
+
+        embedded = [doc for doc in documents if doc.duplicate_of or doc.document_id in vectors]
+        if not embedded:
+            return success_docs, IndexingError(failures) if failures else None
+
+        dims = self._vectors.shape[1] if self._size else next(
+            (len(vectors[doc.document_id]) for doc in embedded if not doc.duplicate_of),
+            self.embedding_config.dimensions or mdl.DEFAULT_DIMENSIONS,
+        )
+        matrix = np.zeros((len(embedded), dims), dtype=np.float32)
+        for i, doc in enumerate(embedded):
+            if doc.duplicate_of:
+                continue
+            vector = vectors[doc.document_id]
+            if len(vector) != dims:
+                return success_docs, ValueError(f"Expected {dims} dimensions, got {len(vector)}.")
+            matrix[i] = vector
+
+        now = dt.datetime.now()
+        for doc in embedded:
+            doc.created_at = now
+            doc.updated_at = now
+
+        self._delete_rows([doc.document_id for doc in embedded])
+        self._append(embedded, matrix)
+        self._invalidate_results()
+        success_docs = [doc.document_id for doc in embedded]
+
+        if failures:
+            return success_docs, IndexingError(failures)
+
+        return success_docs, None
+
+    async def delete_by_ids(
+        self,
+        ids: List[str]
+    ) -> Tuple[List[str], Exception | None]:
+        """ Deletes the documents. Near-duplicates linked to a deleted document are promoted first,
+        so their content stays searchable.
+        """
+        if not ids:
+            return [], None
+
+        err = await self._promote_duplicates(ids)
+        if err:
+            return [], err
+
+        deleted = self._delete_rows(ids)
+        if deleted:
+            self._invalidate_results()
+        return deleted, None
+
+    async def _promote_duplicates(self, ids: List[str]) -> Exception | None:
+        """ Gives the near-duplicates linked to `ids` the vector of their document, or a new one if it has none,
+        and unlinks them.
+        """
+        deleted = set(ids)
+        linked = [
+            (self._row_by_id[document_id], canonical_id)
+            for canonical_id in deleted
+            for document_id in self._linked.get(canonical_id, ())
+            if document_id not in deleted and document_id in self._row_by_id
+        ]
+        if not linked:
+            return None
+
+        fresh, err = await self._aembed({
+            str(row): self._documents[row].content  # type: ignore
+            for row, canonical_id in linked if canonical_id not in self._row_by_id
+        })
+        if err:
+            return err
+
+        self._ensure_capacity(self._size, self._vectors.shape[1])
+        for row, canonical_id in linked:
+            canonical_row = self._row_by_id.get(canonical_id)
+            if canonical_row is None:
+                self._vectors[row] = _normalize(np.asarray(fresh[str(row)], dtype=np.float32))
+            else:
+                self._vectors[row] = self._vectors[canonical_row]
+            doc = self._documents[row].model_copy(update={"duplicate_of": None})  # type: ignore
+            self._documents[row] = doc
+            self._is_duplicate[row] = False
+            if doc.signature:
+                self._signatures.add(doc.signature, doc)
+        for canonical_id in deleted:
+            self._linked.pop(canonical_id, None)
+
+        self._invalidate_results()
+        lg.logger.info(f"Promoted {len(linked)} near-duplicate documents on index {self.indexname}")
+        return None
+
+    async def get_documents(
+        self,
+        ids: List[str],
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]:
+        rows = (self._row_by_id.get(document_id) for document_id in ids)
+        return [self._documents[row] for row in rows if row is not None], None  # type: ignore
+
+    async def copy_file_documents(
+        self,
+        source_file_id: str,
+        file_meta: dict[str, Any],
+    ) -> Tuple[List[str], Exception | None]:
+        """ Copies the documents of a file as documents of another file with the same content,
+        linked to their source like `VectorStore.copy_file_documents` does.
+        """
+        rows = sorted(
+            row for row in self._row_by_id.values()
+            if self._documents[row].file_meta.file_id == source_file_id  # type: ignore
+        )
+        now = dt.datetime.now()
+        copies = [_file_copy(self._documents[row], file_meta, now) for row in rows]  # type: ignore
+        if not copies:
+            return [], None
+
+        return await self.add_documents(copies, vectors={
+            copy.document_id: self._vectors[row].tolist()
+            for copy, row in zip(copies, rows) if not copy.duplicate_of
+        })
+
+    async def _link_indexed(
+        self,
+        documents: List[mdl.DocumentT],
+        *,
+        threshold: float,
+        candidates: int,
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]:
+        """ Compares the documents with every live document sharing a signature band with them. """
+        duplicates: List[mdl.DocumentT] = []
+        for doc in documents:
+            doc.duplicate_of = _best_match(
+                doc.signature,  # type: ignore
+                (
+                    (signature, other.document_id)
+                    for signature, other in self._signatures.candidates(doc.signature)  # type: ignore
+                    if other.document_id != doc.document_id and self._is_live(other) and _covers(other, doc)
+                ),
+                threshold,
+            )
+            if doc.duplicate_of:
+                duplicates.append(doc)
+
+        return duplicates, None
+
+    async def _search(
+        self,
+        query: str,
+        filter: mdl.SearchFilter
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]:
+        vector_key = "query_vector"
+        vector, err = await self._aembed({
+            vector_key: query
+        })
+        if err or vector_key not in vector:
+            return [], err or ValueError("Failed to embed the query.")
+
+        rows = self._rank(vector[vector_key], filter, filter.top_k)
+        if rows.size == 0:
+            return [], ValueError("No results found.")
+
+        return [self._documents[row] for row in rows], None  # type: ignore
+
+    async def _search_many(
+        self,
+        searches: List[Tuple[str, mdl.SearchFilter]],
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]:
+        """ Ranks the documents for every query, all embedded in one `_aembed` call, and fuses the rankings. """
+        vectors, err = await self._aembed({
+            f"query_vector_{i}": query for i, (query, _) in enumerate(searches)
+        })
+        if err:
+            return [], err
+
+        ranked_lists = [
+            [
+                {"_id": int(row)}
+                for row in self._rank(vectors[f"query_vector_{i}"], filter, filter.top_k * filter.oversample)
+            ]
+            for i, (_, filter) in enumerate(searches)
+        ]
+        top_k = max(filter.top_k for _, filter in searches)
+        fused = _reciprocal_rank_fusion(ranked_lists, rank_constant=searches[0][1].rank_constant)
+        if not fused:
+            return [], ValueError("No results found.")
+
+        return [self._documents[hit["_id"]] for hit in fused[:top_k]], None  # type: ignore
+
+    def _rank(self, query_vector: List[float], filter: mdl.SearchFilter, k: int) -> np.ndarray:
+        """ Returns the rows of the `k` documents matching the filter most similar to the query, best first. """
+        candidates = np.flatnonzero(self._filter_mask(filter))
+        if candidates.size == 0:
+            return candidates
+
+        scores = self._vectors[candidates] @ _normalize(np.asarray(query_vector, dtype=np.float32))
+        k = min(k, candidates.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return candidates[top[np.argsort(-scores[top])]]
+
+    def _is_live(self, doc: mdl.DocumentT) -> bool:
+        """ Whether `doc` is the current, searchable version of its document. """
+        row = self._row_by_id.get(doc.document_id)
+        return row is not None and self._documents[row] is doc and not doc.duplicate_of
+
+    def snapshot(self) -> Exception | None:
+        """ Writes the live rows to `<snapshot_dir>/<indexname>.npy` and `.json`. """
+        if not self.snapshot_dir:
+            return ValueError("snapshot_dir is not configured.")
+
+        live = np.flatnonzero(~self._is_deleted[:self._size])
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            np.save(self._snapshot_path(".npy"), np.ascontiguousarray(self._vectors[live]))
+            with open(self._snapshot_path(".json"), "w", encoding="utf-8") as f:
+                json.dump(
+                    [self._documents[row].model_dump(mode="json") for row in live],  # type: ignore
+                    f,
+                    ensure_ascii=False,
+                )
+        except Exception as e:
+            return e
+
+        return None
+
+    def load(self) -> Exception | None:
+        """ Replaces the store with the snapshot. The vectors are memory-mapped read-only
+        and copied into memory on the next `add_documents`.
+        """
+        try:
+            vectors = np.load(self._snapshot_path(".npy"), mmap_mode="r")
+            with open(self._snapshot_path(".json"), "r", encoding="utf-8") as f:
+                documents = [self.document_class.model_validate(d) for d in json.load(f)]
+        except Exception as e:
+            return e
+
+        if len(documents) != vectors.shape[0]:
+            return ValueError(
+                f"Snapshot has {vectors.shape[0]} vectors but {len(documents)} documents."
+            )
+
+        self._reset()
+        self._invalidate_results()
+        self._vectors = vectors
+        self._set_columns(documents, start=0)
+        self._size = len(documents)
+        lg.logger.info(f"Loaded {self._size} documents into index {self.indexname}")
+        return None
+
+    def _snapshot_path(self, suffix: str) -> str:
+        return os.path.join(self.snapshot_dir or "", self.indexname + suffix)
+
+    def _reset(self) -> None:
+        self._size = 0
+        self._vectors: np.ndarray = np.empty((0, 0), dtype=np.float32)
+        self._documents: List[mdl.DocumentT | None] = []
+        self._row_by_id: dict[str, int] = {}
+        self._is_deleted = np.zeros(0, dtype=bool)
+        self._is_duplicate = np.zeros(0, dtype=bool)
+        self._effective_from = np.zeros(0, dtype=np.float64)
+        self._effective_to = np.zeros(0, dtype=np.float64)
+        self._tag_masks: dict[str, np.ndarray] = {}
+        self._linked: dict[str, set[str]] = {}
+        self._signatures: dedup.SignatureIndex[mdl.DocumentT] = dedup.SignatureIndex()
+
+    def _filter_mask(self, filter: mdl.SearchFilter) -> np.ndarray:
+        eff_at = filter.effective_at.timestamp()
+        size = self._size
+        mask = (
+            ~self._is_deleted[:size]
+            & ~self._is_duplicate[:size]
+            & (self._effective_from[:size] <= eff_at)
+            & (self._effective_to[:size] >= eff_at)
+        )
+        for tag in filter.tags:
+            tag_mask = self._tag_masks.get(tag)
+            if tag_mask is None:
+                return np.zeros(size, dtype=bool)
+            mask &= tag_mask[:size]
+        return mask
+
+    def _append(self, documents: List[mdl.DocumentT], matrix: np.ndarray) -> None:
+        start = self._size
+        end = start + len(documents)
+        self._ensure_capacity(end, matrix.shape[1])
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self._vectors[start:end] = matrix / np.where(norms == 0, 1, norms)
+        self._set_columns(documents, start=start)
+        self._size = end
+
+    def _set_columns(self, documents: List[mdl.DocumentT], start: int) -> None:
+        end = start + len(documents)
+        self._ensure_columns(end)
+        self._documents[start:end] = documents
+        self._is_deleted[start:end] = False
+        self._is_duplicate[start:end] = [bool(d.duplicate_of) for d in documents]
+        self._effective_from[start:end] = [d.file_meta.effective_from.timestamp() for d in documents]
+        self._effective_to[start:end] = [d.file_meta.effective_to.timestamp() for d in documents]
+        for row, doc in enumerate(documents, start=start):
+            self._row_by_id[doc.document_id] = row
+            if doc.duplicate_of:
+                self._linked.setdefault(doc.duplicate_of, set()).add(doc.document_id)
+            elif doc.signature:
+                self._signatures.add(doc.signature, doc)
+            for tag in doc.tags:
+                tag_mask = self._tag_masks.get(tag)
+                if tag_mask is None or tag_mask.size < self._is_deleted.size:
+                    tag_mask = self._grow(tag_mask, self._is_deleted.size, bool)
+                    self._tag_masks[tag] = tag_mask
+                tag_mask[row] = True
+
+    def _ensure_capacity(self, size: int, dims: int) -> None:
+        capacity = self._vectors.shape[0]
+        if size <= capacity and self._vectors.flags.writeable:
+            return
+
+        new_capacity = max(size, capacity * 2, 1024)
+        vectors = np.zeros((new_capacity, dims), dtype=np.float32)
+        if self._size:
+            vectors[:self._size] = self._vectors[:self._size]
+        self._vectors = vectors
+
+    def _ensure_columns(self, size: int) -> None:
+        if size <= self._is_deleted.size:
+            return
+
+        new_size = max(size, self._is_deleted.size * 2, 1024)
+        self._is_deleted = self._grow(self._is_deleted, new_size, bool, fill=True)
+        self._is_duplicate = self._grow(self._is_duplicate, new_size, bool)
+        self._effective_from = self._grow(self._effective_from, new_size, np.float64)
+        self._effective_to = self._grow(self._effective_to, new_size, np.float64)
+        self._documents.extend([None] * (new_size - len(self._documents)))
+        for tag, tag_mask in self._tag_masks.items():
+            self._tag_masks[tag] = self._grow(tag_mask, new_size, bool)
+
+    @staticmethod
+    def _grow(array: np.ndarray | None, size: int, dtype: type, fill: bool = False) -> np.ndarray:
+        grown = np.full(size, fill, dtype=dtype) if fill else np.zeros(size, dtype=dtype)
+        if array is not None:
+            grown[:array.size] = array
+        return grown
+
+    def _delete_rows(self, ids: List[str]) -> List[str]:
+        deleted: List[str] = []
+        for document_id in ids:
+            row = self._row_by_id.pop(document_id, None)
+            if row is None:
+                continue
+            duplicate_of = self._documents[row].duplicate_of  # type: ignore
+            if duplicate_of:
+                self._linked.get(duplicate_of, set()).discard(document_id)
+            self._is_deleted[row] = True
+            self._documents[row] = None
+            deleted.append(document_id)
+        return deleted
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
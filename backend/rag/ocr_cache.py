@@ -0,0 +1,70 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any
+
+import backend.utils.logger as lg
+
+
+class OcrResultCache:
+    """ Content-addressed disk cache of Document Intelligence results.
+
+    Entries are keyed by the sha256 of the document bytes and the model id, so the same file
+    uploaded twice, by anyone, or vectorized again, is analyzed once. Each entry is the
+    `AnalyzeResult.as_dict()` JSON, gzip-compressed, stored at `<cache_dir>/<model_id>/<key[:2]>/<key>.json.gz`.
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def digest(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    async def aget(self, digest: str, model_id: str) -> dict[str, Any] | None:
+        path = self._path(digest, model_id)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            data = await asyncio.to_thread(self.load_path, path)
+        except Exception as e:
+            lg.logger.warning(f"Failed to read OCR cache entry {path}: {e}")
+            return None
+
+        lg.logger.info(f"OCR cache hit for {model_id}:{digest}")
+        return data
+
+    async def aset(self, digest: str, model_id: str, data: dict[str, Any]) -> None:
+        try:
+            await asyncio.to_thread(self._write, self._path(digest, model_id), data)
+        except Exception as e:
+            lg.logger.warning(f"Failed to write OCR cache entry for {model_id}:{digest}: {e}")
+
+    @staticmethod
+    def load_path(path: str) -> dict[str, Any]:
+        """ Loads an analysis result from a `.json` or `.json.gz` file.
+        Raw REST responses, with the result under `analyzeResult`, are unwrapped.
+        """
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        return data.get("analyzeResult", data)
+
+    def _path(self, digest: str, model_id: str) -> str:
+        return os.path.join(self.cache_dir, model_id, digest[:2], f"{digest}.json.gz")
+
+    @staticmethod
+    def _write(path: str, data: dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
@@ -0,0 +1,61 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, ParamSpec, TypeVar
+
+import backend.utils.logger as lg
+
+from backend.config import CONFIG
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def get_process_pool(workers: int = CONFIG.FORMAT_PROCESS_WORKERS) -> ProcessPoolExecutor | None:
+    """ Returns the process-wide pool for CPU-bound ingestion work, creating it on first use.
+
+    Workers are spawned rather than forked, since the API process runs threads, and live until
+    `shutdown_process_pool`. None when `workers` is 0, in which case the work runs inline.
+    """
+    global _pool
+    if _pool is None and workers > 0:
+        _pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        lg.logger.info(f"Process pool started with {workers} workers")
+    return _pool
+
+
+def shutdown_process_pool() -> None:
+    """ Shuts the process-wide pool down, if started. Pending work is cancelled. """
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        lg.logger.info("Process pool stopped")
+
+
+async def run_in_process(func: Callable[P, R], *args: P.args, **kwargs: P.kwargs) -> R:
+    """ Runs `func` in the process pool and awaits its result, keeping the event loop free.
+
+    `func`, its arguments and its result cross the process boundary, so they must be picklable:
+    module-level functions or `functools.partial` of them, and plain data. Without a pool,
+    `func` runs inline. A pool broken by a dying worker is replaced on the next call.
+    """
+    pool = get_process_pool()
+    if pool is None:
+        return func(*args, **kwargs)
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, functools.partial(func, *args, **kwargs))
+    except BrokenProcessPool:
+        lg.logger.warning("Process pool is broken, restarting it on the next call")
+        if _pool is pool:
+            shutdown_process_pool()
+        raise
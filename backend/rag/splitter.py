@@ -1,5 +1,11 @@
+import re
 from typing import List
 
+from backend.rag.tokenizer import count_tokens
+
+_WORD = re.compile(r"\s*\S+\s*")
+
+
 def split_by_header(
     text: str,
     delimeter: List[str] = ['##', '###'],
@@ -7,7 +13,7 @@ def split_by_header(
 ) -> List[str]:
     """
     Splits the text into sections based on the specified headers.
-    
+
     Args:
         text (str): The text to be split.
         delimeter (List[str]): List of header prefixes to split by.
@@ -16,27 +22,140 @@ def split_by_header(
     Returns:
         List[str]: A list of sections split by the specified headers.
     """
-    sections = []
-    current_section = ""
-    seen = False
-    
     lines = text.splitlines()
-    for line in lines:
-        if any(
-            line.startswith(header) 
-            for header in delimeter
-        ):
-            if ignore_first_seen_header and not seen:
-                seen = True
-                current_section += line + "\n"
-                continue
-            
-            sections.append(current_section.strip())
-            current_section = ""
-            
-        current_section += line + "\n"
-    
-    sections.append(current_section.strip())
-    
-    return sections
-        
\ No newline at end of file
+    return [
+        "\n".join(lines[start:end]).strip()
+        for start, end in _header_spans(lines, tuple(delimeter), ignore_first_seen_header)
+    ]
+
+
+def split_by_tokens(
+    text: str,
+    *,
+    max_tokens: int = 512,
+    overlap_tokens: int = 64,
+    delimeter: List[str] = ['##', '###'],
+    ignore_first_seen_header: bool = True,
+    model: str = "text-embedding-3-small",
+) -> List[str]:
+    """
+    Splits the text into sections like `split_by_header`, then splits every section longer than
+    `max_tokens` into chunks of at most `max_tokens` tokens.
+
+    Sections are cut at line boundaries, overlong lines at word boundaries, and words longer than
+    the budget at character boundaries, so no text is dropped. Consecutive chunks of the same section
+    repeat up to `overlap_tokens` tokens of whole lines or words. Chunks never span two sections.
+
+    Token counts are summed per line or word, plus one per boundary, which bounds the count of
+    the joined chunk from above for BPE tokenizers.
+
+    Args:
+        text (str): The text to be split.
+        max_tokens (int): Maximum number of tokens of a chunk.
+        overlap_tokens (int): Maximum number of tokens repeated from the end of the previous chunk.
+        delimeter (List[str]): List of header prefixes to split by.
+        ignore_first_seen_header (bool): If True, the first occurrence of a header will not start a new section.
+        model (str): The model whose tokenizer counts the tokens, usually the embedding model.
+
+    Returns:
+        List[str]: The non-empty chunks, in order.
+    """
+    if max_tokens <= 0:
+        raise ValueError("max_tokens must be positive.")
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens // 2))
+
+    lines = text.splitlines(keepends=True)
+    chunks: List[str] = []
+    for start, end in _header_spans(lines, tuple(delimeter), ignore_first_seen_header):
+        section = "".join(lines[start:end]).strip()
+        if not section:
+            continue
+        if count_tokens(section, model) <= max_tokens:
+            chunks.append(section)
+            continue
+
+        units: List[str] = []
+        sizes: List[int] = []
+        for line in lines[start:end]:
+            _add_units(line, units, sizes, max_tokens=max_tokens, model=model)
+        chunks.extend(_pack(units, sizes, max_tokens=max_tokens, overlap_tokens=overlap_tokens))
+
+    return chunks
+
+
+def _header_spans(
+    lines: List[str],
+    delimeter: tuple[str, ...],
+    ignore_first_seen_header: bool,
+) -> List[tuple[int, int]]:
+    """ Returns the `[start, end)` line ranges of the sections. """
+    starts = [
+        idx for idx, line in enumerate(lines) if line.startswith(delimeter)
+    ]
+    if ignore_first_seen_header:
+        starts = starts[1:]
+    bounds = [0, *starts, len(lines)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def _add_units(
+    text: str,
+    units: List[str],
+    sizes: List[int],
+    *,
+    max_tokens: int,
+    model: str,
+) -> None:
+    """ Appends `text` as one unit, or as word and character pieces of at most `max_tokens` tokens. """
+    size = count_tokens(text, model)
+    if size <= max_tokens:
+        units.append(text)
+        sizes.append(size)
+        return
+
+    for word in _WORD.findall(text) or [text]:
+        size = count_tokens(word, model)
+        if size <= max_tokens:
+            units.append(word)
+            sizes.append(size)
+            continue
+
+        start = 0
+        while start < len(word):
+            length = min(len(word) - start, max_tokens)
+            while (size := count_tokens(word[start:start + length], model)) > max_tokens:
+                length = max(1, min(length - 1, length * max_tokens // size))
+            units.append(word[start:start + length])
+            sizes.append(size)
+            start += length
+
+
+def _pack(
+    units: List[str],
+    sizes: List[int],
+    *,
+    max_tokens: int,
+    overlap_tokens: int,
+) -> List[str]:
+    """ Greedily packs consecutive units into chunks of at most `max_tokens`, in one pass.
+    Each chunk after the first starts with the trailing units of the previous one that fit in `overlap_tokens`.
+    """
+    chunks: List[str] = []
+    start = 0
+    tokens = 0
+    emitted = 0
+    for end, size in enumerate(sizes):
+        if start < end and tokens + size + 1 > max_tokens:
+            if end > emitted:
+                chunks.append("".join(units[start:end]).strip())
+                emitted = end
+            while start < end and (tokens > overlap_tokens or tokens + size + 1 > max_tokens):
+                tokens -= sizes[start] + 1
+                start += 1
+
+        tokens += size + 1
+
+    if start < len(units) and len(units) > emitted:
+        chunks.append("".join(units[start:]).strip())
+
+    return [chunk for chunk in chunks if chunk]
@@ -0,0 +1,45 @@
+import functools
+
+import tiktoken
+
+import backend.utils.logger as lg
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@functools.lru_cache(maxsize=16)
+def get_encoding(model: str) -> tiktoken.Encoding | None:
+    """ Returns the tiktoken encoding for the given model, cached per process.
+
+    Args:
+        model (str): The OpenAI model name, e.g. `text-embedding-3-small`.
+
+    Returns:
+        tiktoken.Encoding | None: The encoding for the model, or `cl100k_base` if the model is unknown.
+            None if the encoding files cannot be loaded, e.g. without network access.
+    """
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        lg.logger.warning(f"Failed to load tiktoken encoding for {model}, estimating tokens instead: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str = "text-embedding-3-small") -> int:
+    """ Counts the number of tokens of the text for the given model.
+    Falls back to a conservative estimate of one token per two UTF-8 bytes when no encoding is available.
+
+    Args:
+        text (str): The text to count.
+        model (str): The OpenAI model name.
+
+    Returns:
+        int: The number of tokens.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return (len(text.encode("utf-8")) + 1) // 2
+    return len(encoding.encode(text, disallowed_special=()))
@@ -1,8 +1,13 @@
+import asyncio
+import base64
+import hashlib
 import io
 from contextlib import asynccontextmanager
-from typing import Any, AsyncGenerator, Tuple, BinaryIO
+from typing import Any, AsyncGenerator, Callable, List, Tuple, BinaryIO
 
+from azure.storage.blob import BlobBlock
 from azure.storage.blob.aio import ContainerClient
+from pydantic import BaseModel, Field
 
 from backend.config import CONFIG
 
@@ -34,26 +39,170 @@ async def get_blob(
     finally:
         await container_client.close()
 
+class UploadedBlob(BaseModel):
+    url: str = Field(
+        ...,
+        description="URL of the blob holding the content, an existing one if the content was a duplicate."
+    )
+    digest: str = Field(
+        ...,
+        description="The sha256 of the content, in hex."
+    )
+    size: int = Field(
+        ...,
+        description="Size of the content in bytes."
+    )
+    is_duplicate: bool = Field(
+        default=False,
+        description="Whether a blob with the same content already existed, in which case nothing was committed."
+    )
+
+
 async def upload_file(
     file_stream: io.BytesIO | BinaryIO,
     file_name: str,
-    file_extension: str = ".txt"
-) -> Tuple[str, Exception | None]:
+    file_extension: str = ".txt",
+    *,
+    container_client: ContainerClient | None = None,
+    find_duplicate: Callable[[str], str | None] | None = None,
+    block_size: int = 4 * 1024 * 1024,
+    concurrency: int = 4,
+) -> Tuple[UploadedBlob, Exception | None]:
     """
-    Asynchronously uploads a file to Azure Blob Storage.
+    Asynchronously uploads a file to Azure Blob Storage, hashing it in flight.
+
+    The stream is read in blocks of `block_size`, each block is added to the sha256 and staged
+    with `stage_block`, at most `concurrency` blocks at once, so sending starts with the first block
+    and memory stays bounded. Once the digest is known, `find_duplicate` is asked for the URL of a
+    blob with the same content. If there is one, the staged blocks are never committed, Azure discards them,
+    and that URL is returned. A file of a single block is hashed before sending, so a duplicate costs no upload.
     
     Args:
         file_stream (io.BytesIO): The file stream to upload.
         file_name (str): The name of the file to be uploaded.
+        container_client (ContainerClient | None): A shared client to upload with. 
+            If None, a client is created and closed for this upload.
+        find_duplicate (Callable[[str], str | None] | None): Returns the URL of an existing blob with the given sha256, if any.
+        block_size (int): Size in bytes of the staged blocks.
+        concurrency (int): Maximum number of blocks staged at once.
+    
+    Returns:
+        Tuple[UploadedBlob, Exception | None]: The URL, digest and size of the uploaded blob or an error.
+    """
+    try:
+        if container_client is not None:
+            return await _upload_blob(
+                container_client, file_stream, file_name, file_extension,
+                find_duplicate=find_duplicate, block_size=block_size, concurrency=concurrency,
+            ), None
+
+        async with get_blob() as container_client:
+            uploaded = await _upload_blob(
+                container_client, file_stream, file_name, file_extension,
+                find_duplicate=find_duplicate, block_size=block_size, concurrency=concurrency,
+            )
+    except Exception as e:
+            return UploadedBlob(url="", digest="", size=0), e
+    return uploaded, None
+
+
+async def _upload_blob(
+    container_client: ContainerClient,
+    file_stream: io.BytesIO | BinaryIO,
+    file_name: str,
+    file_extension: str,
+    *,
+    find_duplicate: Callable[[str], str | None] | None,
+    block_size: int,
+    concurrency: int,
+) -> UploadedBlob:
+    blob_client = container_client.get_blob_client(f"{RAG_PATH}/{file_name}.{file_extension}")
+    hasher = hashlib.sha256()
+
+    chunk = await _read(file_stream, block_size)
+    next_chunk = await _read(file_stream, block_size) if chunk else b""
+    if not next_chunk:
+        hasher.update(chunk)
+        digest = hasher.hexdigest()
+        duplicate = find_duplicate(digest) if find_duplicate else None
+        if duplicate:
+            return UploadedBlob(url=duplicate, digest=digest, size=len(chunk), is_duplicate=True)
+
+        await blob_client.upload_blob(chunk, overwrite=True)
+        return UploadedBlob(url=blob_client.url, digest=digest, size=len(chunk))
+
+    blocks: List[BlobBlock] = []
+    pending: set[asyncio.Task] = set()
+    size = 0
+    try:
+        while chunk:
+            hasher.update(chunk)
+            size += len(chunk)
+            block_id = base64.b64encode(f"{len(blocks):08d}".encode()).decode()
+            blocks.append(BlobBlock(block_id=block_id))
+
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+            pending.add(asyncio.create_task(blob_client.stage_block(block_id=block_id, data=chunk)))
+
+            chunk, next_chunk = next_chunk, (await _read(file_stream, block_size) if next_chunk else b"")
+
+        await asyncio.gather(*pending)
+    except BaseException:
+        for task in pending:
+            task.cancel()
+        raise
+
+    digest = hasher.hexdigest()
+    duplicate = find_duplicate(digest) if find_duplicate else None
+    if duplicate:
+        return UploadedBlob(url=duplicate, digest=digest, size=size, is_duplicate=True)
+
+    await blob_client.commit_block_list(blocks)
+    return UploadedBlob(url=blob_client.url, digest=digest, size=size)
+
+
+async def _read(file_stream: io.BytesIO | BinaryIO, size: int) -> bytes:
+    """ Reads a block in a thread, since the stream may be a spooled file on disk. """
+    return await asyncio.to_thread(file_stream.read, size)
+
+
+async def download_file(
+    file_name: str,
+    file_extension: str,
+    *,
+    container_client: ContainerClient | None = None,
+) -> Tuple[bytes, Exception | None]:
+    """
+    Asynchronously downloads a file uploaded with `upload_file`.
+    
+    Args:
+        file_name (str): The name the file was uploaded with.
+        file_extension (str): The extension the file was uploaded with.
+        container_client (ContainerClient | None): A shared client to download with. 
+            If None, a client is created and closed for this download.
     
     Returns:
-        Tuple[str, Exception | None]: The URL of the uploaded blob or an error.
+        Tuple[bytes, Exception | None]: The content of the blob or an error.
     """
     try:
+        if container_client is not None:
+            return await _download_blob(container_client, file_name, file_extension), None
+
         async with get_blob() as container_client:
-            blob_client = container_client.get_blob_client(f"{RAG_PATH}/{file_name}.{file_extension}")
-            await blob_client.upload_blob(file_stream, overwrite=True)
-            endpoint = blob_client.url
+            content = await _download_blob(container_client, file_name, file_extension)
     except Exception as e:
-            return "", e
-    return endpoint, None
+            return b"", e
+    return content, None
+
+
+async def _download_blob(
+    container_client: ContainerClient,
+    file_name: str,
+    file_extension: str,
+) -> bytes:
+    blob_client = container_client.get_blob_client(f"{RAG_PATH}/{file_name}.{file_extension}")
+    downloader = await blob_client.download_blob()
+    return await downloader.readall()
@@ -1,6 +1,13 @@
+import abc
+import asyncio
 import datetime as dt
+import functools
+import time
 import uuid
 from typing import (
+    Any,
+    AsyncIterator,
+    Iterable,
     List,
     Tuple, 
     Generic,
@@ -9,17 +16,535 @@ from typing import (
 import elasticsearch.dsl as dsl
 
 from elasticsearch import AsyncElasticsearch
-from openai import AsyncOpenAI
+from elasticsearch.helpers import async_bulk, async_streaming_bulk
+from openai import AsyncOpenAI, NOT_GIVEN
+from pydantic import TypeAdapter
 
+import backend.rag.dedup as dedup
 import backend.rag.models as mdl
+import backend.utils.logger as lg
 
+from backend.rag.cache import AsyncCacheService, SearchResultCache, SEARCH_RESULT_CACHE
+from backend.rag.process_pool import run_in_process
+from backend.rag.tokenizer import count_tokens
 
 
-class AsyncCacheService: ...
+VECTOR_FIELDS = ["vector"]
+SEARCH_EXCLUDES = [*VECTOR_FIELDS, "signature", "signature_bands"]
+MSEARCH_FILTER_PATH = [
+    "responses.error",
+    "responses.hits.hits._id",
+    "responses.hits.hits._score",
+    "responses.hits.hits._source",
+]
 
-class VectorStore(Generic[mdl.DocumentT]):
+
+class EmbeddingError(Exception):
+    """ Raised when some of the texts could not be embedded.
+
+    `failures` maps each failed key to the exception that caused it.
+    """
+    def __init__(self, failures: dict[str, Exception]) -> None:
+        super().__init__(f"Failed to embed {len(failures)} text(s): {list(failures)[:5]}")
+        self.failures = failures
+
+
+class IndexingError(Exception):
+    """ Raised when some of the documents could not be indexed.
+
+    `failures` maps each failed document id to the exception that caused it,
+    whether it failed at the embedding or at the indexing step.
+    """
+    def __init__(self, failures: dict[str, Exception]) -> None:
+        super().__init__(f"Failed to index {len(failures)} document(s): {list(failures)[:5]}")
+        self.failures = failures
+
+
+class BaseVectorStore(abc.ABC, Generic[mdl.DocumentT]):
+    """ Backend-independent part of a vector store.
+
+    Holds the embedding service and the cache, and embeds texts through `_aembed`.
+    Backends implement `add_documents`, `get_documents`, `copy_file_documents`, `delete_by_ids`,
+    `delete_vectorstore`, `_search`, `_search_many` and `_link_indexed`.
+    """
+
+    def __init__(
+        self,
+        embedding_service: AsyncOpenAI,
+        cache_service: AsyncCacheService,
+        indexname: str,
+        document_class: type[mdl.DocumentT],
+        *,
+        embedding_model: str = "text-embedding-3-small",
+        embedding_config: mdl.EmbeddingConfig | None = None,
+        result_cache: SearchResultCache | None = SEARCH_RESULT_CACHE,
+    ) -> None:
+        self.embedding_service = embedding_service
+        self.cache_service = cache_service
+        self.indexname = indexname
+        self.embedding_model = embedding_model
+        self.embedding_config = embedding_config or mdl.EmbeddingConfig()
+        self.document_class = document_class
+        self.result_cache = result_cache
+
+    @abc.abstractmethod
+    async def delete_vectorstore(self) -> Exception | None: ...
+
+    @abc.abstractmethod
+    async def add_documents(
+        self,
+        documents: List[mdl.DocumentT],
+        *,
+        vectors: dict[str, List[float]] | None = None,
+    ) -> Tuple[List[str], Exception | None]: ...
+
+    @abc.abstractmethod
+    async def delete_by_ids(
+        self,
+        ids: List[str]
+    ) -> Tuple[List[str], Exception | None]: ...
+
+    @abc.abstractmethod
+    async def get_documents(
+        self,
+        ids: List[str],
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]: ...
+
+    @abc.abstractmethod
+    async def copy_file_documents(
+        self,
+        source_file_id: str,
+        file_meta: dict[str, Any],
+    ) -> Tuple[List[str], Exception | None]: ...
+
+    @abc.abstractmethod
+    async def _search(
+        self,
+        query: str,
+        filter: mdl.SearchFilter
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]: ...
+
+    @abc.abstractmethod
+    async def _search_many(
+        self,
+        searches: List[Tuple[str, mdl.SearchFilter]],
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]:
+        """ Searches distinct queries, each with its filter, and fuses their hits by reciprocal rank fusion.
+        Returns at most the largest `top_k` of the filters, without expanding them.
+        """
+
+    @abc.abstractmethod
+    async def _link_indexed(
+        self,
+        documents: List[mdl.DocumentT],
+        *,
+        threshold: float,
+        candidates: int,
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]:
+        """ Links the documents to their near-duplicates in the store, see `link_duplicates`. """
+
+    async def search(
+        self,
+        query: str,
+        filter: mdl.SearchFilter | None = None
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]:
+        """ Searches the documents, answering from `result_cache` when possible.
+        With `filter.neighbors`, hits are expanded into passages, see `_expand_neighbors`.
+
+        Args:
+            query (str): The search query.
+            filter (mdl.SearchFilter | None): The search filter. Defaults to `mdl.SearchFilter()`.
+
+        Returns:
+            Tuple[List[mdl.DocumentT], Exception | None]: The matched documents and any error that occurred.
+        """
+        if not filter:
+            filter = mdl.SearchFilter()
+
+        if self.result_cache is None:
+            return await self._search_expanded(query, filter)
+
+        key = self._cache_key(query, filter)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached, None
+
+        generation = self.result_cache.generation(self.indexname)
+        start = time.perf_counter()
+        results, err = await self._search_expanded(query, filter)
+        if not err:
+            self.result_cache.set(key, results, time.perf_counter() - start, generation)
+
+        return results, err
+
+    def _cache_key(self, query: str, filter: mdl.SearchFilter) -> Tuple:
+        assert self.result_cache is not None
+        return self.result_cache.make_key(
+            indexname=self.indexname,
+            query=query,
+            tags=filter.tags,
+            top_k=filter.top_k,
+            stride_score=filter.stride_score,
+            effective_at=filter.effective_at.timestamp(),
+            neighbors=filter.neighbors,
+            fusion=filter.fusion,
+            oversample=filter.oversample,
+            num_candidates=filter.num_candidates,
+            rank_constant=filter.rank_constant,
+        )
+
+    def _cached(self, key: Tuple) -> List[mdl.DocumentT] | None:
+        assert self.result_cache is not None
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            stats = self.result_cache.stats
+            lg.logger.debug(
+                f"Search cache hit on {self.indexname}: "
+                f"hit ratio {stats.hit_ratio:.1%}, saved {stats.saved_seconds:.2f}s in total"
+            )
+        return cached
+
+    async def _search_expanded(
+        self,
+        query: str,
+        filter: mdl.SearchFilter
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]:
+        results, err = await self._search(query, filter)
+        if err or not filter.neighbors:
+            return results, err
+        return await self._expand_neighbors(results, filter.neighbors), None
+
+    async def search_many(
+        self,
+        queries: List[str],
+        filters: mdl.SearchFilter | List[mdl.SearchFilter] | None = None,
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]:
+        """ Searches several queries in one retrieval round trip and fuses their hits.
+
+        The queries are embedded together through `_aembed`, so they share one embeddings request,
+        and the backend searches them all at once, see `_search_many`. The hits are fused with
+        reciprocal rank fusion, so a document found by several queries ranks higher and is returned once.
+        Every query runs as with `fusion='rrf'`. Results are cached in `result_cache` under the set of
+        queries and their filters, so the same queries in any order share an entry.
+
+        Args:
+            queries (List[str]): The search queries. Empty queries are dropped, and a repeated query
+                is searched once with the filter of its first occurrence.
+            filters (mdl.SearchFilter | List[mdl.SearchFilter] | None): One filter for every query,
+                or one per query. Defaults to `mdl.SearchFilter()`.
+
+        Returns:
+            Tuple[List[mdl.DocumentT], Exception | None]: The fused documents, at most the largest `top_k`
+                of the filters, expanded with the largest `neighbors`, and any error that occurred.
+        """
+        if filters is None:
+            filters = mdl.SearchFilter()
+        if isinstance(filters, mdl.SearchFilter):
+            filters = [filters] * len(queries)
+        if len(filters) != len(queries):
+            return [], ValueError(f"Got {len(filters)} filters for {len(queries)} queries.")
+
+        unique: dict[str, mdl.SearchFilter] = {}
+        for query, filter in zip(queries, filters):
+            if query.strip():
+                unique.setdefault(query.strip(), filter)
+        searches = list(unique.items())
+        if not searches:
+            return [], ValueError("No query given.")
+
+        if self.result_cache is None:
+            return await self._search_many_expanded(searches)
+
+        # Tagged apart from the keys of `search`, which runs single queries with their own fusion.
+        key = (self.indexname, "many", frozenset(self._cache_key(query, filter) for query, filter in searches))
+        cached = self._cached(key)
+        if cached is not None:
+            return cached, None
+
+        generation = self.result_cache.generation(self.indexname)
+        start = time.perf_counter()
+        results, err = await self._search_many_expanded(searches)
+        if not err:
+            self.result_cache.set(key, results, time.perf_counter() - start, generation)
+
+        return results, err
+
+    async def _search_many_expanded(
+        self,
+        searches: List[Tuple[str, mdl.SearchFilter]],
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]:
+        results, err = await self._search_many(searches)
+        neighbors = max(filter.neighbors for _, filter in searches)
+        if err or not neighbors:
+            return results, err
+        return await self._expand_neighbors(results, neighbors), None
+
+    async def _expand_neighbors(
+        self,
+        hits: List[mdl.DocumentT],
+        neighbors: int,
+    ) -> List[mdl.DocumentT]:
+        """ Merges each hit with up to `neighbors` chunks before and after it in its file.
+
+        The neighbouring ids are derived from `page_meta.chunk_index` with `mdl.make_document_id`
+        and fetched with a single `get_documents`. Hits of the same file whose windows overlap or touch
+        are merged into one passage, ranked at the best of them. A passage keeps the id and tags of its
+        best hit and the `page_meta` of its first chunk, and joins the chunks in file order without
+        the text repeated between consecutive chunks. Hits without a `chunk_index` are kept as they are,
+        and if the fetch fails the hits are returned unexpanded.
+        """
+        ids: List[str] = []
+        for hit in hits:
+            index = hit.page_meta.chunk_index
+            if index < 0:
+                continue
+            ids.extend(
+                mdl.make_document_id(hit.file_meta.file_id, i)
+                for i in range(max(0, index - neighbors), index + neighbors + 1)
+                if i != index
+            )
+
+        fetched, err = await self.get_documents(list(dict.fromkeys(ids)))
+        if err:
+            lg.logger.warning(f"Failed to fetch neighbouring chunks on {self.indexname}: {err}")
+            return hits
+
+        chunks: dict[Tuple[str, int], mdl.DocumentT] = {
+            (doc.file_meta.file_id, doc.page_meta.chunk_index): doc for doc in [*fetched, *hits]
+        }
+        windows: dict[str, List[Tuple[int, int, int]]] = {}
+        passages: List[Tuple[int, mdl.DocumentT]] = []
+        for rank, hit in enumerate(hits):
+            index = hit.page_meta.chunk_index
+            if index < 0:
+                passages.append((rank, hit))
+            else:
+                windows.setdefault(hit.file_meta.file_id, []).append((index - neighbors, index + neighbors, rank))
+
+        for file_id, spans in windows.items():
+            spans.sort()
+            merged: List[List[int]] = []
+            for start, end, rank in spans:
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                    merged[-1][2] = min(merged[-1][2], rank)
+                else:
+                    merged.append([start, end, rank])
+
+            for start, end, rank in merged:
+                members = [
+                    chunks[(file_id, i)] for i in range(max(0, start), end + 1) if (file_id, i) in chunks
+                ]
+                content = functools.reduce(_join_overlapping, (doc.content for doc in members))
+                passages.append((rank, hits[rank].model_copy(update={
+                    "content": content,
+                    "page_meta": members[0].page_meta,
+                })))
+
+        passages.sort(key=lambda passage: passage[0])
+        return [passage for _, passage in passages]
+
+    async def link_duplicates(
+        self,
+        documents: List[mdl.DocumentT],
+        *,
+        threshold: float,
+        local: dedup.SignatureIndex[mdl.DocumentT] | None = None,
+        candidates: int = 5,
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]:
+        """ Finds the near-duplicates among the documents and links them by setting their `duplicate_of`.
+
+        A document is a near-duplicate of an indexed document when their MinHash signatures estimate
+        a Jaccard similarity of at least `threshold`, and when every search matching the document
+        also matches that one: it has all of its tags and an effective period covering its own.
+        Only documents with a vector are linked to. Candidates sharing a signature band are looked up
+        in `local` first, then in the store with `_link_indexed`. Missing signatures are computed
+        in the process pool.
+
+        Args:
+            documents (List[mdl.DocumentT]): The documents to check. Their `signature` and `duplicate_of` are set.
+            threshold (float): The estimated Jaccard similarity from which a document is a near-duplicate.
+            local (dedup.SignatureIndex[mdl.DocumentT] | None): Documents not searchable yet, e.g. earlier
+                batches of the same file, to check before the index.
+            candidates (int): Number of index hits compared per document.
+
+        Returns:
+            Tuple[List[mdl.DocumentT], Exception | None]: The near-duplicates, and the error of the store lookup,
+                in which case only the near-duplicates found in `local` are linked.
+        """
+        unsigned = [doc for doc in documents if doc.signature is None]
+        if unsigned:
+            signatures = await run_in_process(dedup.minhash_many, [doc.content for doc in unsigned])
+            for doc, signature in zip(unsigned, signatures):
+                doc.signature = signature
+
+        duplicates: List[mdl.DocumentT] = []
+        pending: List[mdl.DocumentT] = []
+        for doc in documents:
+            doc.duplicate_of = None
+            if not doc.content.strip():
+                continue
+            if local is not None:
+                doc.duplicate_of = _best_match(
+                    doc.signature,  # type: ignore
+                    (
+                        (signature, other.document_id)
+                        for signature, other in local.candidates(doc.signature)  # type: ignore
+                        if other.document_id != doc.document_id and _covers(other, doc)
+                    ),
+                    threshold,
+                )
+            if doc.duplicate_of:
+                duplicates.append(doc)
+            else:
+                pending.append(doc)
+
+        if not pending:
+            return duplicates, None
+
+        linked, err = await self._link_indexed(pending, threshold=threshold, candidates=candidates)
+        return duplicates + linked, err
+
+    async def embed_documents(
+        self,
+        documents: List[mdl.DocumentT],
+    ) -> Tuple[dict[str, List[float]], Exception | None]:
+        """ Embeds the content of the documents, keyed by `document_id`.
+        The result can be persisted and passed back to `add_documents` as `vectors`.
+        """
+        return await self._aembed({
+            doc.document_id: doc.content for doc in documents
+        })
+
+    async def _resolve_vectors(
+        self,
+        documents: List[mdl.DocumentT],
+        vectors: dict[str, List[float]] | None,
+    ) -> Tuple[dict[str, List[float]], Exception | None]:
+        if vectors is None:
+            return await self.embed_documents(documents)
+
+        missing = {
+            doc.document_id: ValueError("No vector given for the document.")
+            for doc in documents if doc.document_id not in vectors
+        }
+        return vectors, EmbeddingError(missing) if missing else None
+
+    def _invalidate_results(self) -> None:
+        if self.result_cache is not None:
+            self.result_cache.invalidate(self.indexname)
+
+    async def _aembed(
+        self,
+        texts: dict[str, str],
+    ) -> Tuple[dict[str, List[float]], Exception | None]:
+        """ Embeds the texts with batched, concurrent embeddings requests.
+
+        Texts already in the cache service are not sent, and identical texts are sent once.
+        The rest are packed into list inputs bounded by `EmbeddingConfig.batch_size` and
+        `EmbeddingConfig.batch_tokens`, and at most `EmbeddingConfig.concurrency` requests
+        run at once.
+
+        Args:
+            texts (dict[str, str]): The texts to embed, keyed by an arbitrary identifier.
+
+        Returns:
+            Tuple[dict[str, List[float]], Exception | None]: The embeddings of the texts that succeeded,
+                and an `EmbeddingError` listing the keys that failed, if any.
+        """
+        config = self.embedding_config
+        embedding_results: dict[str, List[float]] = {}
+        failures: dict[str, Exception] = {}
+
+        keys_by_cache_key: dict[str, List[str]] = {}
+        text_by_cache_key: dict[str, str] = {}
+        for key, text in texts.items():
+            if not text or not text.strip():
+                failures[key] = ValueError("Cannot embed an empty text.")
+                continue
+
+            cache_key = self.cache_service.make_key(self.embedding_model, config.dimensions, text)
+            keys_by_cache_key.setdefault(cache_key, []).append(key)
+            text_by_cache_key[cache_key] = text
+
+        embedded = await self.cache_service.aget_many(keys_by_cache_key)
+        batch_failures: dict[str, Exception] = {}
+
+        batches: List[List[Tuple[str, str]]] = []
+        batch: List[Tuple[str, str]] = []
+        batch_tokens = 0
+        for cache_key, text in text_by_cache_key.items():
+            if cache_key in embedded:
+                continue
+
+            tokens = count_tokens(text, self.embedding_model)
+            if tokens > config.max_input_tokens:
+                batch_failures[cache_key] = ValueError(
+                    f"Text has {tokens} tokens, exceeding the limit of {config.max_input_tokens}."
+                )
+                continue
+
+            if batch and (
+                len(batch) >= config.batch_size 
+                or batch_tokens + tokens > config.batch_tokens
+            ):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+
+            batch.append((cache_key, text))
+            batch_tokens += tokens
+
+        if batch:
+            batches.append(batch)
+
+        semaphore = asyncio.Semaphore(config.concurrency)
+        fresh: dict[str, List[float]] = {}
+
+        async def _embed_batch(batch: List[Tuple[str, str]]) -> None:
+            async with semaphore:
+                try:
+                    embeddings = (
+                        await self.embedding_service.embeddings
+                        .create(
+                            input=[text for _, text in batch], 
+                            model=self.embedding_model,
+                            dimensions=config.dimensions or NOT_GIVEN,
+                        )
+                    )
+                except Exception as e:
+                    for cache_key, _ in batch:
+                        batch_failures[cache_key] = e
+                    return
+
+            for data in embeddings.data:
+                cache_key, _ = batch[data.index]
+                fresh[cache_key] = data.embedding
+
+            for cache_key, _ in batch:
+                if cache_key not in fresh:
+                    batch_failures[cache_key] = ValueError("No embedding returned for the text.")
+
+        await asyncio.gather(*(_embed_batch(b) for b in batches))
+        await self.cache_service.aset_many(fresh)
+        embedded.update(fresh)
+
+        for cache_key, keys in keys_by_cache_key.items():
+            for key in keys:
+                if cache_key in embedded:
+                    embedding_results[key] = embedded[cache_key]
+                else:
+                    failures[key] = batch_failures[cache_key]
+
+        if failures:
+            return embedding_results, EmbeddingError(failures)
+
+        return embedding_results, None
+
+
+class VectorStore(BaseVectorStore[mdl.DocumentT]):
 
     __create_key = object()
+    _ensured_indices: set[str] = set()
 
     def __init__(
         self,
@@ -31,17 +556,25 @@ class VectorStore(Generic[mdl.DocumentT]):
         document_class: type[mdl.DocumentT],
         *,
         embedding_model: str = "text-embedding-3-small",
+        embedding_config: mdl.EmbeddingConfig | None = None,
+        result_cache: SearchResultCache | None = SEARCH_RESULT_CACHE,
+        trusted_hydration: bool = True,
     ) -> None:
         
         if key != VectorStore.__create_key:
             raise ValueError("Use the create method to instantiate VectorStore.")
         
+        super().__init__(
+            embedding_service=embedding_service,
+            cache_service=cache_service,
+            indexname=indexname,
+            document_class=document_class,
+            embedding_model=embedding_model,
+            embedding_config=embedding_config,
+            result_cache=result_cache,
+        )
         self.vector_client = vector_client
-        self.embedding_service = embedding_service
-        self.cache_service = cache_service
-        self.indexname = indexname
-        self.embedding_model = embedding_model
-        self.document_class = document_class        
+        self.trusted_hydration = trusted_hydration
 
     @classmethod
     async def create(
@@ -53,18 +586,47 @@ class VectorStore(Generic[mdl.DocumentT]):
         document_class: type[mdl.DocumentT],
         *,
         embedding_model: str = "text-embedding-3-small",
+        embedding_config: mdl.EmbeddingConfig | None = None,
+        result_cache: SearchResultCache | None = SEARCH_RESULT_CACHE,
+        index_type: mdl.VectorIndexTypeLiteral | None = None,
+        trusted_hydration: bool = True,
     ) -> "VectorStore[mdl.DocumentT]":
-        try:
-            resp = await vector_client.indices.exists(index=indexname)
-            if not resp:
-                await document_class.get_es_definition().init(
-                    index=indexname,
-                    using=vector_client,
+        """ Creates the VectorStore, creating the index if it does not exist yet.
+
+        The vector field of a new index is sized to `embedding_config.dimensions` and quantized
+        with `index_type` (e.g. `int8_hnsw`, `bbq_hnsw`). An existing index must have the same dimensions.
+        With `trusted_hydration`, hits are built with `document_class.from_es_source` instead of
+        being validated, which is only safe for documents written by this store.
+        Indices created before near-duplicate detection get its fields added to their mapping.
+        """
+        dims = (embedding_config.dimensions if embedding_config else None) or mdl.DEFAULT_DIMENSIONS
+        if indexname not in cls._ensured_indices:
+            try:
+                resp = await vector_client.indices.exists(index=indexname)
+                if not resp:
+                    await document_class.get_es_definition(dims, index_type).init(
+                        index=indexname,
+                        using=vector_client,
+                    )
+                else:
+                    mapping = await vector_client.indices.get_mapping(index=indexname)
+                    for index_mapping in mapping.body.values():
+                        properties = index_mapping["mappings"]["properties"]
+                        vector_field = properties.get("vector", {})
+                        if vector_field.get("dims", dims) != dims:
+                            raise ValueError(
+                                f"Index has {vector_field['dims']} dimensions, but {dims} were configured."
+                            )
+                        if "signature_bands" not in properties:
+                            await vector_client.indices.put_mapping(
+                                index=indexname,
+                                properties=mdl.SIGNATURE_MAPPING,
+                            )
+            except Exception as indexErr:
+                raise ValueError(
+                    f"Failed to initialize index {indexname}: {indexErr}"
                 )
-        except Exception as indexErr:
-            raise ValueError(
-                f"Failed to initialize index {indexname}: {indexErr}"
-            )
+            cls._ensured_indices.add(indexname)
         
         return cls(
             key=cls.__create_key,
@@ -73,10 +635,15 @@ class VectorStore(Generic[mdl.DocumentT]):
             cache_service=cache_service,
             indexname=indexname,
             document_class=document_class,
-            embedding_model=embedding_model
+            embedding_model=embedding_model,
+            embedding_config=embedding_config,
+            result_cache=result_cache,
+            trusted_hydration=trusted_hydration
         )
 
     async def delete_vectorstore(self) -> Exception | None:
+        self._invalidate_results()
+        VectorStore._ensured_indices.discard(self.indexname)
         try:
             await self.vector_client.indices.delete(index=self.indexname)
         except Exception as e:
@@ -87,38 +654,146 @@ class VectorStore(Generic[mdl.DocumentT]):
     async def add_documents(
         self,
         documents: List[mdl.DocumentT],
+        *,
+        bulk: bool = True,
+        chunk_size: int = 500,
+        max_chunk_bytes: int = 10 * 1024 * 1024,
+        refresh: bool = False,
+        vectors: dict[str, List[float]] | None = None,
     ) -> Tuple[List[str], Exception | None]: 
-        
+        """ Embeds and indexes the documents, using `document_id` as the ES `_id`.
+
+        Near-duplicates linked by `link_duplicates` are indexed without a vector.
+
+        Args:
+            documents (List[mdl.DocumentT]): The documents to add.
+            vectors (dict[str, List[float]] | None): Precomputed embeddings keyed by `document_id`,
+                e.g. from `embed_documents`. Documents without one are reported as failures. None embeds them all.
+            bulk (bool): If True, documents are streamed through the bulk API, otherwise saved one by one.
+            chunk_size (int): Maximum number of documents per bulk request.
+            max_chunk_bytes (int): Maximum size in bytes of a bulk request.
+            refresh (bool): Whether to refresh the index after the last bulk request.
+
+        Returns:
+            Tuple[List[str], Exception | None]: The ids of the indexed documents,
+                and an `IndexingError` listing the documents that failed, if any.
+        """
         success_docs: List[str] = []
+        failures: dict[str, Exception] = {}
 
-        for doc in documents:
-            vector, err = await self._aembed({
-                doc.document_id: doc.content
-            })
-            if err:
-                continue
-            
-            doc.created_at = dt.datetime.now()
-            doc.updated_at = dt.datetime.now()
-            
-            try:
-                es_doc = doc.to_es(vector=vector[doc.document_id])
-                await es_doc.save(using=self.vector_client, index=self.indexname)
-            except Exception as e:
-                continue
+        vectors, err = await self._resolve_vectors(
+            [doc for doc in documents if not doc.duplicate_of],
+            vectors,
+        )
+        if isinstance(err, EmbeddingError):
+            failures.update(err.failures)
+        elif err:
+            return success_docs, err
+
+        embedded = [doc for doc in documents if doc.duplicate_of or doc.document_id in vectors]
+        now = dt.datetime.now()
+        for doc in embedded:
+            doc.created_at = now
+            doc.updated_at = now
+
+        if bulk:
+            async for document_id, exc in self._bulk_index(
+                embedded,
+                vectors,
+                chunk_size=chunk_size,
+                max_chunk_bytes=max_chunk_bytes,
+            ):
+                if exc:
+                    failures[document_id] = exc
+                else:
+                    success_docs.append(document_id)
+
+            if refresh and success_docs:
+                try:
+                    await self.vector_client.indices.refresh(index=self.indexname)
+                except Exception as e:
+                    lg.logger.warning(f"Failed to refresh index {self.indexname}: {e}")
+        else:
+            for doc in embedded:
+                try:
+                    es_doc = doc.to_es(vector=vectors.get(doc.document_id))
+                    es_doc.meta.id = doc.document_id
+                    await es_doc.save(using=self.vector_client, index=self.indexname, refresh=refresh)
+                except Exception as e:
+                    failures[doc.document_id] = e
+                    continue
+
+                success_docs.append(doc.document_id)
+
+        if success_docs:
+            self._invalidate_results()
+
+        if failures:
+            return success_docs, IndexingError(failures)
 
-            success_docs.append(doc.document_id)
-        
         return success_docs, None
 
+    async def _bulk_index(
+        self,
+        documents: List[mdl.DocumentT],
+        vectors: dict[str, List[float]],
+        *,
+        chunk_size: int,
+        max_chunk_bytes: int,
+    ) -> AsyncIterator[Tuple[str, Exception | None]]:
+        """ Streams the documents to the bulk API and yields the result of each document.
+
+        Yields:
+            Tuple[str, Exception | None]: The document id, and the error if it failed to index.
+        """
+        def _actions():
+            for doc in documents:
+                yield {
+                    "_op_type": "index",
+                    "_index": self.indexname,
+                    "_id": doc.document_id,
+                    "_source": doc.to_es(vector=vectors.get(doc.document_id)).to_dict(),
+                }
+
+        reported: set[str] = set()
+        try:
+            async for ok, item in async_streaming_bulk(
+                self.vector_client,
+                _actions(),
+                chunk_size=chunk_size,
+                max_chunk_bytes=max_chunk_bytes,
+                raise_on_error=False,
+                raise_on_exception=False,
+            ):
+                result: dict[str, Any] = item.get("index", {})
+                document_id = str(result.get("_id", ""))
+                reported.add(document_id)
+                if ok:
+                    yield document_id, None
+                else:
+                    yield document_id, ValueError(
+                        f"Bulk index failed with status {result.get('status')}: {result.get('error')}"
+                    )
+        except Exception as e:
+            for doc in documents:
+                if doc.document_id not in reported:
+                    yield doc.document_id, e
+
 
     async def delete_by_ids(
         self,
         ids: List[str]
     ) -> Tuple[List[str], Exception | None]: 
+        """ Deletes the documents. Near-duplicates linked to a deleted document are promoted first,
+        so their content stays searchable.
+        """
         if not ids:
             return [], None
 
+        err = await self._promote_duplicates(ids)
+        if err:
+            return [], err
+
         query = {
             "query": {
                 "terms": {
@@ -135,45 +810,493 @@ class VectorStore(Generic[mdl.DocumentT]):
             )
         except Exception as e:
             return [], e
+        finally:
+            self._invalidate_results()
 
         return ids, None
 
+    async def _promote_duplicates(self, ids: List[str]) -> Exception | None:
+        """ Gives the near-duplicates linked to `ids` the vector of their document, or a new one if it has none,
+        and unlinks them.
+        """
+        linked: List[dict[str, Any]] = []
+        try:
+            async for hits in self._iter_hits(
+                page_size=500,
+                keep_alive="1m",
+                source=["document_id", "duplicate_of", "content"],
+                query={"bool": {
+                    "filter": [{"terms": {"duplicate_of": ids}}],
+                    "must_not": [{"terms": {"document_id": ids}}],
+                }},
+            ):
+                linked.extend(hit["_source"] for hit in hits)
+            if not linked:
+                return None
 
-    async def search(
+            resp = await self.vector_client.mget(
+                index=self.indexname,
+                ids=list({source["duplicate_of"] for source in linked}),
+                source_includes=VECTOR_FIELDS,
+            )
+        except Exception as e:
+            return e
+
+        vectors: dict[str, List[float]] = {
+            doc["_id"]: doc["_source"]["vector"]
+            for doc in resp["docs"] if doc.get("found") and "vector" in doc["_source"]
+        }
+        fresh, err = await self._aembed({
+            source["document_id"]: source["content"]
+            for source in linked if source["duplicate_of"] not in vectors
+        })
+        if err:
+            return err
+
+        actions = [
+            {
+                "_op_type": "update",
+                "_index": self.indexname,
+                "_id": source["document_id"],
+                "doc": {
+                    "vector": vectors.get(source["duplicate_of"]) or fresh[source["document_id"]],
+                    "duplicate_of": None,
+                },
+            }
+            for source in linked
+        ]
+        try:
+            _, errors = await async_bulk(self.vector_client, actions, raise_on_error=False)
+        except Exception as e:
+            return e
+
+        lg.logger.info(f"Promoted {len(linked) - len(errors)} near-duplicate documents on index {self.indexname}")
+        if errors:
+            return IndexingError({
+                str(item["update"].get("_id")): ValueError(str(item["update"].get("error")))
+                for item in errors  # type: ignore
+            })
+        return None
+
+    async def _link_indexed(
         self,
-        query: str,
-        filter: mdl.SearchFilter | None = None
+        documents: List[mdl.DocumentT],
+        *,
+        threshold: float,
+        candidates: int,
     ) -> Tuple[List[mdl.DocumentT], Exception | None]:
-        if not filter:
-            filter = mdl.SearchFilter()
-        
-        vector_key = "query_vector"
-        try:
-            vector, err = await self._aembed({
-                vector_key: query
+        """ Looks up the candidates of all the documents with a single msearch on `signature_bands`. """
+        duplicates: List[mdl.DocumentT] = []
+        searches: List[dict[str, Any]] = []
+        for doc in documents:
+            searches.append({})
+            searches.append({
+                "query": {"bool": {
+                    "filter": [
+                        {"terms": {"signature_bands": dedup.band_keys(doc.signature)}},  # type: ignore
+                        {"range": {"file_meta.effective_from": {"lte": doc.file_meta.effective_from}}},
+                        {"range": {"file_meta.effective_to": {"gte": doc.file_meta.effective_to}}},
+                        *({"term": {"tags": tag}} for tag in doc.tags),
+                    ],
+                    "must_not": [
+                        {"term": {"is_deleted": True}},
+                        {"term": {"document_id": doc.document_id}},
+                        {"exists": {"field": "duplicate_of"}},
+                    ],
+                }},
+                "size": candidates,
+                "_source": ["document_id", "signature"],
             })
+        try:
+            resp = await self.vector_client.msearch(
+                index=self.indexname,
+                searches=searches,
+                filter_path=MSEARCH_FILTER_PATH,
+            )
+        except Exception as e:
+            return duplicates, e
+
+        for doc, response in zip(documents, resp["responses"]):
+            if "error" in response:
+                lg.logger.warning(f"Near-duplicate lookup on {self.indexname} failed: {response['error']}")
+                continue
+
+            doc.duplicate_of = _best_match(
+                doc.signature,  # type: ignore
+                (
+                    (hit["_source"]["signature"], hit["_source"]["document_id"])
+                    for hit in response.get("hits", {}).get("hits", [])
+                    if hit["_source"].get("signature")
+                ),
+                threshold,
+            )
+            if doc.duplicate_of:
+                duplicates.append(doc)
+
+        return duplicates, None
+
+    async def iter_documents(
+        self,
+        *,
+        page_size: int = 500,
+        keep_alive: str = "2m",
+    ) -> AsyncIterator[mdl.DocumentT]:
+        """ Streams every live document of the index in `_shard_doc` order.
+
+        Pages through a point in time with `search_after`, so at most `page_size` documents
+        are held at once and the view is consistent while the index keeps being written.
+
+        Args:
+            page_size (int): Number of documents fetched per request.
+            keep_alive (str): How long the point in time is kept open between two requests.
+
+        Yields:
+            mdl.DocumentT: The documents, without their vectors.
+        """
+        async for hits in self._iter_hits(
+            page_size=page_size,
+            keep_alive=keep_alive,
+            source={"excludes": VECTOR_FIELDS},
+        ):
+            for hit in hits:
+                yield self._hydrate(hit["_source"])
+
+    async def get_documents(
+        self,
+        ids: List[str],
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]:
+        """ Fetches documents by id with a single `mget`, without their vectors.
+
+        Args:
+            ids (List[str]): The document ids.
+
+        Returns:
+            Tuple[List[mdl.DocumentT], Exception | None]: The documents found, in the order of `ids`.
+                Unknown ids are skipped.
+        """
+        if not ids:
+            return [], None
+
+        try:
+            resp = await self.vector_client.mget(
+                index=self.indexname,
+                ids=ids,
+                source_excludes=VECTOR_FIELDS,
+            )
         except Exception as e:
             return [], e
+
+        return [self._hydrate(doc["_source"]) for doc in resp["docs"] if doc.get("found")], None
+
+    async def _iter_hits(
+        self,
+        *,
+        page_size: int,
+        keep_alive: str,
+        source: Any = True,
+        query: dict[str, Any] | None = None,
+    ) -> AsyncIterator[List[dict[str, Any]]]:
+        """ Yields pages of raw hits through a point in time and `search_after`.
+        Tombstoned documents are skipped, and `query` further restricts the hits.
+        """
+        must_not = [{"term": {"is_deleted": True}}]
+        bool_query: dict[str, Any] = {"must_not": must_not}
+        if query is not None:
+            bool_query["filter"] = [query]
+
+        pit = await self.vector_client.open_point_in_time(index=self.indexname, keep_alive=keep_alive)
+        pit_id = pit["id"]
+        search_after: List[Any] | None = None
+        try:
+            while True:
+                resp = await self.vector_client.search(
+                    pit={"id": pit_id, "keep_alive": keep_alive},
+                    query={"bool": bool_query},
+                    sort=[{"_shard_doc": "asc"}],
+                    size=page_size,
+                    source=source,
+                    search_after=search_after,
+                    track_total_hits=False,
+                )
+                pit_id = resp.get("pit_id", pit_id)
+                hits = resp["hits"]["hits"]
+                if not hits:
+                    return
+
+                yield hits
+                if len(hits) < page_size:
+                    return
+                search_after = hits[-1]["sort"]
+        finally:
+            try:
+                await self.vector_client.close_point_in_time(id=pit_id)
+            except Exception as e:
+                lg.logger.warning(f"Failed to close point in time on index {self.indexname}: {e}")
+
+    async def reindex_to(
+        self,
+        new_index: str,
+        *,
+        re_embed: bool = False,
+        embedding_model: str | None = None,
+        embedding_config: mdl.EmbeddingConfig | None = None,
+        index_type: mdl.VectorIndexTypeLiteral | None = None,
+        alias: str | None = None,
+        page_size: int = 500,
+        keep_alive: str = "5m",
+    ) -> Tuple["VectorStore[mdl.DocumentT]", Exception | None]:
+        """ Copies the index into `new_index` and atomically points the alias at it.
+
+        Documents are streamed page by page from a point in time, so memory stays flat in the
+        size of the index. The stored vectors are reused unless `re_embed` is set, in which case
+        every page is embedded again with `embedding_model` and `embedding_config` in batched requests.
+        Documents written while the copy runs are picked up by a second pass on `updated_at`
+        right before the swap. Searches keep going to the old index until the swap.
+
+        The alias defaults to `indexname`. If that name is still a concrete index, the swap removes it
+        in the same `update_aliases` call that adds the alias, so the name never stops resolving.
+        Otherwise the alias is moved from its current indices, which are kept.
+
+        Args:
+            new_index (str): The name of the index to create and fill.
+            re_embed (bool): Whether to compute new vectors instead of copying the stored ones.
+            embedding_model (str | None): The embedding model of the new index. Defaults to the current one.
+            embedding_config (mdl.EmbeddingConfig | None): The embedding config of the new index.
+                Defaults to the current one.
+            index_type (mdl.VectorIndexTypeLiteral | None): The vector index type of the new index.
+            alias (str | None): The alias to swap. Defaults to `indexname`.
+            page_size (int): Number of documents read, embedded and bulk indexed at a time.
+            keep_alive (str): How long the point in time is kept open between two pages.
+
+        Returns:
+            Tuple[VectorStore[mdl.DocumentT], Exception | None]: A store over the alias once swapped,
+                otherwise over `new_index`, and an `IndexingError` listing the documents that failed
+                to copy, in which case the alias is left untouched.
+        """
+        alias = alias or self.indexname
+        embedding_model = embedding_model or self.embedding_model
+        embedding_config = embedding_config or self.embedding_config
+        if not re_embed and (
+            embedding_model != self.embedding_model
+            or embedding_config.dimensions != self.embedding_config.dimensions
+        ):
+            raise ValueError("Changing the embedding model or dimensions requires re_embed=True.")
+
+        target = await VectorStore.create(
+            vector_client=self.vector_client,
+            embedding_service=self.embedding_service,
+            cache_service=self.cache_service,
+            indexname=new_index,
+            document_class=self.document_class,
+            embedding_model=embedding_model,
+            embedding_config=embedding_config,
+            result_cache=self.result_cache,
+            index_type=index_type,
+            trusted_hydration=self.trusted_hydration,
+        )
+
+        started_at = dt.datetime.now()
+        copied, failures = await self.copy_to(
+            target, re_embed=re_embed, page_size=page_size, keep_alive=keep_alive,
+        )
+        caught_up, late_failures = await self.copy_to(
+            target,
+            re_embed=re_embed,
+            page_size=page_size,
+            keep_alive=keep_alive,
+            query={"range": {"updated_at": {"gte": started_at}}},
+        )
+        failures.update(late_failures)
+        lg.logger.info(
+            f"Copied {copied} documents and {caught_up} late writes from {self.indexname} to {new_index}"
+        )
+        if failures:
+            return target, IndexingError(failures)
+
+        err = await target.swap_alias(alias)
+        return target, err
+
+    async def copy_to(
+        self,
+        target: "VectorStore[mdl.DocumentT]",
+        *,
+        re_embed: bool,
+        query: dict[str, Any] | None = None,
+        page_size: int = 500,
+        keep_alive: str = "5m",
+    ) -> Tuple[int, dict[str, Exception]]:
+        """ Copies the documents matching `query` into `target`, page by page from a point in time.
+
+        Stored vectors are reused unless `re_embed` is set, in which case every page is embedded
+        again with the target's embedding model in batched requests. Duplicates are copied without a vector.
+        The target's aliases are left untouched, see `reindex_to` for a copy followed by a swap.
+
+        Args:
+            target (VectorStore[mdl.DocumentT]): The store to write into.
+            re_embed (bool): Whether to compute new vectors instead of copying the stored ones.
+            query (dict[str, Any] | None): An Elasticsearch query selecting the documents. Defaults to all.
+            page_size (int): Number of documents read, embedded and bulk indexed at a time.
+            keep_alive (str): How long the point in time is kept open between two pages.
+
+        Returns:
+            Tuple[int, dict[str, Exception]]: The number of documents copied, and the failures by document id.
+        """
+        copied = 0
+        failures: dict[str, Exception] = {}
+        source: Any = {"excludes": VECTOR_FIELDS} if re_embed else True
+
+        async for hits in self._iter_hits(
+            page_size=page_size, keep_alive=keep_alive, source=source, query=query,
+        ):
+            documents = [self._hydrate(hit["_source"]) for hit in hits]
+            if re_embed:
+                vectors, err = await target._aembed({
+                    doc.document_id: doc.content for doc in documents if not doc.duplicate_of
+                })
+                if isinstance(err, EmbeddingError):
+                    failures.update(err.failures)
+                elif err:
+                    failures.update({doc.document_id: err for doc in documents})
+                    continue
+            else:
+                vectors = {
+                    hit["_source"]["document_id"]: hit["_source"]["vector"]
+                    for hit in hits if "vector" in hit["_source"]
+                }
+
+            async for document_id, exc in target._bulk_index(
+                [doc for doc in documents if doc.duplicate_of or doc.document_id in vectors],
+                vectors,
+                chunk_size=page_size,
+                max_chunk_bytes=10 * 1024 * 1024,
+            ):
+                if exc:
+                    failures[document_id] = exc
+                else:
+                    copied += 1
+
+        return copied, failures
+
+    async def swap_alias(self, alias: str) -> Exception | None:
+        """ Refreshes the index and atomically points `alias` at it, then makes the store use the alias.
+
+        If `alias` is still a concrete index, it is removed in the same `update_aliases` call that adds
+        the alias, so the name never stops resolving. Otherwise the alias is moved from its current indices,
+        which are kept.
+
+        Args:
+            alias (str): The alias to point at this store's index.
+
+        Returns:
+            Exception | None: The error of the swap, in which case the alias is left untouched.
+        """
+        index = self.indexname
+        try:
+            await self.vector_client.indices.refresh(index=index)
+            actions: List[dict[str, Any]] = [{"add": {"index": index, "alias": alias}}]
+            if await self.vector_client.indices.exists_alias(name=alias):
+                current = await self.vector_client.indices.get_alias(name=alias)
+                for name in current.body:
+                    if name != index:
+                        actions.insert(0, {"remove": {"index": name, "alias": alias}})
+            elif await self.vector_client.indices.exists(index=alias):
+                actions.append({"remove_index": {"index": alias}})
+            await self.vector_client.indices.update_aliases(actions=actions)
+        except Exception as e:
+            return e
+
+        if self.result_cache is not None:
+            self.result_cache.invalidate(alias)
+        VectorStore._ensured_indices.add(alias)
+        self.indexname = alias
+        return None
+
+    async def copy_file_documents(
+        self,
+        source_file_id: str,
+        file_meta: dict[str, Any],
+        *,
+        page_size: int = 500,
+    ) -> Tuple[List[str], Exception | None]:
+        """ Copies the documents of a file as documents of another file with the same content.
+        Nothing is embedded, the copies only get new ids and their `file_meta` updated with `file_meta`.
+        Numbered chunks get the ids `mdl.make_document_id` gives them in the new file.
+
+        Copies are linked as near-duplicates of the canonical document of their source, so they are
+        stored without a vector and a search does not return the same chunk twice. A copy whose
+        `file_meta` update makes it match searches its source does not match keeps the vector instead.
+
+        Args:
+            source_file_id (str): The `file_meta.file_id` of the documents to copy.
+            file_meta (dict[str, Any]): The `FileMeta` fields to replace, e.g. `file_id` and `file_name`.
+            page_size (int): Number of documents read and bulk indexed at a time.
+
+        Returns:
+            Tuple[List[str], Exception | None]: The ids of the copies,
+                and an `IndexingError` listing the copies that failed, if any.
+        """
+        copied: List[str] = []
+        failures: dict[str, Exception] = {}
+        try:
+            async for hits in self._iter_hits(
+                page_size=page_size,
+                keep_alive="2m",
+                query={"term": {"file_meta.file_id": source_file_id}},
+            ):
+                now = dt.datetime.now()
+                documents: List[mdl.DocumentT] = []
+                vectors: dict[str, List[float]] = {}
+                for hit in hits:
+                    copy = _file_copy(self._hydrate(hit["_source"]), file_meta, now)
+                    if not copy.duplicate_of and "vector" in hit["_source"]:
+                        vectors[copy.document_id] = hit["_source"]["vector"]
+                    documents.append(copy)
+
+                async for document_id, exc in self._bulk_index(
+                    documents,
+                    vectors,
+                    chunk_size=page_size,
+                    max_chunk_bytes=10 * 1024 * 1024,
+                ):
+                    if exc:
+                        failures[document_id] = exc
+                    else:
+                        copied.append(document_id)
+        except Exception as e:
+            return copied, e
+        finally:
+            if copied:
+                self._invalidate_results()
+
+        if failures:
+            return copied, IndexingError(failures)
+
+        return copied, None
+
+    async def _search(
+        self,
+        query: str,
+        filter: mdl.SearchFilter
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]:
+        vector_key = "query_vector"
+        vector, err = await self._aembed({
+            vector_key: query
+        })
+        if err or vector_key not in vector:
+            return [], err or ValueError("Failed to embed the query.")
         
-        eff_at: dt.datetime = filter.effective_at
-        filter_clauses = [
-            dsl.Q("term", is_deleted=False),
-            dsl.Q("range", **{"file_meta.effective_from": {"lte": eff_at}}),
-            dsl.Q("range", **{"file_meta.effective_to": {"gte": eff_at}}),
-        ]
-        for tag in filter.tags:
-            filter_clauses.append(dsl.Q("term", tags=tag))
+        if filter.fusion == "rrf":
+            return await self._search_rrf(query, vector[vector_key], filter)
 
-        should_clauses = [
-            dsl.Q("match", content={"query": query, "operator": "and"})
-        ]
         bool_query = dsl.Q(
             "bool",
-            filter=filter_clauses,
-            should=should_clauses,
-            minimum_should_match=1 if should_clauses else 0
+            filter=self._filter_clauses(filter),
+            should=[
+                dsl.Q("match", content={"query": query, "operator": "and"})
+            ],
+            minimum_should_match=1
         )
-        oversample = filter.top_k * 3
+        oversample = filter.top_k * filter.oversample
         search_query = (
             dsl.AsyncSearch(
                 using=self.vector_client,
@@ -184,8 +1307,9 @@ class VectorStore(Generic[mdl.DocumentT]):
                 "vector",
                 k=oversample,
                 query_vector=vector[vector_key],
-                num_candidates=max(oversample * 2, 100),
+                num_candidates=filter.num_candidates or max(oversample * 2, 50),
             )
+            .source(excludes=SEARCH_EXCLUDES)
             .extra(size=oversample)
         )
         try:
@@ -196,55 +1320,231 @@ class VectorStore(Generic[mdl.DocumentT]):
         results: List[mdl.DocumentT] = []
         if not resp.hits:
             return results, ValueError("No results found.")
-        
-        for hit in resp.hits:
-            doc = self.document_class(
-                document_id=hit.document_id,  # type: ignore
-                content=hit.content,  # type: ignore
-                tags=hit.tags,  # type: ignore
-                created_at=hit.created_at,  # type: ignore
-                updated_at=hit.updated_at,  # type: ignore
-                page_meta=mdl.PageMeta(
-                    number=hit.page_meta.number,
-                    total_pages=hit.page_meta.total_pages
-                ),  # type: ignore
-                file_meta=mdl.FileMeta(
-                    file_id=hit.file_meta.file_id,
-                    file_path=hit.file_meta.file_path,
-                    file_name=hit.file_meta.file_name,
-                    file_extension=hit.file_meta.file_extension,
-                    file_type=hit.file_meta.file_type,
-                    file_description=hit.file_meta.file_description,
-                    effective_from=hit.file_meta.effective_from,
-                    effective_to=hit.file_meta.effective_to,
-                    author=hit.file_meta.author,
-                    department=hit.file_meta.department
-                )
+
+        # The summed lexical and kNN scores are unbounded, so hits are pruned relative to the best one.
+        best = resp.hits[0].meta.score or 1.0
+        for hit in resp.hits[:filter.top_k]:
+            if (hit.meta.score or 0) / best < filter.stride_score:
+                break
+            results.append(self._hydrate(hit.to_dict()))
+
+        return results, None
+
+    async def _search_rrf(
+        self,
+        query: str,
+        query_vector: List[float],
+        filter: mdl.SearchFilter,
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]:
+        """ Runs the lexical and kNN legs as two ranked lists in one msearch round trip,
+        prunes each list with `filter.stride_score` and fuses them with reciprocal rank fusion.
+        """
+        try:
+            resp = await self.vector_client.msearch(
+                index=self.indexname,
+                searches=self._rrf_searches(query, query_vector, filter),
+                filter_path=MSEARCH_FILTER_PATH,
             )
-            results.append(doc)
+        except Exception as e:
+            return [], e
 
-        return results[:filter.top_k], None
+        ranked_lists = self._ranked_legs(resp["responses"], filter)
+        fused = _reciprocal_rank_fusion(ranked_lists, rank_constant=filter.rank_constant)
+        if not fused:
+            return [], ValueError("No results found.")
 
+        return [self._hydrate(hit["_source"]) for hit in fused[:filter.top_k]], None
 
-    async def _aembed(
+    async def _search_many(
         self,
-        texts: dict[str, str],
-    ) -> Tuple[dict[str, List[float]], Exception | None]:
-        
-        embedding_results: dict[str, List[float]] = {}
+        searches: List[Tuple[str, mdl.SearchFilter]],
+    ) -> Tuple[List[mdl.DocumentT], Exception | None]:
+        """ Runs the lexical and kNN legs of every query in a single msearch and fuses them. """
+        vectors, err = await self._aembed({
+            f"query_vector_{i}": query for i, (query, _) in enumerate(searches)
+        })
+        if err:
+            return [], err
 
-        for key, text in texts.items():
-            try:
-                embeddings = (
-                    await self.embedding_service.embeddings
-                    .create(input=text, model=self.embedding_model)
-                )
-            except Exception as e:
-                return {}, e
+        bodies: List[dict[str, Any]] = []
+        for i, (query, filter) in enumerate(searches):
+            bodies.extend(self._rrf_searches(query, vectors[f"query_vector_{i}"], filter))
+        try:
+            resp = await self.vector_client.msearch(
+                index=self.indexname,
+                searches=bodies,
+                filter_path=MSEARCH_FILTER_PATH,
+            )
+        except Exception as e:
+            return [], e
+
+        ranked_lists: List[List[dict[str, Any]]] = []
+        for i, (_, filter) in enumerate(searches):
+            ranked_lists.extend(self._ranked_legs(resp["responses"][2 * i:2 * i + 2], filter))
+
+        top_k = max(filter.top_k for _, filter in searches)
+        fused = _reciprocal_rank_fusion(ranked_lists, rank_constant=searches[0][1].rank_constant)
+        if not fused:
+            return [], ValueError("No results found.")
+
+        return [self._hydrate(hit["_source"]) for hit in fused[:top_k]], None
+
+    def _rrf_searches(
+        self,
+        query: str,
+        query_vector: List[float],
+        filter: mdl.SearchFilter,
+    ) -> List[dict[str, Any]]:
+        """ Returns the msearch header and body lines of the lexical and the kNN leg of a query. """
+        size = filter.top_k * filter.oversample
+        filter_clauses = [q.to_dict() for q in self._filter_clauses(filter)]
+        lexical = {
+            "query": {
+                "bool": {
+                    "filter": filter_clauses,
+                    "must": [{"match": {"content": {"query": query, "operator": "and"}}}],
+                }
+            },
+            "size": size,
+            "_source": {"excludes": SEARCH_EXCLUDES},
+        }
+        knn = {
+            "knn": {
+                "field": "vector",
+                "query_vector": query_vector,
+                "k": size,
+                "num_candidates": filter.num_candidates or max(size * 2, 50),
+                "filter": filter_clauses,
+            },
+            "size": size,
+            "_source": {"excludes": SEARCH_EXCLUDES},
+        }
+        return [{}, lexical, {}, knn]
+
+    def _ranked_legs(
+        self,
+        responses: List[dict[str, Any]],
+        filter: mdl.SearchFilter,
+    ) -> List[List[dict[str, Any]]]:
+        """ Prunes the hits of the lexical and kNN responses of a query with `filter.stride_score`.
+        kNN hits are compared by their similarity score, lexical hits by their score relative to the best one.
+        A failed leg is logged and left out.
+        """
+        ranked_lists: List[List[dict[str, Any]]] = []
+        for leg, response in zip(("lexical", "knn"), responses):
+            if "error" in response:
+                lg.logger.warning(f"The {leg} leg of the search on {self.indexname} failed: {response['error']}")
+                continue
+
+            hits = response.get("hits", {}).get("hits", [])
+            if leg == "knn":
+                hits = [h for h in hits if (h["_score"] or 0) >= filter.stride_score]
+            elif hits:
+                best = hits[0]["_score"] or 1.0
+                hits = [h for h in hits if (h["_score"] or 0) / best >= filter.stride_score]
+            ranked_lists.append(hits)
+
+        return ranked_lists
+
+    def _filter_clauses(self, filter: mdl.SearchFilter) -> List[dsl.Query]:
+        eff_at: dt.datetime = filter.effective_at
+        filter_clauses = [
+            dsl.Q("bool", must_not=[dsl.Q("term", is_deleted=True), dsl.Q("exists", field="duplicate_of")]),
+            dsl.Q("range", **{"file_meta.effective_from": {"lte": eff_at}}),
+            dsl.Q("range", **{"file_meta.effective_to": {"gte": eff_at}}),
+        ]
+        for tag in filter.tags:
+            filter_clauses.append(dsl.Q("term", tags=tag))
+        return filter_clauses
+
+    def _hydrate(self, source: dict[str, Any]) -> mdl.DocumentT:
+        if self.trusted_hydration:
+            return self.document_class.from_es_source(source)
+        return _type_adapter(self.document_class).validate_python(source)
+
+
+@functools.lru_cache(maxsize=None)
+def _type_adapter(document_class: type[mdl.DocumentT]) -> TypeAdapter[mdl.DocumentT]:
+    return TypeAdapter(document_class)
+
+
+def _join_overlapping(left: str, right: str) -> str:
+    """ Appends `right` to `left`, dropping the start of `right` that `left` already ends with.
+    Overlaps shorter than 16 characters are kept, so a shared trailing word is not mistaken for one.
+    """
+    head = right[:16]
+    start = left.find(head) if head else -1
+    while start != -1:
+        if right.startswith(left[start:]):
+            return left[:start] + right
+        start = left.find(head, start + 1)
+    return f"{left}\n\n{right}"
+
+
+def _covers(canonical: mdl.Document, document: mdl.Document) -> bool:
+    """ Whether every search filter matching `document` also matches `canonical`. """
+    return (
+        set(document.tags) <= set(canonical.tags)
+        and canonical.file_meta.effective_from <= document.file_meta.effective_from
+        and canonical.file_meta.effective_to >= document.file_meta.effective_to
+    )
+
+
+def _file_copy(doc: mdl.DocumentT, file_meta: dict[str, Any], now: dt.datetime) -> mdl.DocumentT:
+    """ Copies the document into the file described by `file_meta`, see `copy_file_documents`.
+    The copy is linked to the canonical document of `doc` if every search matching it also matches `doc`.
+    """
+    new_meta = doc.file_meta.model_copy(update=file_meta)
+    copy = doc.model_copy(update={
+        "document_id": (
+            mdl.make_document_id(new_meta.file_id, doc.page_meta.chunk_index)
+            if doc.page_meta.chunk_index >= 0 else "doc-" + str(uuid.uuid4())
+        ),
+        "file_meta": new_meta,
+        "created_at": now,
+        "updated_at": now,
+    })
+    if _covers(doc, copy):
+        copy.duplicate_of = doc.duplicate_of or doc.document_id
+    return copy
+
+
+def _best_match(
+    signature: str,
+    candidates: Iterable[Tuple[str, str]],
+    threshold: float,
+) -> str | None:
+    """ Returns the id of the candidate most similar to `signature`, if at least `threshold`. """
+    best: str | None = None
+    for candidate_signature, document_id in candidates:
+        score = dedup.similarity(signature, candidate_signature)
+        if score >= threshold:
+            best, threshold = document_id, score
+    return best
+
+
+def _reciprocal_rank_fusion(
+    ranked_lists: List[List[dict[str, Any]]],
+    *,
+    rank_constant: int = 60,
+) -> List[dict[str, Any]]:
+    """ Fuses ranked lists of ES hits by reciprocal rank fusion.
+
+    Each hit scores `sum(1 / (rank_constant + rank))` over the lists it appears in, rank starting at 1.
+
+    Returns:
+        List[dict[str, Any]]: The distinct hits, best fused score first.
+    """
+    scores: dict[str, float] = {}
+    hits: dict[str, dict[str, Any]] = {}
+    for ranked in ranked_lists:
+        for rank, hit in enumerate(ranked, start=1):
+            scores[hit["_id"]] = scores.get(hit["_id"], 0.0) + 1.0 / (rank_constant + rank)
+            hits.setdefault(hit["_id"], hit)
+
+    return [hits[_id] for _id in sorted(scores, key=scores.__getitem__, reverse=True)]
 
-            embedding_results[key] = embeddings.data[0].embedding if embeddings.data else []
 
-        return embedding_results, None
 
 if __name__ == "__main__":
     # Example usage
@@ -0,0 +1,113 @@
+import base64
+import datetime as dt
+import json
+import zlib
+from typing import Any, List, Tuple
+
+import numpy as np
+
+from sqlalchemy import select, delete
+from sqlalchemy.orm import Session
+
+import backend._types as t
+import backend.db.file_tables as tbl
+import backend.utils.logger as lg
+
+
+def load_checkpoint(
+    session: Session,
+    file_id: str,
+    stage: t.IngestionStageLiteral,
+) -> Tuple[Any | None, Exception | None]:
+    """
+    Load the output of a completed ingestion stage of a file.
+
+    Returns:
+        Tuple[Any | None, Exception | None]: The JSON payload of the stage, or None if the stage has not completed.
+    """
+    try:
+        payload = session.execute(
+            select(tbl.IngestionCheckpoint.payload)
+            .where(
+                tbl.IngestionCheckpoint.file_id == file_id,
+                tbl.IngestionCheckpoint.stage == stage,
+            )
+        ).scalar_one_or_none()
+        if payload is None:
+            return None, None
+        data = json.loads(zlib.decompress(payload))
+    except Exception as e:
+        lg.logger.warning(f"Error loading checkpoint {stage} of file {file_id}: {e}")
+        return None, e
+
+    lg.logger.info(f"Resuming file {file_id} from checkpoint {stage}")
+    return data, None
+
+
+def save_checkpoint(
+    session: Session,
+    file_id: str,
+    stage: t.IngestionStageLiteral,
+    data: Any,
+) -> Exception | None:
+    """
+    Persist the output of a completed ingestion stage of a file, replacing a previous one.
+    """
+    payload = zlib.compress(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+    try:
+        session.merge(
+            tbl.IngestionCheckpoint(
+                file_id=file_id,
+                stage=stage,
+                payload=payload,
+                created_at=dt.datetime.now(),
+            )
+        )
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        lg.logger.warning(f"Error saving checkpoint {stage} of file {file_id}: {e}")
+        return e
+
+    lg.logger.info(f"Checkpoint {stage} of file {file_id} saved ({len(payload)} bytes)")
+    return None
+
+
+def clear_checkpoints(
+    session: Session,
+    file_id: str,
+) -> Exception | None:
+    """
+    Delete every checkpoint of a file, once it is vectorized or deleted.
+    """
+    try:
+        session.execute(
+            delete(tbl.IngestionCheckpoint)
+            .where(tbl.IngestionCheckpoint.file_id == file_id)
+        )
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        lg.logger.warning(f"Error clearing checkpoints of file {file_id}: {e}")
+        return e
+
+    return None
+
+
+def pack_vectors(vectors: dict[str, List[float]]) -> dict[str, Any]:
+    """
+    Encode embeddings as a base64 float32 matrix, about 4 times smaller than JSON floats.
+    """
+    ids = list(vectors)
+    matrix = np.asarray([vectors[i] for i in ids], dtype=np.float32)
+    return {
+        "ids": ids,
+        "dims": int(matrix.shape[1]) if ids else 0,
+        "vectors": base64.b64encode(matrix.tobytes()).decode("ascii"),
+    }
+
+
+def unpack_vectors(data: dict[str, Any]) -> dict[str, List[float]]:
+    matrix = np.frombuffer(base64.b64decode(data["vectors"]), dtype=np.float32)
+    matrix = matrix.reshape(len(data["ids"]), data["dims"])
+    return {document_id: row.tolist() for document_id, row in zip(data["ids"], matrix)}
@@ -1,60 +1,26 @@
+import asyncio
 import datetime as dt
+import functools
 import io
-import os
 import json
+import random
 
-from sqlalchemy import select, update, func, insert
+from sqlalchemy import select, update, delete, func, or_
 from sqlalchemy.orm import Session
-from openai import AsyncOpenAI
-from elasticsearch import AsyncElasticsearch
 
-from typing import Literal, Tuple, BinaryIO
+from typing import AsyncIterator, List, Tuple, BinaryIO
 
 import backend.db.file_tables as tbl
 import backend.db.user_tables as user_tbl
 import backend.models as mdl
 import backend.rag as rag
+import backend.services.checkpoints as ckpt
 
 import backend.utils.logger as lg
 import agents.main as agents
 
-def _upsert_vectorize_status(
-    session: Session,
-    request_id: str,
-    file_id: str,
-    status: Literal["gray", "red", "yellow", "green"],
-    is_insert: bool,
-    error_message: str | None = None
-) -> Exception | None:
-    """
-    Upsert the vectorization status of a file.
-    """
-    stmt = (
-        update(tbl.VectorizingFile)
-        .where(tbl.VectorizingFile.file_id == file_id)
-        .values(status=status, error_message=error_message, created_at=dt.datetime.now())
-    )
-    if is_insert:
-        stmt = (
-            insert(tbl.VectorizingFile)
-            .values(
-                vectorizing_id="vec-" + request_id,
-                file_id=file_id,
-                status=status,
-                error_message=error_message
-            )
-        )
-        
-    try:
-        session.execute(stmt)
-        session.commit()
-    except Exception as e:
-        session.rollback()
-        lg.logger.error(f"Error updating vectorize status for file {file_id}: {e}")
-        return e
-
-    return None
-
+from backend.clients import ClientRegistry
+from backend.config import CONFIG
 
 def _get_file(
     session: Session,
@@ -79,6 +45,7 @@ def _get_file(
             func.coalesce(Vectorize.status, 'gray').label("vectorizing_status"),
             File.created_at,
             File.updated_at,
+            File.digest,
         )
         .join(
             User,
@@ -111,28 +78,44 @@ async def upload_file(
     file_content_type: str,
     file_stream: io.BytesIO | BinaryIO,
     user_profile: mdl.User,
-    session: Session
-) -> Exception | None:
+    session: Session,
+    clients: ClientRegistry
+) -> Tuple[bool, Exception | None]:
     """
     Upload a file to the server.
+    The content is hashed while uploading, and a file whose content was already uploaded
+    reuses the existing blob instead of storing it again.
+
+    Returns:
+        Tuple[bool, Exception | None]: Whether the content was a duplicate, and any error.
     """
     name, ext = filename.split(".") if "." in filename else (filename, "txt")
-    url, err = await rag.upload_file(file_stream=file_stream, file_name=file_id, file_extension=ext)
+    uploaded, err = await rag.upload_file(
+        file_stream=file_stream, 
+        file_name=file_id, 
+        file_extension=ext,
+        container_client=clients.container_client,
+        find_duplicate=lambda digest: _find_blob_by_digest(session=session, digest=digest),
+    )
     if err:
         lg.logger.error(f"Error uploading file: {err}")
-        return err
+        return False, err
+
+    if uploaded.is_duplicate:
+        lg.logger.info(f"File {file_id} has the same content as {uploaded.url}, reusing the blob")
     
     new_file = tbl.File(
         file_id=file_id,
-        file_path=url,
+        file_path=uploaded.url,
         file_name=name,
-        file_size=file_size,
+        file_size=uploaded.size if uploaded.size else file_size,
         file_extension=ext,
         file_content_type=file_content_type,
         author_id=user_profile.user_id,
         is_deleted=False,
         created_at=dt.datetime.now(),
         updated_at=dt.datetime.now(),
+        digest=uploaded.digest,
     )
     session.add(new_file)
     try:
@@ -140,9 +123,59 @@ async def upload_file(
     except Exception as e:
         session.rollback()
         print(f"Error committing session: {e}")
-        return e
+        return False, e
     
-    return None
+    return uploaded.is_duplicate, None
+
+
+def _find_blob_by_digest(
+    session: Session,
+    digest: str,
+) -> str | None:
+    """
+    Get the blob URL of a file with the given content digest, if any.
+    """
+    try:
+        return session.execute(
+            select(tbl.File.file_path)
+            .where(
+                tbl.File.digest == digest,
+                tbl.File.is_deleted == False
+            )
+            .limit(1)
+        ).scalar_one_or_none()
+    except Exception as e:
+        lg.logger.warning(f"Error looking up files with digest {digest}: {e}")
+        return None
+
+
+def _find_vectorized_duplicate(
+    session: Session,
+    filedto: mdl.File,
+) -> str | None:
+    """
+    Get the ID of another vectorized file with the same content, whose documents can be copied.
+    """
+    if not filedto.digest:
+        return None
+
+    File = tbl.File
+    Vectorize = tbl.VectorizingFile
+    try:
+        return session.execute(
+            select(File.file_id)
+            .join(Vectorize, Vectorize.file_id == File.file_id)
+            .where(
+                File.digest == filedto.digest,
+                File.file_id != filedto.file_id,
+                File.is_deleted == False,
+                Vectorize.status == "green",
+            )
+            .limit(1)
+        ).scalar_one_or_none()
+    except Exception as e:
+        lg.logger.warning(f"Error looking up vectorized duplicates of file {filedto.file_id}: {e}")
+        return None
 
 
 def get_files(
@@ -167,6 +200,7 @@ def get_files(
             func.coalesce(Vectorize.status, 'gray').label("vectorizing_status"),
             File.created_at,
             File.updated_at,
+            File.digest,
         )
         .join(
             User,
@@ -194,119 +228,336 @@ def get_files(
 
 
 
-async def vectorize_file(
+def enqueue_vectorize(
     user_profile: mdl.User,
     session: Session,
     request_id: str,
-    file_id: str
-) -> Exception | None:
-    lg.logger.info(f"Vectorizing file {file_id} for user {user_profile.user_id}!!")
+    file_id: str,
+) -> Tuple[mdl.VectorizeJob, Exception | None]:
+    """
+    Queue the vectorization of a file. The job is picked up by an ingestion worker, see `backend.worker`.
+    A file has a single job row, so a file that is already queued or running returns its current job,
+    and a finished one is queued again.
+    """
+    _, err = _get_file(session=session, user_profile=user_profile, file_id=file_id)
+    if err:
+        lg.logger.error(f"Error retrieving file {file_id}: {err}")
+        return mdl.VectorizeJob.mock(), err
 
-    openai = AsyncOpenAI()
-    vector_client = AsyncElasticsearch(
-        hosts=os.getenv("ELASTICSEARCH_HOSTS", "http://localhost:9200"),
-        api_key=os.getenv("ELASTICSEARCH_API_KEY", "")
-    )
-    cache = rag.AsyncCacheService()
-    indexname = "document"
+    Vectorize = tbl.VectorizingFile
+    now = dt.datetime.now()
+    try:
+        job = session.execute(
+            select(Vectorize)
+            .where(Vectorize.file_id == file_id)
+            .with_for_update()
+        ).scalars().first()
+
+        if job is None:
+            job = tbl.VectorizingFile(
+                vectorizing_id="vec-" + request_id,
+                file_id=file_id,
+                created_at=now,
+            )
+            session.add(job)
+        elif job.status == "yellow":
+            lg.logger.info(f"File {file_id} is already queued as job {job.vectorizing_id}")
+            session.commit()
+            return _to_job(job), None
+
+        job.status = "yellow"
+        job.error_message = None
+        job.user_id = user_profile.user_id
+        job.attempts = 0
+        job.max_attempts = CONFIG.INGESTION_MAX_ATTEMPTS
+        job.run_after = now
+        job.locked_by = None
+        job.locked_at = None
+        job.updated_at = now
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        lg.logger.error(f"Error queueing vectorization of file {file_id}: {e}")
+        return mdl.VectorizeJob.mock(), e
 
-    filedto, err = _get_file(session=session, user_profile=user_profile, file_id=file_id)
+    lg.logger.info(f"File {file_id} queued as job {job.vectorizing_id}")
+    return _to_job(job), None
+
+
+def get_vectorize_job(
+    user_profile: mdl.User,
+    session: Session,
+    file_id: str,
+) -> Tuple[mdl.VectorizeJob, Exception | None]:
+    """
+    Get the vectorization job of a file.
+    """
+    _, err = _get_file(session=session, user_profile=user_profile, file_id=file_id)
     if err:
         lg.logger.error(f"Error retrieving file {file_id}: {err}")
-        err = _upsert_vectorize_status(
-            session=session,
-            request_id=request_id, 
-            file_id=file_id, 
-            status="red", 
-            is_insert=False,
-            error_message=f"Error vectorizing file {file_id}: {err}",
+        return mdl.VectorizeJob.mock(), err
+
+    try:
+        job = session.execute(
+            select(tbl.VectorizingFile)
+            .where(tbl.VectorizingFile.file_id == file_id)
+        ).scalars().first()
+    except Exception as e:
+        lg.logger.error(f"Error retrieving vectorization job of file {file_id}: {e}")
+        return mdl.VectorizeJob.mock(), e
+
+    if job is None:
+        return mdl.VectorizeJob.mock(), ValueError(f"File {file_id} has never been vectorized.")
+
+    return _to_job(job), None
+
+
+def claim_vectorize_job(
+    session: Session,
+    worker_id: str,
+    lease_seconds: float,
+) -> Tuple[tbl.VectorizingFile | None, Exception | None]:
+    """
+    Lock the next due job for the worker.
+    Rows locked by other workers are skipped, so any number of worker processes can poll the same table.
+    A running job whose lock is older than `lease_seconds` is considered abandoned and is claimed again.
+    Jobs without a `user_id` cannot run on behalf of anyone and are never claimed.
+
+    Returns:
+        Tuple[tbl.VectorizingFile | None, Exception | None]: The claimed job, or None if no job is due.
+    """
+    Vectorize = tbl.VectorizingFile
+    now = dt.datetime.now()
+    stmt = (
+        select(Vectorize)
+        .where(
+            Vectorize.status == "yellow",
+            Vectorize.run_after <= now,
+            Vectorize.user_id.is_not(None),
+            or_(
+                Vectorize.locked_by.is_(None),
+                Vectorize.locked_at < now - dt.timedelta(seconds=lease_seconds),
+            )
         )
-        if err:
-            lg.logger.error(f"Error updating vectorize status: {err}")
-        
-        return err
+        .order_by(Vectorize.run_after)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    try:
+        job = session.execute(stmt).scalars().first()
+        if job is not None:
+            job.locked_by = worker_id
+            job.locked_at = now
+            job.attempts += 1
+            job.updated_at = now
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        lg.logger.error(f"Error claiming a vectorization job: {e}")
+        return None, e
 
-    err = _upsert_vectorize_status(
-        session=session,
-        request_id=request_id, 
-        file_id=file_id, 
-        status="yellow", 
-        is_insert=True,
-        error_message=None,
+    return job, None
+
+
+def renew_vectorize_job(
+    session: Session,
+    job_id: str,
+    worker_id: str,
+) -> Tuple[bool, Exception | None]:
+    """
+    Extend the lease of a running job, so it is not claimed again while its worker is alive.
+
+    Returns:
+        Tuple[bool, Exception | None]: False if the job is no longer locked by the worker, and any error that occurred.
+    """
+    now = dt.datetime.now()
+    try:
+        result = session.execute(
+            update(tbl.VectorizingFile)
+            .where(
+                tbl.VectorizingFile.vectorizing_id == job_id,
+                tbl.VectorizingFile.locked_by == worker_id,
+            )
+            .values(locked_at=now, updated_at=now)
+        )
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        lg.logger.error(f"Error renewing the lease of vectorization job {job_id}: {e}")
+        return True, e
+
+    return result.rowcount > 0, None # type: ignore
+
+
+def finish_vectorize_job(
+    session: Session,
+    job_id: str,
+    worker_id: str,
+    err: Exception | None,
+    message: str | None = None,
+    retry_backoff: float = 30.0,
+) -> Exception | None:
+    """
+    Record the outcome of an attempt and release the job.
+    Nothing is recorded if the job is no longer locked by `worker_id`, e.g. its lease expired and another worker claimed it.
+    A failed attempt is retried after `retry_backoff * 2 ** (attempts - 1)` seconds, with 10% jitter,
+    until `max_attempts` is reached, at which point the job turns red.
+    """
+    try:
+        job = session.execute(
+            select(tbl.VectorizingFile)
+            .where(
+                tbl.VectorizingFile.vectorizing_id == job_id,
+                tbl.VectorizingFile.locked_by == worker_id,
+            )
+            .with_for_update()
+        ).scalars().first()
+        if job is None:
+            session.rollback()
+            return ValueError(f"Job {job_id} is no longer locked by worker {worker_id}.")
+
+        now = dt.datetime.now()
+        job.locked_by = None
+        job.locked_at = None
+        job.updated_at = now
+        if err is None:
+            job.status = "green"
+            job.error_message = message
+        elif job.attempts < job.max_attempts:
+            delay = retry_backoff * 2 ** (job.attempts - 1)
+            job.run_after = now + dt.timedelta(seconds=delay * random.uniform(1.0, 1.1))
+            job.error_message = f"Attempt {job.attempts} of {job.max_attempts} failed, retrying: {err}"
+        else:
+            job.status = "red"
+            job.error_message = f"Error vectorizing file {job.file_id}: {err}"
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        lg.logger.error(f"Error finishing vectorization job {job_id}: {e}")
+        return e
+
+    return None
+
+
+def get_job_user(
+    session: Session,
+    user_id: str,
+) -> Tuple[mdl.User, Exception | None]:
+    """
+    Get the profile of the user a job runs on behalf of.
+    """
+    User = user_tbl.User
+    stmt = (
+        select(
+            User.user_id,
+            User.username,
+            User.email,
+            User.is_superuser,
+        )
+        .where(User.user_id == user_id)
     )
+    try:
+        user = session.execute(stmt).mappings().one()
+    except Exception as e:
+        lg.logger.error(f"Error retrieving user {user_id}: {e}")
+        return mdl.User(user_id=user_id, username="unknown"), e
+
+    return mdl.User.model_validate(dict(user)), None
+
+
+def _to_job(job: tbl.VectorizingFile) -> mdl.VectorizeJob:
+    return mdl.VectorizeJob(
+        job_id=job.vectorizing_id,
+        file_id=job.file_id,
+        status=job.status, # type: ignore
+        is_running=job.locked_by is not None,
+        attempts=job.attempts,
+        max_attempts=job.max_attempts,
+        error_message=job.error_message,
+        run_after=job.run_after,
+        created_at=job.created_at,
+        updated_at=job.updated_at,
+    )
+
+
+async def vectorize_file(
+    user_profile: mdl.User,
+    session: Session,
+    file_id: str,
+    clients: ClientRegistry
+) -> Tuple[str | None, Exception | None]:
+    """
+    Run the ingestion pipeline of a file: read, format, analyze, embed and index.
+    The stages run concurrently on a stream of pages and document batches, see `_ingest`.
+    Called by the ingestion workers, which own the job status. Documents left by a previous attempt
+    are deleted first, so a retried job does not index the file twice.
+
+    The output of every stage is checkpointed per file, so a retry resumes after the last completed
+    stage instead of paying again for OCR, tagging and embedding. The checkpoints are cleared once
+    the file is indexed. A file with the same content as an already vectorized file copies its
+    documents and vectors instead.
+
+    Returns:
+        Tuple[str | None, Exception | None]: A message describing partial failures, if any, and the error.
+    """
+    lg.logger.info(f"Vectorizing file {file_id} for user {user_profile.user_id}!!")
+
+    indexname = "document"
+
+    filedto, err = _get_file(session=session, user_profile=user_profile, file_id=file_id)
     if err:
-        lg.logger.error(f"Error updating vectorize status: {err}")
-        return err
+        lg.logger.error(f"Error retrieving file {file_id}: {err}")
+        return None, err
 
     lg.logger.info(f"File {file_id} found: {filedto.file_name}")
-
-    pages, err = await rag.format_file(filedto.file_path)
+    vector_store = await clients.vector_store(indexname)
+    err = await _clear_documents(session=session, file_id=file_id, vector_store=vector_store)
     if err:
-        lg.logger.error(f"Error vectorizing file {file_id}: {err}")
-        err = _upsert_vectorize_status(
-            session=session,
-            request_id=request_id, 
-            file_id=file_id, 
-            status="red", 
-            is_insert=False,
-            error_message=f"Error vectorizing file {file_id}: {err}",
+        return None, err
+
+    duplicate_id = _find_vectorized_duplicate(session=session, filedto=filedto)
+    if duplicate_id:
+        success, err = await vector_store.copy_file_documents(
+            duplicate_id,
+            file_meta={
+                "file_id": file_id,
+                "file_path": filedto.file_path,
+                "file_name": filedto.file_name,
+                "file_extension": filedto.file_extension,
+            },
         )
-        if err:
-            lg.logger.error(f"Error updating vectorize status: {err}")
-        return err
+        if success and not err:
+            lg.logger.info(f"Copied {len(success)} documents of file {duplicate_id} with the same content")
+            return _insert_documents(session=session, file_id=file_id, document_ids=success)
 
+        lg.logger.warning(f"Error copying documents of file {duplicate_id}, vectorizing from scratch: {err}")
+        err = await _clear_documents(session=session, file_id=file_id, vector_store=vector_store)
+        if err:
+            return None, err
 
-    lg.logger.info(f"Pages {len(pages)} formatted")
-    documents, err = await rag.analyze(
-        pages, 
-        ai=agents.AsyncSimpleAgent(provider=openai), 
-        file=filedto,
-        split_func=rag.split_by_header
+    partial_message, err = await _ingest(
+        session=session,
+        filedto=filedto,
+        clients=clients,
+        vector_store=vector_store,
     )
-    
     if err:
-        lg.logger.error(f"Error analyzing documents: {err}")
-        err = _upsert_vectorize_status(
-            session=session,
-            request_id=request_id, 
-            file_id=file_id, 
-            status="red", 
-            is_insert=False,
-            error_message=f"Error vectorizing file {file_id}: {err}",
-        )
-        if err:
-            lg.logger.error(f"Error updating vectorize status: {err}")
+        lg.logger.error(f"Error ingesting file {file_id}: {err}")
+        return None, err
 
-        return err
+    ckpt.clear_checkpoints(session=session, file_id=file_id)
+    return partial_message, None
 
-    lg.logger.info(f"Documents {len(documents)} analyzed")
-    lg.logger.info(f"Adding {len(documents)} documents to vector store")
-    async with vector_client as client:
-        vector_store = await rag.VectorStore.create(
-            vector_client=client,
-            embedding_service=openai,
-            cache_service=cache,
-            indexname=indexname,
-            document_class=rag.Document
-        )
-        success, err = await vector_store.add_documents(documents)
-        if err:
-            err = _upsert_vectorize_status(
-                session=session,
-                request_id=request_id, 
-                file_id=file_id, 
-                status="red", 
-                is_insert=False,
-                error_message=f"Error vectorizing file {file_id}: {err}",
-            )
-            if err:
-                lg.logger.error(f"Error updating vectorize status: {err}")
-            return err
-    
+
+def _insert_documents(
+    session: Session,
+    file_id: str,
+    document_ids: List[str],
+) -> Tuple[str | None, Exception | None]:
     success_doc = []
-    for s in success:
+    for document_id in document_ids:
         doc = tbl.Document(
-            document_id=s,
+            document_id=document_id,
             file_id=file_id,
         )
         success_doc.append(doc)
@@ -315,27 +566,272 @@ async def vectorize_file(
         session.add_all(success_doc)
         session.commit()
     except Exception as e:
+        session.rollback()
         lg.logger.error(f"Error adding documents to session: {e}")
-        return e
+        return None, e
 
-    err = _upsert_vectorize_status(
-        session=session,
-        request_id=request_id, 
-        file_id=file_id, 
-        status="green", 
-        is_insert=False,
-        error_message=None
-    )
+    return None, None
+
+
+async def _ingest(
+    session: Session,
+    filedto: mdl.File,
+    clients: ClientRegistry,
+    vector_store: rag.BaseVectorStore,
+) -> Tuple[str | None, Exception | None]:
+    """
+    Stream the file through the tag, embed and index stages, connected by bounded queues.
+
+    A batch of documents is embedded as soon as it is tagged and indexed as soon as it is embedded,
+    so the first chunks are searchable while later pages are still being tagged, and at most
+    `INGESTION_QUEUE_SIZE` batches wait between two stages. Batches waiting for the embedder are merged
+    up to the embeddings batch size. Indexed documents are recorded per batch, so `_clear_documents`
+    knows about everything a failed attempt indexed.
+
+    Before embedding, near-duplicates of indexed chunks or of earlier chunks of the file are linked to
+    them instead of embedded, see `VectorStore.link_duplicates`.
+
+    The tagged documents are checkpointed once tagging completes, and their vectors once embedding
+    stops, so a retry resumes with the same document ids and only embeds what is missing.
+
+    Returns:
+        Tuple[str | None, Exception | None]: A message describing partial failures, if any, and the error.
+    """
+    file_id = filedto.file_id
+    to_embed: asyncio.Queue[List[rag.Document] | None] = asyncio.Queue(maxsize=CONFIG.INGESTION_QUEUE_SIZE)
+    to_index: asyncio.Queue[List[rag.Document] | None] = asyncio.Queue(maxsize=CONFIG.INGESTION_QUEUE_SIZE)
+
+    vectors: dict[str, List[float]] = {}
+    packed, _ = ckpt.load_checkpoint(session=session, file_id=file_id, stage="embeddings")
+    if packed is not None:
+        vectors = ckpt.unpack_vectors(packed)
+
+    documents_checkpointed = False
+    total = indexed = 0
+    failures: dict[str, Exception] = {}
+
+    async def tag() -> None:
+        nonlocal documents_checkpointed, total
+        checkpointed, _ = ckpt.load_checkpoint(session=session, file_id=file_id, stage="documents")
+        if checkpointed is not None:
+            documents_checkpointed = True
+            step = vector_store.embedding_config.batch_size
+            for start in range(0, len(checkpointed), step):
+                batch = [rag.Document.model_validate(doc) for doc in checkpointed[start:start + step]]
+                total += len(batch)
+                await to_embed.put(batch)
+        else:
+            documents: List[rag.Document] = []
+            async for batch in rag.analyze_stream(
+                _page_stream(session=session, filedto=filedto, clients=clients),
+                ai=agents.AsyncSimpleAgent(provider=clients.openai),
+                file=filedto,
+                split_func=functools.partial(
+                    rag.split_by_tokens,
+                    max_tokens=CONFIG.CHUNK_MAX_TOKENS,
+                    overlap_tokens=CONFIG.CHUNK_OVERLAP_TOKENS,
+                    model=vector_store.embedding_model,
+                ),
+                concurrency=CONFIG.TAGGING_CONCURRENCY,
+                timeout=CONFIG.TAGGING_TIMEOUT,
+                batch_tokens=CONFIG.TAGGING_BATCH_TOKENS,
+                batch_size=CONFIG.TAGGING_BATCH_SIZE,
+            ):
+                documents.extend(batch)
+                total += len(batch)
+                await to_embed.put(batch)
+
+            lg.logger.info(f"Documents {len(documents)} analyzed")
+            ckpt.save_checkpoint(
+                session=session,
+                file_id=file_id,
+                stage="documents",
+                data=[doc.model_dump(mode="json") for doc in documents],
+            )
+            documents_checkpointed = True
+
+        await to_embed.put(None)
+
+    async def embed() -> None:
+        embedded = False
+        linked = 0
+        seen: rag.SignatureIndex[rag.Document] = rag.SignatureIndex()
+        try:
+            while (batch := await _next_batch(to_embed, vector_store.embedding_config.batch_size)) is not None:
+                if CONFIG.DEDUP_THRESHOLD > 0:
+                    duplicates, err = await vector_store.link_duplicates(
+                        batch, threshold=CONFIG.DEDUP_THRESHOLD, local=seen,
+                    )
+                    if err:
+                        lg.logger.warning(f"Near-duplicate lookup failed for file {file_id}: {err}")
+                    linked += len(duplicates)
+                else:
+                    for doc in batch:
+                        doc.duplicate_of = None
+
+                missing = [doc for doc in batch if not doc.duplicate_of and doc.document_id not in vectors]
+                if missing:
+                    # Documents that fail to embed are left out, and reported by `add_documents`.
+                    fresh, err = await vector_store.embed_documents(missing)
+                    if err and not isinstance(err, rag.EmbeddingError):
+                        raise err
+                    vectors.update(fresh)
+                    embedded = embedded or bool(fresh)
+                for doc in batch:
+                    if doc.signature and not doc.duplicate_of and doc.document_id in vectors:
+                        seen.add(doc.signature, doc)
+                await to_index.put(batch)
+            await to_index.put(None)
+            if linked:
+                lg.logger.info(f"Linked {linked} near-duplicate documents of file {file_id}")
+        finally:
+            if embedded and documents_checkpointed:
+                ckpt.save_checkpoint(
+                    session=session, file_id=file_id, stage="embeddings", data=ckpt.pack_vectors(vectors)
+                )
+
+    async def index() -> None:
+        nonlocal indexed
+        while (batch := await to_index.get()) is not None:
+            success, err = await vector_store.add_documents(batch, vectors=vectors)
+            if isinstance(err, rag.IndexingError):
+                failures.update(err.failures)
+            elif err:
+                raise err
+
+            _, err = _insert_documents(session=session, file_id=file_id, document_ids=success)
+            if err:
+                raise err
+            indexed += len(success)
+            lg.logger.info(f"Indexed {indexed} documents of file {file_id}")
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            group.create_task(tag())
+            group.create_task(embed())
+            group.create_task(index())
+    except BaseExceptionGroup as eg:
+        return None, eg.exceptions[0]
+
+    if failures:
+        for document_id, failure in failures.items():
+            lg.logger.warning(f"Document {document_id} of file {file_id} failed to index: {failure}")
+        if not indexed:
+            return None, rag.IndexingError(failures)
+        return f"{len(failures)} of {total} documents failed to index.", None
+
+    return None, None
+
+
+async def _next_batch(
+    queue: asyncio.Queue[List[rag.Document] | None],
+    limit: int,
+) -> List[rag.Document] | None:
+    """
+    Wait for a batch, then merge the batches already queued, up to `limit` documents.
+    Returns None once the queue is closed with None.
+    """
+    batch = await queue.get()
+    if batch is None:
+        return None
+
+    batch = list(batch)
+    while len(batch) < limit and not queue.empty():
+        more = queue.get_nowait()
+        if more is None:
+            queue.put_nowait(None)
+            break
+        batch.extend(more)
+
+    return batch
+
+
+async def _page_stream(
+    session: Session,
+    filedto: mdl.File,
+    clients: ClientRegistry,
+) -> AsyncIterator[rag.FormattedPage]:
+    """
+    Read the file with OCR and yield its markdown pages, resuming from the checkpoints.
+    With an OCR cache, identical bytes are analyzed once. Files uploaded before digests were recorded
+    are downloaded and hashed first. Raises the error of the OCR call.
+    """
+    file_id = filedto.file_id
+    pages, _ = ckpt.load_checkpoint(session=session, file_id=file_id, stage="pages")
+    if pages is not None:
+        for number, content in enumerate(pages, start=1):
+            yield rag.FormattedPage(content=content, number=number, total_pages=len(pages))
+        return
+
+    analyze_result, _ = ckpt.load_checkpoint(session=session, file_id=file_id, stage="analyze_result")
+    if analyze_result is None:
+        content: bytes | None = None
+        if clients.ocr_cache is not None and not filedto.digest:
+            content, err = await rag.download_file(
+                filedto.file_id,
+                filedto.file_extension,
+                container_client=clients.container_client,
+            )
+            if err:
+                lg.logger.warning(f"Error downloading file {file_id}, skipping the OCR cache: {err}")
+                content = None
+
+        result, err = await rag.read(
+            filedto.file_path,
+            content=content,
+            digest=filedto.digest,
+            cache=clients.ocr_cache,
+        )
+        if err or not result:
+            raise err or ValueError(f"No analysis result for file {file_id}.")
+        analyze_result = result.as_dict()
+        ckpt.save_checkpoint(session=session, file_id=file_id, stage="analyze_result", data=analyze_result)
+
+    formatted: List[str] = []
+    async for page in rag.iter_pages(analyze_result):
+        formatted.append(page.content)
+        yield page
+
+    lg.logger.info(f"Pages {len(formatted)} formatted")
+    ckpt.save_checkpoint(session=session, file_id=file_id, stage="pages", data=formatted)
+
+
+async def _clear_documents(
+    session: Session,
+    file_id: str,
+    vector_store: rag.BaseVectorStore,
+) -> Exception | None:
+    """
+    Delete the indexed documents of a file, e.g. those left by a failed attempt.
+    """
+    document_ids = list(session.execute(
+        select(tbl.Document.document_id)
+        .where(tbl.Document.file_id == file_id)
+    ).scalars())
+    if not document_ids:
+        return None
+
+    lg.logger.info(f"Deleting {len(document_ids)} previous documents of file {file_id}")
+    _, err = await vector_store.delete_by_ids(ids=document_ids)
     if err:
-        lg.logger.error(f"Error updating vectorize status: {err}")
+        lg.logger.error(f"Error deleting previous documents of file {file_id}: {err}")
         return err
-    return None 
+
+    try:
+        session.execute(delete(tbl.Document).where(tbl.Document.file_id == file_id))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        return e
+
+    return None
 
 
 async def delete_file(
     user_profile: mdl.User,
     session: Session,
-    file_id: str
+    file_id: str,
+    clients: ClientRegistry
 ) -> Exception | None:
     lg.logger.info(f"Deleting file {file_id} for user {user_profile.user_id}!!")
     
@@ -365,23 +861,14 @@ async def delete_file(
     if len(to_delete_vector) > 0:
         lg.logger.info(f"Deleting {len(to_delete_vector)} documents from vector store")
 
-        vector_client = AsyncElasticsearch(
-            hosts=os.getenv("ELASTICSEARCH_HOSTS", "http://localhost:9200"),
-            api_key=os.getenv("ELASTICSEARCH_API_KEY", "")
+        vector_store = await clients.vector_store("document")
+        success, err = await vector_store.delete_by_ids(
+            ids=to_delete_vector
         )
-        async with vector_client as client:
-            vector_store = await rag.VectorStore.create(
-                vector_client=client,
-                embedding_service=AsyncOpenAI(),
-                cache_service=rag.AsyncCacheService(),
-                indexname="document",
-                document_class=rag.Document
-            )
-            success, err = await vector_store.delete_by_ids(
-                ids=to_delete_vector
-            )
-            if err:
-                lg.logger.error(f"Error Deleting documents to vector store: {err}")
+        if err:
+            lg.logger.error(f"Error Deleting documents to vector store: {err}")
+
+    ckpt.clear_checkpoints(session=session, file_id=file_id)
 
     soft_delete = (
         update(tbl.File)
@@ -1,62 +1,46 @@
-import os
 from typing import List, Tuple, Any, cast
 
-from elasticsearch import AsyncElasticsearch
-from openai import AsyncOpenAI
-
 import backend.models as mdl
 import backend.rag as rag
-import backend.config as cfg
+
+from backend.clients import get_clients
+from backend.config import CONFIG
 
 async def rag_tool(
-    query: str,
+    queries: List[str],
     tags: str
 ) -> str: 
     """
     ## RAG Tool
-    이 도구는 주어진 쿼리와 태그를 사용하여 RAG(정보 검색 및 생성) 시스템에서 문서를 검색합니다.
+    이 도구는 주어진 쿼리들과 태그를 사용하여 RAG(정보 검색 및 생성) 시스템에서 문서를 검색합니다.
     반드시 쿼리는 간결하고 명확해야 하며, 유저의 지난 질문들에서 핵심 정보들로만 추출해야 합니다.
     검색할 때 필요하지 않은 키워드들은 과감히 제거하세요. 예를들어 `내부`, `문서`와 같은 단어들은 제거해야 합니다.
+    질문에 여러 측면이 있다면 도구를 여러 번 호출하지 말고, 측면마다 하나의 쿼리를 만들어 `queries`에 함께 넣으세요.
 
     ## 좋은 예시
-    - `내부 문서에서 사이냅소프트에 관한 정보를 찾아줘` -> `사이냅소프트에 관한 정보`
+    - `내부 문서에서 사이냅소프트에 관한 정보를 찾아줘` -> `["사이냅소프트에 관한 정보"]`
+    - `사이냅소프트의 매출과 주요 제품을 알려줘` -> `["사이냅소프트 매출", "사이냅소프트 주요 제품"]`
 
     """
-    
-    vector_client = AsyncElasticsearch(
-        hosts=cfg.CONFIG.ELASTICSEARCH_HOSTS,
-        api_key=cfg.CONFIG.ELASTICSEARCH_API_KEY
-    )
-    embedding_service = AsyncOpenAI()
-    cache_service = rag.AsyncCacheService()
-    indexname = "document"
-    
-    async with vector_client as client:
-        vector_store = await rag.VectorStore.create(
-            vector_client=client,
-            embedding_service=embedding_service,
-            cache_service=cache_service,
-            indexname=indexname,
-            document_class=rag.Document
+    if isinstance(queries, str):
+        queries = [queries]
+
+    clients = await get_clients()
+    vector_store = await clients.vector_store("document")
+
+    # Search for documents
+    filter = rag.SearchFilter(top_k=5, tags=[tags], neighbors=CONFIG.RAG_NEIGHBOR_CHUNKS)
+    results, err = cast(
+        Tuple[List[rag.Document], Exception | None],
+        await vector_store.search_many(
+            queries,
+            filter
         )
-        
-        # Search for documents
-        filter = rag.SearchFilter(top_k=5, tags=[tags])
-        results, err = cast(
-            Tuple[List[rag.Document], Exception | None],
-            await vector_store.search(
-                query,
-                filter
-            )
-        )
-        if err:
-            return ""
-    
-    rag_description = ""
-    for r in results:
-        rag_description += r.to_desription()
+    )
+    if err:
+        return ""
 
-    return rag_description
+    return rag.pack_context(results, max_tokens=CONFIG.RAG_CONTEXT_TOKENS)
 
 
 TOOL_MAP = {
@@ -0,0 +1,210 @@
+""" Ingestion workers running the queued vectorization jobs.
+
+`POST /files/{file_id}/vectorize` only queues a job in the `vectorizing_file` table.
+Workers claim due jobs with `SELECT ... FOR UPDATE SKIP LOCKED`, run the pipeline and record the outcome,
+retrying failed jobs with exponential backoff. Throughput scales with `INGESTION_CONCURRENCY`
+and the number of worker processes, independently of the API.
+While a job runs, its worker renews the lease every third of `INGESTION_LEASE_SECONDS`,
+so only the jobs of dead workers are claimed again.
+
+The API runs a worker in process unless `INGESTION_IN_PROCESS=false`. To run workers separately:
+    python -m backend.worker
+"""
+import asyncio
+import os
+import signal
+import socket
+import uuid
+from typing import List, Tuple
+
+from sqlalchemy.orm import Session
+
+import backend.config as cfg
+import backend.db.engine as db
+import backend.services.file as svc
+import backend.utils.logger as lg
+
+from backend.clients import ClientRegistry, aopen_clients, aclose_clients
+
+
+class IngestionWorker:
+    """ Pool of `concurrency` asyncio tasks, each polling for a job and running it to completion. """
+
+    def __init__(
+        self,
+        *,
+        concurrency: int = 2,
+        poll_interval: float = 2.0,
+        lease_seconds: float = 1800.0,
+        retry_backoff: float = 30.0,
+        worker_id: str | None = None,
+    ) -> None:
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.retry_backoff = retry_backoff
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+
+    @classmethod
+    def from_config(cls, config: cfg.Config = cfg.CONFIG) -> "IngestionWorker":
+        return cls(
+            concurrency=config.INGESTION_CONCURRENCY,
+            poll_interval=config.INGESTION_POLL_INTERVAL,
+            lease_seconds=config.INGESTION_LEASE_SECONDS,
+            retry_backoff=config.INGESTION_RETRY_BACKOFF,
+        )
+
+    def start(self, clients: ClientRegistry) -> None:
+        """ Starts the pool on the running event loop. """
+        if self._tasks:
+            return
+
+        self._stopping.clear()
+        self._tasks = [
+            asyncio.create_task(self._run(clients, slot), name=f"ingestion-{slot}")
+            for slot in range(self.concurrency)
+        ]
+        lg.logger.info(f"Ingestion worker {self.worker_id} started with {self.concurrency} slots")
+
+    async def stop(self) -> None:
+        """ Stops polling and cancels the running jobs. Cancelled jobs are released for a retry. """
+        self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        lg.logger.info(f"Ingestion worker {self.worker_id} stopped")
+
+    async def _run(self, clients: ClientRegistry, slot: int) -> None:
+        while not self._stopping.is_set():
+            try:
+                ran = await self._run_once(clients)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                lg.logger.error(f"Ingestion slot {slot} of worker {self.worker_id} failed: {e}")
+                ran = False
+
+            if not ran:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _run_once(self, clients: ClientRegistry) -> bool:
+        """ Claims and runs one job. Returns False if no job was due. """
+        session = db.SessionLocal()
+        try:
+            job, err = svc.claim_vectorize_job(
+                session=session,
+                worker_id=self.worker_id,
+                lease_seconds=self.lease_seconds,
+            )
+            if err or job is None:
+                return False
+
+            job_id, file_id, user_id = job.vectorizing_id, job.file_id, job.user_id
+            lg.logger.info(f"Worker {self.worker_id} running job {job_id} (attempt {job.attempts}/{job.max_attempts})")
+
+            run = asyncio.create_task(self._vectorize(session, clients, file_id, user_id or ""))
+            heartbeat = asyncio.create_task(self._heartbeat(job_id))
+            try:
+                await asyncio.wait([run, heartbeat], return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError:
+                run.cancel()
+                heartbeat.cancel()
+                await asyncio.gather(run, heartbeat, return_exceptions=True)
+                svc.finish_vectorize_job(
+                    session=session,
+                    job_id=job_id,
+                    worker_id=self.worker_id,
+                    err=RuntimeError("Worker stopped during the job."),
+                    retry_backoff=0,
+                )
+                raise
+
+            if not run.done():
+                # The heartbeat only returns once another worker owns the job, which now runs it again.
+                run.cancel()
+                await asyncio.gather(run, return_exceptions=True)
+                lg.logger.error(f"Worker {self.worker_id} lost the lease of job {job_id}, abandoning it")
+                return True
+
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            message: str | None = None
+            try:
+                message, err = run.result()
+            except Exception as e:
+                err = e
+
+            if err:
+                lg.logger.error(f"Job {job_id} of file {file_id} failed: {err}")
+            else:
+                lg.logger.info(f"Job {job_id} of file {file_id} succeeded")
+
+            finish_err = svc.finish_vectorize_job(
+                session=session,
+                job_id=job_id,
+                worker_id=self.worker_id,
+                err=err,
+                message=message,
+                retry_backoff=self.retry_backoff,
+            )
+            if finish_err:
+                lg.logger.error(f"Error recording the outcome of job {job_id}: {finish_err}")
+            return True
+        finally:
+            session.close()
+
+    async def _vectorize(
+        self,
+        session: Session,
+        clients: ClientRegistry,
+        file_id: str,
+        user_id: str,
+    ) -> Tuple[str | None, Exception | None]:
+        user_profile, err = svc.get_job_user(session=session, user_id=user_id)
+        if err:
+            return None, err
+        return await svc.vectorize_file(
+            user_profile=user_profile,
+            session=session,
+            file_id=file_id,
+            clients=clients,
+        )
+
+    async def _heartbeat(self, job_id: str) -> None:
+        """ Renews the lease of the job every third of `lease_seconds`. Returns once the job is no longer ours. """
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            session = db.SessionLocal()
+            try:
+                renewed, err = svc.renew_vectorize_job(session=session, job_id=job_id, worker_id=self.worker_id)
+            finally:
+                session.close()
+            if not err and not renewed:
+                return
+
+
+async def main() -> None:
+    clients = await aopen_clients()
+    worker = IngestionWorker.from_config()
+    worker.start(clients)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await stop.wait()
+    finally:
+        await worker.stop()
+        await aclose_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())